@@ -0,0 +1,1010 @@
+"""
+Офлайн-бенчмарк жизненного цикла тикета.
+
+Гоняет MainNavigationView -> MapSelect -> TierSelect -> RoleSelect -> кнопки тикета
+(занятие, уход, повторное занятие слотов до полного сбора), MissionStartView (Каскад),
+гонки нажатий на одном тикете, очереди на занятые слоты, индекс списка !lfg, сверку канала с базой, плавный перезапуск с передачей состояния, всплеск очереди авто-подбора (Matchmaker) и объем кэша шлюза в обычном режиме и LEAN_MODE
+против локальной заглушки Discord: фейковые Interaction, Message и TextChannel
+считают REST-вызовы вместо отправки их в сеть. Токен и сеть не нужны.
+
+С --live-map текущая карта Арбитража берется из локального файла состояния мира
+(FileWorldStateProvider), и навигация сразу открывает выбор слота.
+
+Запуск:  python bench_tickets.py --tickets 500 --concurrency 50 [--rest-latency 5] [--live-map] [--json bench_output.txt]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from types import SimpleNamespace
+
+from aiohttp import ClientSession
+
+# Изолируем бенчмарк от рабочих данных бота: база в памяти, настройки во временной папке
+_WORKDIR = tempfile.mkdtemp(prefix='lfg-bench-')
+os.environ['TICKETS_DB'] = ':memory:'
+os.environ['GUILD_CONFIG_DIR'] = os.path.join(_WORKDIR, 'guild_configs')
+os.environ.setdefault('BOT_TOKEN', 'bench')
+os.environ['WORLDSTATE_URL'] = ''  # без сети: источник состояния мира подключается только через --live-map
+
+import bot_host  # noqa: E402
+
+GUILD_ID = 1 << 40
+_snowflakes = itertools.count(1 << 42)
+
+
+# =================================================================
+# ЗАГЛУШКА DISCORD
+# =================================================================
+
+class FakeTransport:
+    """Считает REST-вызовы и (опционально) имитирует задержку сети."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def call(self, route: str):
+        self.calls[route] += 1
+        await asyncio.sleep(self.latency)  # и без задержки запрос отдает управление циклу, как настоящий REST
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.display_name = f"Tenno{user_id % 100000}"
+        self.mention = f"<@{user_id}>"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+
+
+class FakeMessage:
+    def __init__(self, transport: FakeTransport, channel: 'FakeChannel', content=None, embed=None, view=None, message_id=None):
+        self.transport = transport
+        self.channel = channel
+        self.id = message_id or next(_snowflakes)
+        self.content = content
+        self.embeds = [embed] if embed else []
+        self.view = view
+        self.author = None
+        self.components = []
+
+    async def edit(self, content=None, embed=None, view=None, **kwargs):
+        await self.transport.call('message.edit')
+        if embed is not None:
+            self.embeds = [embed]
+        self.view = view
+
+    async def delete(self):
+        await self.transport.call('message.delete')
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeChannel:
+    def __init__(self, transport: FakeTransport, guild: FakeGuild, channel_id: int):
+        self.transport = transport
+        self.guild = guild
+        self.id = channel_id
+        self.mention = f"<#{channel_id}>"
+        self.messages = {}
+        self.bulk_max_age = None  # как у Discord: bulk delete не принимает сообщения старше 14 дней
+
+    async def send(self, content=None, embed=None, view=None, **kwargs):
+        await self.transport.call('channel.send')
+        message = FakeMessage(self.transport, self, content, embed, view)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id: int):
+        await self.transport.call('channel.fetch_message')
+        message = self.messages.get(message_id)
+        if message is None:
+            raise bot_host.discord.NotFound(_FakeResponse(404), 'Unknown Message')
+        return message
+
+    def get_partial_message(self, message_id: int):
+        return self.messages.get(message_id) or FakeMessage(self.transport, self, message_id=message_id)
+
+    async def history(self, limit=None, before=None):
+        """История канала от новых к старым, страницами по 100 (один REST-вызов на страницу)."""
+        message_ids = sorted((message_id for message_id in self.messages if before is None or message_id < before.id), reverse=True)
+        for index, message_id in enumerate(message_ids[:limit]):
+            if index % 100 == 0:
+                await self.transport.call('channel.history')
+            yield self.messages[message_id]
+
+    async def delete_messages(self, messages):
+        await self.transport.call('channel.delete_messages')
+        if self.bulk_max_age is not None:
+            cutoff = bot_host._snowflake_at(time.time() - self.bulk_max_age)
+            if any(message.id < cutoff for message in messages):
+                raise bot_host.discord.HTTPException(_FakeResponse(400), 'You can only bulk delete messages that are under 14 days old.')
+        for message in messages:
+            self.messages.pop(message.id, None)
+
+
+class _FakeResponse:
+    """Минимальный aiohttp-ответ для конструктора discord.HTTPException."""
+
+    def __init__(self, status: int):
+        self.status = status
+        self.reason = 'Fake'
+
+
+class FakeInteractionResponse:
+    def __init__(self, transport: FakeTransport):
+        self.transport = transport
+        self.view = None
+        self.content = None
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def _respond(self, route: str, view=None):
+        self._done = True
+        self.view = view
+        await self.transport.call(route)
+
+    async def defer(self, **kwargs):
+        await self._respond('interaction.defer')
+
+    async def send_message(self, content=None, view=None, **kwargs):
+        self.content = content
+        await self._respond('interaction.send_message', view)
+
+    async def edit_message(self, content=None, view=None, **kwargs):
+        await self._respond('interaction.edit_message', view)
+
+    async def send_modal(self, modal):
+        await self._respond('interaction.send_modal', modal)
+
+
+class FakeFollowup:
+    def __init__(self, transport: FakeTransport):
+        self.transport = transport
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        await self.transport.call('followup.send')
+        self.sent.append(content)
+
+
+class FakeInteraction:
+    def __init__(self, transport: FakeTransport, user: FakeUser, channel: FakeChannel, message: FakeMessage = None, data: dict = None):
+        self.transport = transport
+        self.data = data or {}
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild = channel.guild
+        self.guild_id = channel.guild.id
+        self.message = message
+        self.response = FakeInteractionResponse(transport)
+        self.followup = FakeFollowup(transport)
+
+    async def edit_original_response(self, **kwargs):
+        await self.transport.call('interaction.edit_original_response')
+        if self.message is not None:
+            if kwargs.get('embed') is not None:
+                self.message.embeds = [kwargs['embed']]
+            self.message.view = kwargs.get('view', self.message.view)
+
+
+# =================================================================
+# СЦЕНАРИИ
+# =================================================================
+
+class Bench:
+    def __init__(self, transport: FakeTransport):
+        self.transport = transport
+        self.guild = FakeGuild(GUILD_ID)
+        self.nav_channel = FakeChannel(transport, self.guild, next(_snowflakes))
+        self.lfg_channel = FakeChannel(transport, self.guild, next(_snowflakes))
+        self.latencies = []
+        self.notices = []
+        self._user_ids = itertools.count(1 << 41)
+        # Личные сообщения не уходят в Discord: сценарии сверяют их по списку (id игрока, текст)
+        bot_host.NOTIFIER.notify = lambda user_ids, content: self.notices.extend((user_id, content) for user_id in user_ids)
+
+        channels = {self.nav_channel.id: self.nav_channel, self.lfg_channel.id: self.lfg_channel}
+        bot_host.bot.get_channel = channels.get
+        config_store = bot_host.GUILD_CONFIGS.store(GUILD_ID)
+        config_store.data['LFG_CHANNEL_ID'] = self.lfg_channel.id
+        config_store.data['NAV_CHANNEL_ID'] = self.nav_channel.id
+
+    def new_user(self) -> FakeUser:
+        return FakeUser(next(self._user_ids))
+
+    async def timed(self, coro):
+        started = time.perf_counter()
+        await coro
+        self.latencies.append(time.perf_counter() - started)
+
+    def interaction(self, user: FakeUser, channel: FakeChannel = None, message: FakeMessage = None, values: list = None) -> FakeInteraction:
+        data = {'values': values} if values is not None else None
+        return FakeInteraction(self.transport, user, channel or self.nav_channel, message, data)
+
+    async def open_arbitrage(self, nav_view, initiator: FakeUser, rng: random.Random):
+        interaction = self.interaction(initiator)
+        await self.timed(nav_view.arbitrage_button.callback(interaction))
+
+        if not isinstance(interaction.response.view, bot_host.RoleSelectView):
+            interaction = await self.pick_map(initiator, interaction, rng)
+
+        role_select = next(item for item in interaction.response.view.children if isinstance(item, bot_host.RoleSelect))
+        role = rng.choice(bot_host.mission_slots(role_select.mission))
+        await self.timed(role_select.callback(self.interaction(initiator, values=[role])))
+
+    async def pick_map(self, initiator: FakeUser, interaction: FakeInteraction, rng: random.Random) -> FakeInteraction:
+        """Ручной выбор карты: MapSelect -> TierSelect."""
+        maps_by_tier = bot_host.MISSIONS.current.maps_by_tier
+        tier = rng.choice(list(maps_by_tier))
+        map_select = interaction.response.view.children[0]
+        interaction = self.interaction(initiator, values=[tier])
+        await self.timed(map_select.callback(interaction))
+
+        tier_select = interaction.response.view.children[0]
+        interaction = self.interaction(initiator, values=[rng.choice(maps_by_tier[tier]).key])
+        await self.timed(tier_select.callback(interaction))
+        return interaction
+
+    async def open_cascade(self, nav_view, initiator: FakeUser):
+        interaction = self.interaction(initiator)
+        await self.timed(nav_view.cascade_button.callback(interaction))
+        start_view = interaction.response.view
+        await self.timed(start_view.start_party_button.callback(self.interaction(initiator)))
+
+    def button_id(self, ticket, action: str, slot_index: int = None) -> str:
+        """custom_id кнопки с текущей версии сообщения тикета (как ее видит игрок)."""
+        message = self.lfg_channel.messages.get(ticket.message_id)
+        suffix = f":{slot_index}" if slot_index is not None else ""
+        for item in (message.view.children if message and message.view else ()):
+            if item.custom_id.startswith(f"lfg:{action}:") and item.custom_id.endswith(suffix) and item.custom_id.count(':') == 2 + bool(suffix):
+                return item.custom_id
+        return f"lfg:{action}:{ticket.message_id}{suffix}"
+
+    async def press(self, ticket, user: FakeUser, custom_id: str):
+        """Нажатие кнопки тикета так, как его разбирает диспетчер DynamicItem в discord.py."""
+        interaction = self.interaction(user, self.lfg_channel, self.lfg_channel.messages.get(ticket.message_id))
+        match = bot_host.TicketButton.__discord_ui_compiled_template__.fullmatch(custom_id)
+        item = await bot_host.TicketButton.from_custom_id(interaction, None, match)
+        await self.timed(item.callback(interaction))
+        return interaction
+
+    async def join(self, ticket, user: FakeUser, rng: random.Random):
+        free = [slot_index for slot_index, (_, user_id) in enumerate(ticket.slots) if not user_id]
+        if not free:
+            return None
+        return await self.press(ticket, user, self.button_id(ticket, "join", rng.choice(free)))
+
+    async def leave(self, ticket, user: FakeUser):
+        return await self.press(ticket, user, self.button_id(ticket, "leave"))
+
+    async def ticket_lifecycle(self, nav_view, index: int, rng: random.Random):
+        initiator = self.new_user()
+        if index % 2:
+            await self.open_cascade(nav_view, initiator)
+        else:
+            await self.open_arbitrage(nav_view, initiator, rng)
+
+        message_id = bot_host.ACTIVE_TICKETS[(GUILD_ID, initiator.id)]
+        ticket = bot_host.EXPIRY.tickets[message_id]
+        first, second, third = self.new_user(), self.new_user(), self.new_user()
+
+        # Двое занимают слоты одновременно, один уходит, затем гонка за последние места
+        await asyncio.gather(self.join(ticket, first, rng), self.join(ticket, second, rng))
+        await self.leave(ticket, first)
+        await asyncio.gather(self.join(ticket, first, rng), self.join(ticket, third, rng))
+        while not ticket.is_finished():
+            await self.join(ticket, self.new_user(), rng)
+
+
+    async def ticket_creation(self, nav_view, rng: random.Random) -> dict:
+        """
+        Создание тикета отвечает на взаимодействие до публикации в канал (окно Discord — 3 секунды),
+        а удаленный канал LFG дает игроку сообщение вместо исключения.
+        """
+        acked_at_send = []
+        pending = {}
+        send = self.lfg_channel.send
+
+        async def watched_send(*args, **kwargs):
+            acked_at_send.append(pending['interaction'].response.is_done())
+            return await send(*args, **kwargs)
+
+        self.lfg_channel.send = watched_send
+        try:
+            initiator = self.new_user()
+            interaction = self.interaction(initiator)
+            await nav_view.cascade_button.callback(interaction)
+            pending['interaction'] = self.interaction(initiator)
+            await interaction.response.view.start_party_button.callback(pending['interaction'])
+            cascade_followup = bool(pending['interaction'].followup.sent)
+
+            initiator = self.new_user()
+            interaction = self.interaction(initiator)
+            await nav_view.arbitrage_button.callback(interaction)
+            if not isinstance(interaction.response.view, bot_host.RoleSelectView):
+                interaction = await self.pick_map(initiator, interaction, rng)
+            role_select = next(item for item in interaction.response.view.children if isinstance(item, bot_host.RoleSelect))
+            pending['interaction'] = self.interaction(initiator, values=[bot_host.mission_slots(role_select.mission)[0]])
+            await role_select.callback(pending['interaction'])
+        finally:
+            self.lfg_channel.send = send
+
+        config_store = bot_host.GUILD_CONFIGS.store(GUILD_ID)
+        config_store.data['LFG_CHANNEL_ID'] = next(_snowflakes)  # канал удален: его нет в кэше
+        try:
+            initiator = self.new_user()
+            interaction = self.interaction(initiator)
+            await nav_view.cascade_button.callback(interaction)
+            missing = self.interaction(initiator)
+            await interaction.response.view.start_party_button.callback(missing)
+        finally:
+            config_store.data['LFG_CHANNEL_ID'] = self.lfg_channel.id
+        return {
+            "published": len(acked_at_send),
+            "acked_before_send": all(acked_at_send) and len(acked_at_send) == 2,
+            "cascade_followup": cascade_followup,
+            "missing_channel_notice": (missing.response.content or "").startswith("❌"),
+        }
+
+    async def spaced_joins(self, nav_view, tickets: int, rng: random.Random) -> dict:
+        """
+        Нажатия, разнесенные по окну RENDER_DEBOUNCE: в отличие от жизненного цикла,
+        где тикет собирается раньше первой отложенной правки, здесь правки реально
+        уходят. На тикет: занятие, пауза дольше окна, занятие и уход внутри окна,
+        пауза, затем два занятия до полного сбора.
+        """
+        queue = bot_host.RENDER_QUEUE
+        before = (queue.edits_issued, queue.edits_saved, queue.edits_dropped, self.transport.calls['interaction.edit_original_response'])
+        window = bot_host.RENDER_DEBOUNCE
+
+        async def one(ticket_rng: random.Random):
+            initiator = self.new_user()
+            await self.open_cascade(nav_view, initiator)
+            ticket = bot_host.EXPIRY.tickets[bot_host.ACTIVE_TICKETS[(GUILD_ID, initiator.id)]]
+            first, second = self.new_user(), self.new_user()
+            await self.join(ticket, first, ticket_rng)
+            await asyncio.sleep(window * 1.5)
+            await self.join(ticket, second, ticket_rng)
+            await asyncio.sleep(window * 0.2)
+            await self.leave(ticket, second)
+            await asyncio.sleep(window * 1.5)
+            while not ticket.is_finished():
+                await self.join(ticket, self.new_user(), ticket_rng)
+
+        await asyncio.gather(*(one(random.Random(rng.random())) for _ in range(tickets)))
+        await asyncio.sleep(window * 2)
+        issued, saved, dropped, rest_edits = (
+            after - start for after, start in zip(
+                (queue.edits_issued, queue.edits_saved, queue.edits_dropped, self.transport.calls['interaction.edit_original_response']), before
+            )
+        )
+        return {
+            "tickets": tickets,
+            "edits_issued": issued,
+            "edits_saved": saved,
+            "edits_dropped": dropped,
+            "rest_edit_calls": rest_edits,
+            "edits_per_ticket": round(issued / tickets, 2) if tickets else 0.0,
+            "issued_match_rest": issued == rest_edits,
+        }
+
+    async def contention(self, nav_view, clickers: int, rng: random.Random) -> dict:
+        """
+        Гонки на одном тикете: двойное создание одним инициатором, затем толпа
+        одновременно жмет «Бронь» на случайные слоты тикета Каскада.
+        """
+        def summaries() -> int:
+            return sum(1 for message in self.lfg_channel.messages.values() if message.content and "ПАТИ СОБРАНА" in message.content)
+
+        summaries_before = summaries()
+        initiator = self.new_user()
+        await asyncio.gather(self.open_cascade(nav_view, initiator), self.open_cascade(nav_view, initiator))
+        own_tickets = [ticket for ticket in bot_host.EXPIRY.tickets.values() if ticket.initiator.id == initiator.id]
+        ticket = own_tickets[-1]
+
+        users = [self.new_user() for _ in range(clickers)]
+        interactions = await asyncio.gather(*(
+            self.press(ticket, user, f"lfg:join:{ticket.message_id}:{rng.randrange(len(ticket.slot_names))}")
+            for user in users
+        ))
+        confirmed = {
+            user.id for user, interaction in zip(users, interactions)
+            if interaction.followup.sent and interaction.followup.sent[-1].startswith(("Вы заняли", "🎉"))
+        }
+        seated = set(ticket.slots.occupants()) - {initiator.id}
+        return {
+            "clickers": clickers,
+            "confirmed": len(confirmed),
+            "seated": len(seated),
+            "lost_updates": len(confirmed - seated),
+            "summaries": summaries() - summaries_before,
+            "duplicate_tickets": len(own_tickets) - 1,
+        }
+
+    async def waitlist(self, nav_view, waiters: int, rng: random.Random) -> dict:
+        """
+        Очереди на занятые слоты: толпа жмет кнопки занятых слотов тикета Каскада,
+        затем сидящие по одному уходят. Считаются правки сообщения и уведомления
+        пересаженным; порядок пересадки сверяется с очередями (FIFO), а состояние — с базой.
+        Затем проверяется, что уход со слота не снимает очередь на другой, а сбор пати
+        и закрытие тикета присылают каждому ждущему сообщение о снятой очереди.
+        """
+        initiator = self.new_user()
+        await self.open_cascade(nav_view, initiator)
+        ticket = bot_host.EXPIRY.tickets[bot_host.ACTIVE_TICKETS[(GUILD_ID, initiator.id)]]
+        while ticket.slots.free > 1:
+            await self.join(ticket, self.new_user(), rng)
+        await asyncio.sleep(bot_host.RENDER_DEBOUNCE * 2)
+
+        edits = lambda: bot_host.RENDER_QUEUE.edits_issued
+        taken = [index for index, (_, user_id) in enumerate(ticket.slots) if user_id and user_id != initiator.id]
+        users = [self.new_user() for _ in range(waiters)]
+        edits_before = edits()
+        interactions = await asyncio.gather(*(
+            self.press(ticket, user, self.button_id(ticket, "join", rng.choice(taken))) for user in users
+        ))
+        await asyncio.sleep(bot_host.RENDER_DEBOUNCE * 2)
+        queued = sum(1 for interaction in interactions if interaction.followup.sent[-1].startswith("Слот"))
+        edits_while_queueing = edits() - edits_before
+        expected = {role: list(user_ids) for role, user_ids in ticket.slots.waitlists()}
+
+        row = bot_host.TICKET_STORE.get(ticket.message_id)
+        stored = bot_host.TicketStore.load_slots(row['slots'], json.loads(row['slot_names']), row['waitlist'])
+        store_matches = {role: list(user_ids) for role, user_ids in stored.waitlists()} == expected
+
+        notices_before = len(self.notices)
+        promoted = {role: [] for role in expected}
+        edits_before = edits()
+        for role in rng.sample([role for role, user_ids in expected.items() for _ in user_ids], sum(map(len, expected.values()))):
+            await self.leave(ticket, FakeUser(ticket.slots[role]))
+            promoted[role].append(ticket.slots[role])
+        await asyncio.sleep(bot_host.RENDER_DEBOUNCE * 2)
+        edits_for_leaves = edits() - edits_before
+        notices = [user_id for user_id, _ in self.notices[notices_before:]]
+        leaves = sum(map(len, promoted.values()))
+
+        # Сидящий встает в очередь на другой слот и уходит со своего: очередь остается за ним
+        seated = [(index, user_id) for index, (_, user_id) in enumerate(ticket.slots) if user_id and user_id != initiator.id]
+        (_, mover_id), (target, holder_id) = seated[:2]
+        target_role = ticket.slot_names[target]
+        await self.press(ticket, FakeUser(mover_id), self.button_id(ticket, "join", target))
+        left = await self.leave(ticket, FakeUser(mover_id))
+        leave_keeps_queue = ticket.slots.waiting_for(mover_id) == (target_role, 1) and "по-прежнему" in left.followup.sent[-1]
+        await self.leave(ticket, FakeUser(holder_id))
+        leave_keeps_queue = leave_keeps_queue and ticket.slots[target_role] == mover_id
+
+        # Сбор пати и закрытие тикета снимают очереди: каждому ждущему — одно сообщение
+        ended = lambda: Counter(user_id for user_id, content in self.notices if content.startswith("⌛"))
+        fill_waiters = [self.new_user() for _ in range(3)]
+        for user in fill_waiters:
+            await self.press(ticket, user, self.button_id(ticket, "join", target))
+        ended_before = ended()
+        while not ticket.is_finished():
+            await self.join(ticket, self.new_user(), rng)
+        filled = ended() - ended_before
+
+        closer = self.new_user()
+        await self.open_cascade(nav_view, closer)
+        closed_ticket = bot_host.EXPIRY.tickets[bot_host.ACTIVE_TICKETS[(GUILD_ID, closer.id)]]
+        close_waiters = [self.new_user() for _ in range(3)]
+        for user in close_waiters:
+            await self.press(closed_ticket, user, self.button_id(closed_ticket, "join", 0))
+        ended_before = ended()
+        await self.press(closed_ticket, closer, self.button_id(closed_ticket, "close"))
+        closed = ended() - ended_before
+        return {
+            "waiters": waiters,
+            "queued": queued,
+            "edits_while_queueing": edits_while_queueing,
+            "leaves": leaves,
+            "promoted": len(notices),
+            "edits_for_leaves": edits_for_leaves,
+            "fifo_order": promoted == expected,
+            "notices_match": sorted(notices) == sorted(user_id for user_ids in expected.values() for user_id in user_ids),
+            "store_matches": store_matches,
+            "leave_keeps_queue": leave_keeps_queue,
+            "ended_on_fill": filled == Counter(user.id for user in fill_waiters),
+            "ended_on_close": closed == Counter(user.id for user in close_waiters),
+        }
+
+    async def sweep(self, total: int, rng: random.Random) -> dict:
+        """
+        Сверка канала из total сообщений за 30 дней: живые тикеты, тикеты-сироты моложе
+        и старше 14 дней, сводки бота и сообщения игроков.
+        """
+        channel = FakeChannel(self.transport, self.guild, next(_snowflakes))
+        channel.bulk_max_age = 14 * 24 * 3600
+        me = self.new_user()
+        bot_host.bot._connection.user = me
+        cascade = bot_host.MISSIONS.current.mission(bot_host.MISSION_CASCADE)
+        now = time.time()
+        old_cutoff = now - bot_host.SWEEP_BULK_MAX_AGE
+        expected = Counter()
+        for index in range(total):
+            created = now - 60 - rng.random() * 30 * 24 * 3600
+            message = FakeMessage(self.transport, channel, message_id=bot_host._snowflake_at(created) + index)
+            kind = rng.random()
+            message.author = me if kind < 0.8 else self.new_user()
+            if kind < 0.6:
+                message.components = [SimpleNamespace(children=[SimpleNamespace(custom_id=f"lfg:join:{message.id}:1")])]
+                if kind < 0.1:
+                    bot_host.TICKET_STORE.save(bot_host.PartyTicket(
+                        bot_host.bot, cascade, bot_host.SlotTable(bot_host.mission_slots(cascade)), bot_host.TicketUser(me.id, "Bench"),
+                        message.id, channel_id=channel.id, created_at=created, guild_id=GUILD_ID
+                    ))
+                    expected['kept'] += 1
+                else:
+                    expected['single' if created < old_cutoff else 'bulk'] += 1
+            channel.messages[message.id] = message
+
+        calls_before = Counter(self.transport.calls)
+        lag_samples = []
+        probe = asyncio.ensure_future(_lag_probe(lag_samples))
+        await asyncio.sleep(0)  # замер задержки цикла начинается до сверки
+        report = await bot_host.SWEEPER.sweep_channel(channel)
+        probe.cancel()
+        calls = self.transport.calls - calls_before
+        return {
+            "messages": total,
+            "scanned": report.scanned,
+            "kept": report.kept,
+            "bulk_deleted": report.bulk_deleted,
+            "single_deleted": report.single_deleted,
+            "matches_expected": (report.kept, report.bulk_deleted, report.single_deleted) == (expected['kept'], expected['bulk'], expected['single']),
+            "history_pages": calls['channel.history'],
+            "bulk_requests": calls['channel.delete_messages'],
+            "elapsed_ms": round(report.elapsed * 1000, 1),
+            "loop_lag_max_ms": round(max(lag_samples, default=0.0) * 1000, 3),
+        }
+
+    async def matchmaking(self, players: int, rng: random.Random) -> dict:
+        """
+        Всплеск очереди авто-подбора через кнопку «Встать в очередь» MatchmakingView:
+        время ответа на нажатие, число собранных пати и сверка счетчика очереди с перебором.
+        Затем — выход и повторная постановка одного игрока, пока вершину кучи держит
+        другой: мертвые элементы не должны копиться, а их учет — сходиться с кучами.
+        """
+        previous, bot_host.MATCHMAKER = bot_host.MATCHMAKER, bot_host.Matchmaker()
+        matchmaker = bot_host.MATCHMAKER
+        missions = list(bot_host.MISSIONS.current.missions_by_key.values())
+        latencies = []
+        try:
+            for _ in range(players):
+                user = self.new_user()
+                view = bot_host.MatchmakingView(bot_host.bot, user)
+                # Выбор в меню миссии и ролей — то же, что делают колбэки селектов
+                view.mission = rng.choice(missions)
+                slot_names = bot_host.mission_slots(view.mission)
+                view.roles = rng.sample(slot_names, rng.randint(1, len(slot_names)))
+                started = time.perf_counter()
+                await view.enqueue_button.callback(self.interaction(user))
+                latencies.append(time.perf_counter() - started)
+                view.stop()
+            counts_match = all(
+                matchmaker.queued(GUILD_ID, mission)
+                == sum(1 for entry in matchmaker._entries.values() if entry.mission.key == mission.key)
+                for mission in missions
+            )
+            live = lambda item: matchmaker._entries.get((item[2].guild_id, item[2].user.id)) is item[2]
+            dead_counts_match = all(
+                matchmaker._dead[queue_key + (role,)] == sum(1 for item in heap if not live(item))
+                for queue_key, queues in matchmaker._queues.items() for role, heap in queues.items()
+            )
+
+            churn = bot_host.Matchmaker()
+            mission = missions[0]
+            role = bot_host.mission_slots(mission)[0]
+            holder, churner = self.new_user(), self.new_user()
+            churn.enqueue(GUILD_ID, bot_host.TicketUser(holder.id, holder.display_name), mission, [role])
+            churn_heap_max = 0
+            for _ in range(players):
+                churn.enqueue(GUILD_ID, bot_host.TicketUser(churner.id, churner.display_name), mission, [role])
+                churn.dequeue(GUILD_ID, churner.id)
+                churn_heap_max = max(churn_heap_max, len(churn._queues[(GUILD_ID, mission.key)][role]))
+            return {
+                "players": players,
+                "enqueue_p50_us": round(_percentile(latencies, 0.50) * 1e6, 1),
+                "enqueue_p99_us": round(_percentile(latencies, 0.99) * 1e6, 1),
+                "total_ms": round(sum(latencies) * 1000, 1),
+                "matches": matchmaker.matches,
+                "still_queued": len(matchmaker._entries),
+                "queued_counts_match": counts_match,
+                "dead_counts_match": dead_counts_match,
+                "churn_cycles": players,
+                "churn_heap_max": churn_heap_max,
+            }
+        finally:
+            bot_host.MATCHMAKER = previous
+
+    async def handoff(self, nav_view, tickets: int, rng: random.Random) -> dict:
+        """
+        Плавный перезапуск посреди работы: открытые тикеты, нажатия в очередях тикетов,
+        отложенные перерисовки и игроки в очереди авто-подбора. После SHUTDOWN.drain()
+        «новый процесс» восстанавливает состояние из базы так же, как on_ready.
+        """
+        await bot_host.SHUTDOWN.acquire()
+        for index in range(tickets):
+            if index % 2:
+                await self.open_cascade(nav_view, self.new_user())
+            else:
+                await self.open_arbitrage(nav_view, self.new_user(), rng)
+        open_tickets = [ticket for ticket in bot_host.EXPIRY.tickets.values() if not ticket.is_finished()]
+
+        # Все хотят одну и ту же роль — пати из очереди не соберется и уйдет в снимок
+        arbitration = bot_host.MISSIONS.current.mission(bot_host.MISSION_ARBITRATION)
+        for _ in range(20):
+            player = self.new_user()
+            bot_host.MATCHMAKER.enqueue(GUILD_ID, bot_host.TicketUser(player.id, player.display_name), arbitration, bot_host.mission_slots(arbitration)[:1])
+        queued = len(bot_host.MATCHMAKER.snapshot())
+
+        # Веб-сервер прежнего процесса и нового, запущенного до передачи работы, — на одном порту
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            os.environ['PORT'] = str(probe.getsockname()[1])
+        await bot_host.start_server()
+        try:
+            await bot_host.start_server()
+            new_runner = bot_host.SHUTDOWN.runners.pop()
+        except OSError as error:
+            print(f"Второй веб-сервер не занял порт: {error}")
+            new_runner = None
+
+        in_flight = [asyncio.ensure_future(self.join(ticket, self.new_user(), rng)) for ticket in open_tickets]
+        await asyncio.sleep(0)  # нажатия уже стоят в Mailbox тикетов
+        started = time.perf_counter()
+        await bot_host.SHUTDOWN.drain()
+        drain_ms = (time.perf_counter() - started) * 1000
+        served_after_drain = False
+        if new_runner is not None:
+            async with ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{os.environ['PORT']}/") as response:
+                    served_after_drain = response.status == 200
+            await new_runner.cleanup()
+        interactions = [interaction for interaction in await asyncio.gather(*in_flight) if interaction is not None]
+        still_open = [ticket for ticket in open_tickets if not ticket.is_finished()]
+        late = await self.press(still_open[0], self.new_user(), self.button_id(still_open[0], "join", 0)) if still_open else None
+        expected = {ticket.message_id: list(ticket.slots) for ticket in still_open}
+
+        # Новый процесс: пустая память, все берется из базы
+        bot_host.EXPIRY = bot_host.ExpiryScheduler(bot_host.bot)
+        bot_host.ACTIVE_TICKETS.clear()
+        bot_host.MATCHMAKER = bot_host.Matchmaker()
+        # Каналов еще нет в кэше (сервер недоступен при старте): тикеты все равно восстанавливаются
+        get_channel, bot_host.bot.get_channel = bot_host.bot.get_channel, lambda channel_id: None
+        try:
+            bot_host.restore_tickets()
+        finally:
+            bot_host.bot.get_channel = get_channel
+        restored_queue = bot_host.restore_matchmaking()
+        if bot_host.EXPIRY._task:
+            bot_host.EXPIRY._task.cancel()
+        # Живые тикеты сценария сверки тоже в базе, но в другом канале
+        restored = {message_id: list(ticket.slots) for message_id, ticket in bot_host.EXPIRY.tickets.items() if ticket.channel_id == self.lfg_channel.id}
+        return {
+            "open_tickets": len(still_open),
+            "in_flight_clicks": len(interactions),
+            "in_flight_answered": sum(1 for interaction in interactions if interaction.followup.sent),
+            "late_click_notice": late is not None and late.response.content == bot_host.RESTART_NOTICE,
+            "pending_renders_after_drain": len(bot_host.RENDER_QUEUE._pending),
+            "lease_released": bool(bot_host.TICKET_STORE.lease(bot_host.SHUTDOWN.scope)["released"]),
+            "restored_tickets": len(restored),
+            "restored_state_matches": restored == expected,
+            "queued_players": queued,
+            "restored_queue": restored_queue,
+            "drain_ms": round(drain_ms, 2),
+            "port_shared": new_runner is not None,
+            "served_after_drain": served_after_drain,
+        }
+
+
+async def _lag_probe(samples: list, interval: float = 0.01):
+    """Задержка цикла событий: насколько позже запланированного просыпается sleep."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+
+def _percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure_render_allocations(ticket, renders: int = 1000) -> dict:
+    """Сколько блоков и байт памяти выделяет одна перерисовка (Embed + кнопки; по tracemalloc, результаты сохраняются)."""
+    ticket._render_embed()  # прогрев кэша шаблонов
+    embeds = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    for _ in range(renders):
+        embeds.append((ticket._render_embed(), ticket.build_view()))
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return {"blocks_per_render": blocks / renders, "bytes_per_render": peak / renders}
+
+
+def measure_ticket_index(tickets: int, rng: random.Random, guilds: int = 4, queries: int = 500) -> dict:
+    """
+    Индекс !lfg на тысячах открытых тикетов: время добавления, переноса при смене слотов
+    и запроса страницы; каждая страница сверяется с полным перебором тикетов (состав
+    и порядок). Отдельно меряются первая и последняя страницы одной корзины из tickets
+    тикетов: цена страницы не должна расти с глубиной.
+    """
+    index = bot_host.TicketIndex()
+    missions = list(bot_host.MISSIONS.current.missions_by_key.values())
+    guild_ids = [GUILD_ID + offset for offset in range(guilds)]
+    registry = {}
+    add_latencies = []
+    for number in range(tickets):
+        mission = rng.choice(missions)
+        slot_names = bot_host.mission_slots(mission)
+        taken = rng.sample(slot_names, rng.randint(1, len(slot_names) - 1))
+        ticket = bot_host.PartyTicket(
+            None, mission, bot_host.SlotTable(slot_names, {name: number * 10 + position + 1 for position, name in enumerate(taken)}),
+            bot_host.TicketUser(number, f"Tenno{number}"), next(_snowflakes), guild_id=rng.choice(guild_ids)
+        )
+        started = time.perf_counter()
+        index.add(ticket)
+        add_latencies.append(time.perf_counter() - started)
+        registry[ticket.message_id] = ticket
+
+    update_latencies = []
+    for ticket in rng.sample(list(registry.values()), min(len(registry), tickets // 2)):
+        free_slots = [name for name, user_id in ticket.slots if not user_id]
+        if len(free_slots) > 1:
+            ticket.slots.occupy(free_slots[0], 10 ** 9 + ticket.message_id)
+        started = time.perf_counter()
+        index.update(ticket)
+        update_latencies.append(time.perf_counter() - started)
+
+    filters = [bot_host.TicketFilter(min_free=rng.randint(1, 3))]
+    for mission in missions:
+        tier = mission.map.tier if mission.map else None
+        filters += [bot_host.TicketFilter(kind=mission.kind), bot_host.TicketFilter(tier=tier, min_free=2)]
+        if mission.map:
+            filters.append(bot_host.TicketFilter(map_name=mission.map.name, faction=mission.map.faction))
+    query_latencies = []
+    correct = True
+    for _ in range(queries):
+        guild_id = rng.choice(guild_ids)
+        ticket_filter = rng.choice(filters)
+        expected = sorted((
+            ticket for ticket in registry.values()
+            if ticket.guild_id == guild_id and ticket_filter.matches(bot_host.TicketIndex.key_of(ticket))
+        ), key=lambda ticket: (ticket.slots.free, bot_host.TicketIndex.key_of(ticket), -ticket.created_at, -ticket.message_id))
+        offset = rng.randrange(0, max(1, len(expected))) // bot_host.LFG_PAGE_SIZE * bot_host.LFG_PAGE_SIZE
+        started = time.perf_counter()
+        total, page = index.query(guild_id, ticket_filter, offset, bot_host.LFG_PAGE_SIZE)
+        query_latencies.append(time.perf_counter() - started)
+        correct &= total == len(expected) and page == expected[offset:offset + bot_host.LFG_PAGE_SIZE]
+
+    # Одна корзина: тикеты одной миссии с одинаково занятыми слотами на одном сервере
+    bucket = bot_host.TicketIndex()
+    mission = missions[0]
+    slot_names = bot_host.mission_slots(mission)
+    for number in range(tickets):
+        bucket.add(bot_host.PartyTicket(
+            None, mission, bot_host.SlotTable(slot_names, {slot_names[0]: number + 1}),
+            bot_host.TicketUser(number + 1, f"Tenno{number}"), next(_snowflakes), guild_id=GUILD_ID
+        ))
+    everything = bot_host.TicketFilter()
+    depth = {}
+    for name, offset in (("first", 0), ("last", (tickets - 1) // bot_host.LFG_PAGE_SIZE * bot_host.LFG_PAGE_SIZE)):
+        latencies = []
+        for _ in range(200):
+            started = time.perf_counter()
+            bucket.query(GUILD_ID, everything, offset, bot_host.LFG_PAGE_SIZE)
+            latencies.append(time.perf_counter() - started)
+        depth[name] = _percentile(latencies, 0.50)
+    return {
+        "tickets": tickets,
+        "guilds": guilds,
+        "add_p50_us": round(_percentile(add_latencies, 0.50) * 1e6, 1),
+        "update_p99_us": round(_percentile(update_latencies, 0.99) * 1e6, 1),
+        "query_p50_us": round(_percentile(query_latencies, 0.50) * 1e6, 1),
+        "query_p99_us": round(_percentile(query_latencies, 0.99) * 1e6, 1),
+        "first_page_p50_us": round(depth["first"] * 1e6, 1),
+        "last_page_p50_us": round(depth["last"] * 1e6, 1),
+        "pages_match_scan": correct,
+    }
+
+
+def _guild_payload(guild_id: int, members: int) -> dict:
+    """GUILD_CREATE сервера; members — участники, которые Discord присылает (при intent members — все после чанкинга)."""
+    return {
+        "id": str(guild_id), "name": f"guild-{guild_id}", "unavailable": False, "member_count": members, "large": members > 250,
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(guild_id + 1), "type": 0, "name": "lfg", "position": 0, "permission_overwrites": []}],
+        "members": [
+            {"user": {"id": str(guild_id + 2 + index), "username": f"tenno{index}", "discriminator": "0", "avatar": None},
+             "roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0}
+            for index in range(members)
+        ],
+        "emojis": [], "features": [], "voice_states": [], "presences": [], "threads": [], "stickers": [],
+    }
+
+
+def measure_gateway_cache(guilds: int, members: int) -> dict:
+    """
+    Кэш шлюза в обычном режиме и в LEAN_MODE без подключения к Discord: те же
+    GUILD_CREATE скармливаются ConnectionState клиента с настройками каждого режима
+    (в LEAN_MODE Discord не присылает участников, и кэш их не хранит). Время разбора —
+    нижняя граница времени до on_ready: запросы чанков участников по сети сюда не входят.
+    """
+    result = {"guilds": guilds, "members_per_guild": members}
+    for mode in ("normal", "lean"):
+        if mode == "lean":
+            intents = bot_host.discord.Intents.none()
+            intents.guilds = True
+            options = dict(member_cache_flags=bot_host.discord.MemberCacheFlags.none(), chunk_guilds_at_startup=False, max_messages=None)
+        else:
+            intents = bot_host.discord.Intents.default()
+            intents.members = True
+            intents.message_content = True
+            options = {}
+        payloads = [_guild_payload((index + 1) << 32, members if mode == "normal" else 0) for index in range(guilds)]
+        timings = []
+        for traced in (False, True):
+            state = bot_host.discord.Client(intents=intents, **options)._connection
+            if traced:
+                tracemalloc.start()
+            started = time.perf_counter()
+            for payload in payloads:
+                state._add_guild_from_data(payload)
+            timings.append(time.perf_counter() - started)
+            if traced:
+                result[f"{mode}_cache_mb"] = round(tracemalloc.get_traced_memory()[0] / 2 ** 20, 1)
+                tracemalloc.stop()
+        result[f"{mode}_parse_ms"] = round(timings[0] * 1000, 1)
+        result[f"{mode}_cached_members"] = sum(len(guild.members) for guild in state.guilds)
+    return result
+
+
+async def use_live_map(name: str = "Casta"):
+    """Подключает файловый источник состояния мира с заданной картой и прогревает кэш."""
+    path = os.path.join(_WORKDIR, 'worldstate.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"node": f"{name} (Ceres)", "expiry": None}, f)
+    bot_host.WORLD_STATE = bot_host.WorldStateCache(bot_host.FileWorldStateProvider(path))
+    bot_host.WORLD_STATE.refresh_soon()
+    await bot_host.WORLD_STATE._refresh
+
+
+async def run(args) -> dict:
+    if args.live_map:
+        await use_live_map()
+    transport = FakeTransport(args.rest_latency / 1000)
+    bench = Bench(transport)
+    nav_view = bot_host.MainNavigationView(bot_host.bot)
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(index: int):
+        async with semaphore:
+            await bench.ticket_lifecycle(nav_view, index, random.Random(rng.random()))
+
+    lag_samples = []
+    probe = asyncio.ensure_future(_lag_probe(lag_samples))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(args.tickets)))
+    elapsed = time.perf_counter() - started
+    # Дожидаемся отложенных перерисовок, чтобы учесть их REST-вызовы
+    await asyncio.sleep(bot_host.RENDER_DEBOUNCE * 2)
+    probe.cancel()
+
+    cascade = bot_host.MISSIONS.current.mission(bot_host.MISSION_CASCADE)
+    sample_ticket = bot_host.PartyTicket(
+        bot_host.bot, cascade,
+        bot_host.SlotTable(bot_host.mission_slots(cascade), {"Слот 1": 1, "Слот 3": 2}),
+        bot_host.TicketUser(1, "Bench"), next(_snowflakes), comment="bench",
+    )
+    render = measure_render_allocations(sample_ticket)
+    if bot_host.EXPIRY._task:
+        bot_host.EXPIRY._task.cancel()
+
+    rest_total = sum(transport.calls.values())
+    rest_calls = dict(sorted(transport.calls.items()))
+    # Счетчики перерисовки — только жизненного цикла: остальные сценарии их тоже двигают
+    render_counts = (bot_host.RENDER_QUEUE.edits_issued, bot_host.RENDER_QUEUE.edits_saved, bot_host.RENDER_QUEUE.edits_dropped)
+    creation = await bench.ticket_creation(nav_view, random.Random(args.seed))
+    spaced = await bench.spaced_joins(nav_view, args.spaced_tickets, random.Random(args.seed))
+    # Гонки — отдельный сценарий, его REST-вызовы не входят в расчет на тикет
+    contention = await bench.contention(nav_view, args.clickers, random.Random(args.seed))
+    waitlist = await bench.waitlist(nav_view, args.waiters, random.Random(args.seed))
+    sweep = await bench.sweep(args.sweep_messages, random.Random(args.seed))
+    matchmaking = await bench.matchmaking(args.queue_players, random.Random(args.seed))
+    # Перезапуск останавливает бота — этот сценарий всегда последний
+    handoff = await bench.handoff(nav_view, args.handoff_tickets, random.Random(args.seed))
+    return {
+        "tickets": args.tickets,
+        "concurrency": args.concurrency,
+        "live_map": args.live_map,
+        "elapsed_s": round(elapsed, 3),
+        "callbacks": len(bench.latencies),
+        "callback_p50_ms": round(_percentile(bench.latencies, 0.50) * 1000, 3),
+        "callback_p99_ms": round(_percentile(bench.latencies, 0.99) * 1000, 3),
+        "rest_calls_per_ticket": round(rest_total / args.tickets, 2),
+        "rest_calls": rest_calls,
+        "render_blocks_per_render": round(render["blocks_per_render"], 1),
+        "render_bytes_per_render": round(render["bytes_per_render"]),
+        "rest_queue_wait": bot_host.REST.stats()["wait"],
+        "render_edits_issued": render_counts[0],
+        "render_edits_saved": render_counts[1],
+        "render_edits_dropped": render_counts[2],
+        "loop_lag_p50_ms": round(_percentile(lag_samples, 0.50) * 1000, 3),
+        "loop_lag_p99_ms": round(_percentile(lag_samples, 0.99) * 1000, 3),
+        "loop_lag_max_ms": round(max(lag_samples, default=0.0) * 1000, 3),
+        "ticket_creation": creation,
+        "spaced_joins": spaced,
+        "contention": contention,
+        "waitlist": waitlist,
+        "sweep": sweep,
+        "handoff": handoff,
+        "matchmaking": matchmaking,
+        "ticket_index": measure_ticket_index(args.index_tickets, random.Random(args.seed)),
+        "gateway_cache": measure_gateway_cache(args.guilds, args.members),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк жизненного цикла тикетов LFG-бота без Discord.")
+    parser.add_argument('--tickets', type=int, default=200, help="сколько тикетов провести от создания до сбора")
+    parser.add_argument('--concurrency', type=int, default=20, help="сколько тикетов обрабатывается одновременно")
+    parser.add_argument('--rest-latency', type=float, default=0.0, help="имитация задержки REST-вызова, мс")
+    parser.add_argument('--queue-players', type=int, default=5000, help="сколько игроков встает в очередь авто-подбора")
+    parser.add_argument('--spaced-tickets', type=int, default=50, help="сколько тикетов собирается нажатиями, разнесенными по окну перерисовки")
+    parser.add_argument('--clickers', type=int, default=50, help="сколько игроков одновременно жмут «Бронь» на одном тикете")
+    parser.add_argument('--waiters', type=int, default=16, help="сколько игроков встает в очереди на занятые слоты одного тикета")
+    parser.add_argument('--sweep-messages', type=int, default=10000, help="сколько сообщений в канале для сверки с базой тикетов")
+    parser.add_argument('--handoff-tickets', type=int, default=50, help="сколько тикетов открыто в момент плавного перезапуска")
+    parser.add_argument('--index-tickets', type=int, default=5000, help="сколько открытых тикетов в индексе списка !lfg")
+    parser.add_argument('--guilds', type=int, default=50, help="сколько серверов в замере кэша шлюза (обычный режим против LEAN_MODE)")
+    parser.add_argument('--members', type=int, default=2000, help="участников на сервер в замере кэша шлюза")
+    parser.add_argument('--live-map', action='store_true', help="брать текущую карту Арбитража из локального файла состояния мира")
+    parser.add_argument('--seed', type=int, default=1, help="seed для воспроизводимого выбора карт и слотов")
+    parser.add_argument('--json', metavar='PATH', help="дополнительно записать результат в JSON-файл")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    for key, value in result.items():
+        if key not in ("rest_calls", "rest_queue_wait", "matchmaking", "ticket_index", "gateway_cache"):
+            print(f"{key:>26}: {value}")
+    for route, count in result["rest_calls"].items():
+        print(f"{'REST ' + route:>40}: {count}")
+    for priority, wait in result["rest_queue_wait"].items():
+        print(f"{'queue ' + priority:>40}: {wait}")
+    print(f"{'matchmaking':>26}: {result['matchmaking']}")
+    print(f"{'ticket_index':>26}: {result['ticket_index']}")
+    print(f"{'gateway_cache':>26}: {result['gateway_cache']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,963 +1,4530 @@
-import discord
-from discord.ext import commands
-import json
-from typing import Dict, Any, Optional
-import os # <-- Необходим для чтения переменных окружения (BOT_TOKEN, EXTERNAL_URL, PORT)
-import asyncio # <-- Необходим для асинхронного запуска бота и веб-сервера
-from aiohttp import web, ClientSession # <-- Необходим для веб-сервера и самопинга
-
-# =================================================================
-# 1. КОНСТАНТЫ И НАСТРОЙКИ
-# =================================================================
-
-# ВАЖНОЕ ИЗМЕНЕНИЕ: Токен считывается из переменной окружения 'BOT_TOKEN' на Render.
-BOT_TOKEN = os.environ.get('BOT_TOKEN') 
-if not BOT_TOKEN:
-    print("❌ ВНИМАНИЕ: Переменная окружения 'BOT_TOKEN' не найдена. Бот не сможет запуститься.")
-
-CONFIG_FILE = 'config.json'
-LFG_TIMEOUT = 3600 # 1 час (в секундах)
-
-# --- ИЗОБРАЖЕНИЯ ДЛЯ СТИЛИЗАЦИИ ---
-NAV_IMAGE_URL = 'https://avatars.mds.yandex.net/i?id=bfb7df6ab9ff7534c87f3996ad64e2cb_l-5869570-images-thumbs&n=13' 
-CASCAD_IMAGE_URL = 'https://static.wikia.nocookie.net/warframe/images/6/64/%D0%A2%D1%80%D0%B0%D0%BA%D1%81%D0%BE%D0%B2%D0%B0%D1%8F_%D0%9F%D0%BB%D0%B0%D0%B7%D0%BC%D0%B0_%D0%B2%D0%B8%D0%BA%D0%B8.png/revision/latest?cb=20220428000041&path-prefix=ru'
-
-# --- АРБИТРАЖ: СТИЛИЗАЦИЯ (ЦВЕТА И ИКОНКИ РАС) ---
-FACTION_ICONS = {
-    "Гринир": "https://images-ext-1.discordapp.net/external/Wmh0isPGDXG8s1_xJKjSW_F6CHl6aBQXoRIINUdvm0g/https/assets.empx.cc/Lotus/Interface/Graphics/WorldStatePanel/Grineer.png?format=webp&quality=lossless",
-    "Корпус": "https://images-ext-1.discordapp.net/external/BUNqoLvclDjqa3OUzE04XI4E1nXvU8qR9f_IIb5AP7o/https/assets.empx.cc/Lotus/Interface/Graphics/WorldStatePanel/Corpus.png?format=webp&quality=lossless",
-    "Зараженные": "https://images-ext-1.discordapp.net/external/9_z1utcRwJxSSw4n6ebRLAzqynWnAJAVJDphsjyrg9E/https/assets.empx.cc/Lotus/Interface/Graphics/WorldStatePanel/Infested.png?format=webp&quality=lossless"
-}
-
-TIER_COLORS = {
-    "S-ТИР": discord.Color.red(), 
-    "A-ТИР": discord.Color.gold(), 
-    "B-ТИР": discord.Color.blue() 
-}
-
-# --- ДАННЫЕ КАРТ (обновлено для включения Расы и Тайлсета) ---
-MAP_TIERS_DATA = {
-    "S-ТИР": [
-        {"name": "Casta", "faction": "Гринир", "mission": "Оборона", "tileset": "Grineer Asteroid"},
-        {"name": "Cinxia", "faction": "Гринир", "mission": "Перехват", "tileset": "Grineer Galleon"},
-        {"name": "Seimeni", "faction": "Зараженные", "mission": "Оборона", "tileset": "Infested Ship"},
-    ],
-    "A-ТИР": [
-        {"name": "Hydron", "faction": "Гринир", "mission": "Оборона", "tileset": "Grineer Galleon"},
-        {"name": "Helenе", "faction": "Гринир", "mission": "Оборона", "tileset": "Grineer Asteroid"},
-        {"name": "Sechura", "faction": "Зараженные", "mission": "Оборона", "tileset": "Infested Ship"},
-        {"name": "Odin", "faction": "Гринир", "mission": "Перехват", "tileset": "Grineer Shipyard"},
-    ],
-    "B-ТИР": [
-        {"name": "Hyf", "faction": "Зараженные", "mission": "Оборона", "tileset": "Infested Ship"},
-        {"name": "Ose", "faction": "Корпус", "mission": "Перехват", "tileset": "Corpus Ice Planet"},
-        {"name": "Outer Terminus", "faction": "Корпус", "mission": "Оборона", "tileset": "Corpus Gas City"}
-    ]
-}
-
-# Слоты для Арбитража
-ARBITRAGE_SLOTS = [
-    "Сарина/Цит (Джейд)",
-    "Сарина/Цит",
-    "Вольт / Хрома / Локи",
-    "Висп"
-]
-
-# Слоты для Каскада
-CASCAD_SLOTS = ["Слот 1", "Слот 2", "Слот 3", "Слот 4"]
-
-
-# =================================================================
-# 2. ФУНКЦИИ УПРАВЛЕНИЯ КОНФИГУРАЦИЕЙ
-# =================================================================
-
-def save_config(config_data):
-    """Сохраняет настройки в файл JSON."""
-    with open('config.json', 'w') as f:
-        json.dump(config_data, f, indent=4)
-
-def load_config() -> Dict[str, Any]:
-    """
-    Загружает настройки из файла JSON и гарантирует наличие всех необходимых ключей.
-    """
-    DEFAULT_CONFIG = {
-        "NAV_CHANNEL_ID": None,
-        "LFG_CHANNEL_ID": None,
-        "ARBITRAGE_ROLE_ID": None,
-        "CASCAD_ROLE_ID": None, 
-        "MAP_ROLES": {} 
-    }
-    
-    config = DEFAULT_CONFIG.copy()
-    
-    try:
-        with open('config.json', 'r') as f:
-            loaded_config = json.load(f)
-            config.update(loaded_config)
-    except FileNotFoundError:
-        pass
-    except json.JSONDecodeError:
-        pass
-        
-    save_config(config)
-    
-    return config
-
-CONFIG = load_config()
-
-# =================================================================
-# 3. ИНИЦИАЛИЗАЦИЯ БОТА И НАМЕРЕНИЯ (INTENTS)
-# =================================================================
-
-intents = discord.Intents.default()
-intents.members = True 
-intents.message_content = True 
-
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-# Словарь для отслеживания активных тикетов: {user_id: message_id}
-ACTIVE_TICKETS = {}
-
-# =================================================================
-# 4. КЛАССЫ ИНТЕРАКТИВНЫХ КОМПОНЕНТОВ (VIEWS)
-# =================================================================
-
-async def check_and_delete_old_ticket(initiator: discord.Member, lfg_channel):
-    """Проверяет и удаляет старый тикет инициатора."""
-    old_message_id = ACTIVE_TICKETS.get(initiator.id)
-    if old_message_id:
-        try:
-            old_message = await lfg_channel.fetch_message(old_message_id)
-            await old_message.delete()
-        except discord.NotFound:
-            pass 
-        except Exception as e:
-            print(f"Не удалось удалить старый тикет {old_message_id}: {e}")
-        finally:
-            if initiator.id in ACTIVE_TICKETS:
-                del ACTIVE_TICKETS[initiator.id]
-
-
-class PartyView(discord.ui.View):
-    """Универсальный View для управления созданным тикетом (Арбитраж/Каскад)."""
-    
-    def __init__(self, bot, map_info: str, initial_slots: Dict[str, Any], initiator: discord.Member, slot_names: list, message_id: int, comment: Optional[str] = None):
-        super().__init__(timeout=LFG_TIMEOUT) 
-        self.bot = bot
-        self.map_info = map_info 
-        self.slots = initial_slots
-        self.initiator = initiator
-        self.slot_names = slot_names
-        self.message_id = message_id 
-        self.comment = comment 
-        self._add_role_buttons() 
-
-    # --- ЛОГИКА АВТОМАТИЧЕСКОГО УДАЛЕНИЯ ---
-    async def on_timeout(self):
-        channel_id = CONFIG.get('LFG_CHANNEL_ID')
-        channel = self.bot.get_channel(channel_id)
-        if channel:
-            try:
-                message = await channel.fetch_message(self.message_id)
-                await message.delete()
-                if self.initiator.id in ACTIVE_TICKETS and ACTIVE_TICKETS[self.initiator.id] == self.message_id:
-                    del ACTIVE_TICKETS[self.initiator.id]
-            except discord.NotFound:
-                pass 
-
-    def _create_summary_embed(self) -> discord.Embed:
-        """Создает финальный Embed с информацией о собранной пати."""
-        members_list = []
-        for role, player in self.slots.items():
-            if isinstance(player, discord.Member):
-                member_display = player.mention
-            else:
-                member_display = self.initiator.mention
-
-            members_list.append(f"**{role}:** {member_display}")
-            
-        try:
-            map_data = json.loads(self.map_info)
-            title = "🚀 Пати на Арбитраж Собрана!"
-            description = (
-                f"**Карта:** {map_data['name']} ({map_data['tier']})\n"
-                f"**Миссия:** {map_data['mission']} - {map_data['faction']}\n"
-                f"**Тайлсет:** {map_data['tileset']}"
-            )
-            color = TIER_COLORS.get(map_data["tier"], discord.Color.green())
-        except json.JSONDecodeError:
-            title = "🚀 Пати на Каскад Собрана!"
-            description = (
-                "**Миссия:** Каскад (Зариман) \n"
-                "**Награда:** Мистификаторы (Праймхлам/Отголоски)"
-            )
-            color = discord.Color.dark_green()
-        
-        embed = discord.Embed(
-            title=title,
-            description=description,
-            color=color
-        )
-        
-        embed.add_field(
-            name="⚔️ Состав группы:",
-            value="\n".join(members_list),
-            inline=False
-        )
-        
-        if self.comment:
-            embed.add_field(
-                name="📝 Комментарий создателя:",
-                value=f"> *{self.comment}*",
-                inline=False
-            )
-
-        embed.set_footer(text=f"Пати успешно закрыта. Создатель: {self.initiator.display_name}")
-        return embed
-
-
-    def _update_embed(self, embed: discord.Embed) -> discord.Embed:
-        """Обновляет Embed на основе текущего состояния слотов, данных карты и комментария."""
-        
-        embed.clear_fields() 
-            
-        is_full = all(self.slots[role] != "[СВОБОДНО]" for role in self.slot_names)
-        
-        try:
-            map_data = json.loads(self.map_info)
-            
-            final_color = TIER_COLORS.get(map_data["tier"], discord.Color.gold())
-            embed.color = final_color
-            
-            faction_icon_url = FACTION_ICONS.get(map_data["faction"])
-            if faction_icon_url:
-                embed.set_thumbnail(url=faction_icon_url)
-
-            map_info_text = f"{map_data['tier']} | {map_data['name']} ({map_data['mission']})"
-            if is_full:
-                 final_title = f"✅ ЗАКРЫТО | {map_info_text} | Пати собрана!"
-            else:
-                 final_title = f"⚠️ СБОР | {map_info_text} | Нужны игроки"
-
-            embed.add_field(name="Тип", value=f"{map_data['mission']} - {map_data['faction']}", inline=True)
-            embed.add_field(name="Сет/Тайлы", value=map_data['tileset'], inline=True)
-            embed.add_field(name="Истекает", value="1 час с момента создания", inline=True) 
-            
-            field_icon = "⚙️" 
-            
-        except json.JSONDecodeError:
-            if self.map_info == "Каскад":
-                final_color = discord.Color.blue()
-                embed.color = final_color
-                
-                if CASCAD_IMAGE_URL:
-                    embed.set_thumbnail(url=CASCAD_IMAGE_URL)
-                
-                field_icon = "✨" 
-                
-                if is_full:
-                    final_title = f"✅ ЗАКРЫТО | {self.map_info} | Пати собрана!"
-                else:
-                    final_title = f"⚠️ СБОР | {self.map_info} | Нужны игроки"
-                
-                embed.add_field(name="Награда", value="Мистификаторы (Праймхлам/Отголоски)", inline=True)
-                embed.add_field(name="Тип", value="Каскад (Зариман)", inline=True)
-                embed.add_field(name="Истекает", value="1 час с момента создания", inline=True)
-
-            else: 
-                final_title = f"⚠️ СБОР | {self.map_info} | Нужны игроки"
-                final_color = discord.Color.gold()
-                field_icon = "⚙️"
-            
-
-        # Добавляем Комментарий, если он есть
-        if self.comment:
-            embed.add_field(
-                name="📝 Комментарий создателя:", 
-                value=f"> *{self.comment}*", 
-                inline=False
-            )
-
-
-        # Заполняем поля ролями
-        for role, player in self.slots.items():
-            if player == "[СВОБОДНО]":
-                value = "**[СВОБОДНО]**"
-            elif isinstance(player, discord.Member):
-                value = player.mention
-            else:
-                # Универсальная обработка, чтобы избежать ошибок, если тип не Member
-                value = str(player)
-            
-            embed.add_field(name=f"{field_icon} {role}", value=value, inline=False)
-        
-        embed.title = final_title
-        embed.color = final_color
-
-        embed.set_footer(text=f"Создатель: {self.initiator.display_name} | Удаление через 1 час после создания.")
-        return embed
-    
-    
-    def _add_role_buttons(self):
-        """Создает и добавляет кнопки 'Бронь', а также восстанавливает кнопки 'Закрыть' и 'Покинуть'."""
-        self.clear_items()
-        
-        # 1. Кнопки бронирования (Join Buttons)
-        for role_name in self.slot_names:
-            if self.slots[role_name] == "[СВОБОДНО]":
-                label_text = role_name.split('(')[0].strip()
-                if "Слот" not in label_text:
-                    label_text = f"Бронь: {label_text}"
-
-                button = discord.ui.Button(
-                    label=label_text,
-                    style=discord.ButtonStyle.secondary,
-                    custom_id=f"join_{role_name}",
-                    row=0
-                )
-                button.callback = self._create_join_callback(role_name)
-                self.add_item(button)
-                
-        # 2. ВОССТАНОВЛЕНИЕ КНОПОК УПРАВЛЕНИЯ
-        self.add_item(self.close_party_callback)
-        self.add_item(self.leave_party_callback)
-
-
-    def _create_join_callback(self, role_name: str):
-        """Генерирует callback для кнопки 'Бронь'."""
-        async def join_callback(interaction: discord.Interaction):
-            
-            await interaction.response.defer() 
-            
-            user = interaction.user
-            current_slot = None
-            message = ""
-            
-            for slot_key, player in self.slots.items():
-                if isinstance(player, discord.Member) and player.id == user.id:
-                    current_slot = slot_key
-                    break
-            
-            if current_slot:
-                if current_slot == role_name:
-                    return await interaction.followup.send(
-                        f"Вы уже занимаете слот **{role_name}**.", 
-                        ephemeral=True
-                    )
-                
-                if self.slots[role_name] != "[СВОБОДНО]":
-                    return await interaction.followup.send(
-                        "Этот слот только что заняли!", 
-                        ephemeral=True
-                    )
-                
-                # Перемещение
-                self.slots[current_slot] = "[СВОБОДНО]" 
-                message = f"Вы покинули слот **{current_slot}** и заняли **{role_name}**."
-            else:
-                # Занятие нового слота
-                if self.slots[role_name] != "[СВОБОДНО]":
-                    return await interaction.followup.send(
-                        "Этот слот только что заняли!", 
-                        ephemeral=True
-                    )
-                message = f"Вы заняли слот **{role_name}**."
-
-            self.slots[role_name] = user 
-            
-            # --- ЛОГИКА: ПРОВЕРКА НА ПОЛНЫЙ СБОР И ЗАКРЫТИЕ ТИКЕТА ---
-            is_full = all(self.slots[role] != "[СВОБОДНО]" for role in self.slot_names)
-            
-            if is_full:
-                self.stop()
-                summary_embed = self._create_summary_embed()
-                lfg_channel = interaction.channel
-                mentions = [p.mention for p in self.slots.values() if isinstance(p, discord.Member)]
-                final_content = f"✅ **ПАТИ СОБРАНА!** {', '.join(mentions)} — ВПЕРЕД НА МИССИЮ!"
-                
-                await lfg_channel.send(final_content, embed=summary_embed)
-                
-                await interaction.message.delete()
-                
-                await interaction.followup.send(
-                    f"🎉 **Пати полностью собрана!** Тикет закрыт. Проверьте канал {lfg_channel.mention} для деталей.",
-                    ephemeral=True
-                )
-                
-                if self.initiator.id in ACTIVE_TICKETS and ACTIVE_TICKETS[self.initiator.id] == interaction.message.id:
-                    del ACTIVE_TICKETS[self.initiator.id]
-                
-                return 
-
-            # --- КОНЕЦ ЛОГИКИ ---
-            
-            self._add_role_buttons()
-            embed = self._update_embed(interaction.message.embeds[0])
-            
-            await interaction.edit_original_response(embed=embed, view=self)
-            
-            await interaction.followup.send(message, ephemeral=True)
-            
-        return join_callback
-        
-    @discord.ui.button(label="Закрыть пати ❌", style=discord.ButtonStyle.danger, custom_id="close_party", row=1)
-    async def close_party_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
-        """Удаляет тикет (Embed) из канала LFG и из ACTIVE_TICKETS. Доступно только создателю."""
-        if interaction.user.id != self.initiator.id:
-            return await interaction.response.send_message(
-                "Только создатель пати может её закрыть.", 
-                ephemeral=True
-            )
-            
-        await interaction.response.send_message("Тикет успешно закрыт.", ephemeral=True)
-        
-        try:
-            await interaction.message.delete()
-        except discord.NotFound:
-            pass
-        
-        if self.initiator.id in ACTIVE_TICKETS and ACTIVE_TICKETS[self.initiator.id] == interaction.message.id:
-            del ACTIVE_TICKETS[self.initiator.id]
-
-
-    @discord.ui.button(label="Покинуть слот 🏃", style=discord.ButtonStyle.blurple, custom_id="leave_party", row=1)
-    async def leave_party_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
-        """Позволяет игроку покинуть занятый слот."""
-        
-        await interaction.response.defer()
-        
-        user_id = interaction.user.id
-        slot_to_leave = None
-        
-        for role_name in self.slot_names:
-            player = self.slots.get(role_name)
-            if (isinstance(player, discord.Member) and player.id == user_id):
-                slot_to_leave = role_name
-                break
-        
-        if not slot_to_leave:
-            return await interaction.followup.send(
-                "Вы не занимаете ни одного слота в этой пати.", 
-                ephemeral=True
-            )
-
-        if interaction.user.id == self.initiator.id and len([p for p in self.slots.values() if p != '[СВОБОДНО]']) == 1:
-             return await interaction.followup.send("Как создатель тикета, вы не можете покинуть слот, пока это единственный занятый слот. Вы можете только закрыть тикет.", ephemeral=True)
-
-        self.slots[slot_to_leave] = "[СВОБОДНО]"
-        
-        self._add_role_buttons()
-        embed = self._update_embed(interaction.message.embeds[0])
-        
-        await interaction.edit_original_response(embed=embed, view=self)
-        
-        await interaction.followup.send(
-            f"Вы успешно покинули слот **{slot_to_leave}**.", 
-            ephemeral=True
-        )
-
-
-# =================================================================
-# АРБИТРАЖ, КАСКАД, МОДАЛЬНЫЕ ОКНА И VIEW-КОНТЕЙНЕРЫ 
-# =================================================================
-
-class RoleSelect(discord.ui.Select):
-    """Dropdown для выбора первой роли инициатора (Арбитраж)."""
-    def __init__(self, bot, map_id_string: str, initiator: discord.Member):
-        self.bot = bot
-        self.map_id_string = map_id_string 
-        self.initiator = initiator
-        
-        options = [
-            discord.SelectOption(label=role, value=role)
-            for role in ARBITRAGE_SLOTS
-        ]
-        
-        super().__init__(placeholder="Займите свой первый слот...", options=options, row=0)
-
-    async def callback(self, interaction: discord.Interaction):
-        selected_role = self.values[0]
-        view = self.view 
-
-        try:
-            tier, map_name = self.map_id_string.split('|')
-        except ValueError:
-            return await interaction.response.send_message("❌ Ошибка формата данных карты.", ephemeral=True)
-            
-        map_data_object = next(
-            (item for item in MAP_TIERS_DATA.get(tier, []) if item['name'] == map_name),
-            None 
-        )
-
-        if not map_data_object:
-            return await interaction.response.send_message("❌ Не удалось найти данные карты.", ephemeral=True)
-
-        map_data_object["tier"] = tier
-        map_data_string = json.dumps(map_data_object) 
-        
-        lfg_channel_id = CONFIG.get('LFG_CHANNEL_ID')
-        if not lfg_channel_id:
-            return await interaction.response.send_message("❌ Канал поиска пати не настроен! Используйте `!set_lfg`.", ephemeral=True)
-            
-        lfg_channel = self.bot.get_channel(lfg_channel_id)
-        
-        await check_and_delete_old_ticket(self.initiator, lfg_channel)
-        
-        initial_slots = {role: "[СВОБОДНО]" for role in ARBITRAGE_SLOTS}
-        initial_slots[selected_role] = self.initiator 
-        
-        map_info_text = f"{map_data_object['tier']} | {map_data_object['name']} ({map_data_object['mission']})"
-        
-        initial_embed = discord.Embed(
-            title=f"⏳ Загрузка тикета: {map_info_text}", 
-            color=TIER_COLORS.get(map_data_object['tier'], discord.Color.gold())
-        )
-        
-        role_id = CONFIG.get('ARBITRAGE_ROLE_ID')
-        role_mention = f"<@&{role_id}>" if role_id else ""
-        
-        # Пингуем роль Арбитража и упомянаем создателя
-        sent_message = await lfg_channel.send(
-            f"{role_mention} | Пати на Арбитраж ищет игроков! Создатель: {self.initiator.mention} | Карта: **{map_info_text}**", 
-            embed=initial_embed
-        )
-        
-        ACTIVE_TICKETS[self.initiator.id] = sent_message.id
-        
-        lfg_view = PartyView(
-            self.bot, 
-            map_data_string, 
-            initial_slots, 
-            self.initiator, 
-            ARBITRAGE_SLOTS, 
-            sent_message.id,
-            comment=getattr(view, 'comment_text', None) 
-        )
-        initial_embed = lfg_view._update_embed(initial_embed) 
-        
-        await sent_message.edit(embed=initial_embed, view=lfg_view)
-
-        await interaction.response.edit_message(
-            content=f"🎉 **Тикет создан!** Вы заняли слот **{selected_role}**. Комментарий: {getattr(view, 'comment_text', 'Нет') or 'Нет'}. Проверьте канал {lfg_channel.mention} и ждите других игроков.",
-            view=None
-        )
-
-
-class TierSelect(discord.ui.Select):
-    """Dropdown для выбора конкретной карты внутри выбранного Тира (Шаг 2)."""
-    
-    def __init__(self, bot, map_tier: str, initiator: discord.Member):
-        self.bot = bot
-        self.map_tier = map_tier
-        self.initiator = initiator
-        
-        map_options = MAP_TIERS_DATA.get(map_tier, [])
-        
-        options = []
-        for item in map_options:
-            label = f"{item['name']} {item['faction']} ({item['mission']})"
-            value = f"{map_tier}|{item['name']}" 
-            options.append(discord.SelectOption(label=label, value=value))
-        
-        super().__init__(placeholder=f"Выберите карту в {map_tier}...", options=options, row=0)
-
-    async def callback(self, interaction: discord.Interaction):
-        map_id_string = self.values[0] # e.g., "S-ТИР|Casta"
-        _, map_name = map_id_string.split('|')
-        
-        await interaction.response.edit_message(
-            content=f"✅ Вы выбрали карту **{map_name}**.\n\n⏳ **Шаг 3: Займите свой стартовый слот (и добавьте коммент):**",
-            view=RoleSelectView(self.bot, map_id_string, self.initiator) 
-        )
-
-class MapSelect(discord.ui.Select):
-    """Dropdown для выбора Тира карты (Шаг 1)."""
-    def __init__(self, bot, initiator: discord.Member):
-        self.bot = bot
-        self.initiator = initiator
-        options = [
-            discord.SelectOption(label="S-Тир (Лучшие)", value="S-ТИР", emoji="🔥"),
-            discord.SelectOption(label="A-Тир (Средние)", value="A-ТИР", emoji="⭐"),
-            discord.SelectOption(label="B-Тир (Базовые)", value="B-ТИР", emoji="🔰")
-        ]
-        super().__init__(placeholder="Выберите Тир карты...", options=options)
-
-    async def callback(self, interaction: discord.Interaction):
-        selected_tier = self.values[0]
-        
-        await interaction.response.edit_message(
-            content=f"✅ Вы выбрали **{selected_tier}**.\n\n⏳ **Шаг 2: Выберите название карты:**",
-            view=TierSelectView(self.bot, selected_tier, self.initiator) 
-        )
-
-# =================================================================
-# КАСКАД: КЛАССЫ ВЫБОРА РОЛЕЙ
-# =================================================================
-
-class CascadeStartView(discord.ui.View):
-    """Упрощенный View для создания пати на Каскад. Автоматически занимает Слот 1."""
-    def __init__(self, bot, initiator: discord.Member):
-        super().__init__(timeout=600)
-        self.bot = bot
-        self.comment_text = None 
-        self.initiator = initiator # Сохраняем инициатора для кнопки запуска
-
-    @discord.ui.button(label="Создать пати 🚀", style=discord.ButtonStyle.success, row=0, custom_id="cascade_start_btn")
-    async def start_party_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        """Логика создания тикета: автоматически занимает Слот 1."""
-        
-        selected_role = "Слот 1" # Автоматически занимаем первый слот
-        initiator = self.initiator
-        map_info = "Каскад" 
-        
-        lfg_channel_id = CONFIG.get('LFG_CHANNEL_ID')
-        if not lfg_channel_id:
-            return await interaction.response.send_message("❌ Канал поиска пати не настроен. Используйте `!set_lfg`.", ephemeral=True)
-            
-        lfg_channel = self.bot.get_channel(lfg_channel_id)
-        
-        await check_and_delete_old_ticket(initiator, lfg_channel)
-
-        initial_slots = {role: "[СВОБОДНО]" for role in CASCAD_SLOTS}
-        initial_slots[selected_role] = initiator 
-        
-        initial_embed = discord.Embed(
-            title=f"⏳ Загрузка тикета: {map_info}", 
-            color=discord.Color.blue() 
-        )
-        
-        role_id = CONFIG.get('CASCAD_ROLE_ID')
-        role_mention = f"<@&{role_id}>" if role_id else ""
-        
-        ping_text = f"{role_mention} | Пати на **Каскад** ищет игроков! Создатель: {initiator.mention}"
-        
-        # Отправляем ephemeral ответ, чтобы сообщить о создании
-        await interaction.response.send_message(
-            f"🎉 **Тикет создан!** Вы заняли слот **{selected_role}** (Комм.: {self.comment_text if self.comment_text else 'Нет'}). Проверьте канал {lfg_channel.mention} и ждите других игроков.", 
-            ephemeral=True
-        )
-        
-        # Отправляем сообщение в LFG канал
-        sent_message = await lfg_channel.send(
-            ping_text, 
-            embed=initial_embed
-        )
-
-        ACTIVE_TICKETS[initiator.id] = sent_message.id
-        
-        lfg_view = PartyView(
-            self.bot, 
-            map_info, 
-            initial_slots, 
-            initiator, 
-            CASCAD_SLOTS, 
-            sent_message.id,
-            comment=self.comment_text 
-        )
-        initial_embed = lfg_view._update_embed(initial_embed) 
-        await sent_message.edit(embed=initial_embed, view=lfg_view)
-
-    @discord.ui.button(label="Добавить коммент 📝", style=discord.ButtonStyle.secondary, row=1)
-    async def add_comment_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        modal = CommentModal(view=self)
-        await interaction.response.send_modal(modal)
-
-# =================================================================
-# МОДАЛЬНЫЕ ОКНА
-# =================================================================
-
-class CommentModal(discord.ui.Modal, title='Добавить комментарий к тикету'):
-    """Модальное окно для ввода комментария."""
-    
-    comment_input = discord.ui.TextInput(
-        label='Ваш комментарий (до 100 символов)',
-        style=discord.TextStyle.short,
-        placeholder='Например: +Каскад, Нужен хил, 4x60 и т.д.',
-        required=False,
-        max_length=100,
-    )
-
-    def __init__(self, view: discord.ui.View):
-        super().__init__()
-        self.view = view 
-
-    async def on_submit(self, interaction: discord.Interaction):
-        self.view.comment_text = self.comment_input.value
-        
-        comment_display = f"✅ **Комментарий добавлен:** *{self.comment_input.value}*" if self.comment_input.value else "Комментарий удален."
-
-        # Разделяем контент по двойному переводу строки, чтобы не дублировать старый коммент
-        current_content = interaction.message.content.split('\n\n')[0]
-        
-        await interaction.response.edit_message(
-            content=f"{current_content}\n\n{comment_display}",
-            view=self.view
-        )
-
-# =================================================================
-# VIEW-КОНТЕЙНЕРЫ (С НОВЫМ ПОЛЕМ comment_text)
-# =================================================================
-
-class TierSelectView(discord.ui.View):
-    """View-контейнер для TierSelect."""
-    def __init__(self, bot, map_tier: str, initiator: discord.Member):
-        super().__init__(timeout=600) 
-        self.bot = bot
-        self.add_item(TierSelect(bot, map_tier, initiator))
-
-class RoleSelectView(discord.ui.View):
-    """View-контейнер для RoleSelect."""
-    def __init__(self, bot, map_id_string: str, initiator: discord.Member):
-        super().__init__(timeout=600)
-        self.bot = bot
-        self.map_id_string = map_id_string
-        self.initiator = initiator
-        self.comment_text = None 
-
-        self.add_item(RoleSelect(bot, map_id_string, initiator))
-
-    @discord.ui.button(label="Добавить коммент 📝", style=discord.ButtonStyle.secondary, row=1)
-    async def add_comment_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        modal = CommentModal(view=self)
-        await interaction.response.send_modal(modal)
-
-
-class MapSelectView(discord.ui.View):
-    """View-контейнер для MapSelect."""
-    def __init__(self, bot, initiator: discord.Member):
-        super().__init__(timeout=600)
-        self.bot = bot
-        self.add_item(MapSelect(bot, initiator))
-
-
-class MainNavigationView(discord.ui.View):
-    """Главный View для канала навигации, содержит кнопки выбора миссий."""
-    def __init__(self, bot):
-        super().__init__(timeout=None)
-        self.bot = bot
-
-    @discord.ui.button(label="Найти пати: АРБИТРАЖ", style=discord.ButtonStyle.green, custom_id="arbitrage_start", row=0)
-    async def arbitrage_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        
-        if not CONFIG.get('LFG_CHANNEL_ID'):
-            return await interaction.response.send_message("❌ Канал поиска пати не настроен. Попросите администратора использовать `!set_lfg`.", ephemeral=True)
-            
-        await interaction.response.send_message(
-            "⏳ **Шаг 1: Выберите Тир текущей карты Арбитража:**",
-            view=MapSelectView(self.bot, interaction.user),
-            ephemeral=True
-        )
-
-    @discord.ui.button(label="Найти пати: КАСКАД", style=discord.ButtonStyle.blurple, custom_id="cascade_start", row=0)
-    async def cascade_button(self, interaction: discord.Interaction, button: discord.ui.Button): 
-        
-        if not CONFIG.get('LFG_CHANNEL_ID'):
-            return await interaction.response.send_message("❌ Канал поиска пати не настроен. Попросите администратора использовать `!set_lfg`.", ephemeral=True)
-            
-        await interaction.response.send_message(
-            "⏳ **Настройка пати на Каскад.** .\n\nНажмите **'Создать пати'** или сначала добавьте комментарий:",
-            view=CascadeStartView(self.bot, interaction.user),
-            ephemeral=True
-        )
-
-# =================================================================
-# 5. АДМИНИСТРАТИВНЫЕ КОМАНДЫ ДЛЯ НАСТРОЙКИ
-# =================================================================
-
-requires_admin = commands.has_permissions(manage_guild=True)
-
-@bot.command(name='set_nav')
-@requires_admin
-async def set_nav_channel(ctx, channel: discord.TextChannel):
-    """
-    [ИСПРАВЛЕНО] Устанавливает канал навигации и отправляет стартовое сообщение 
-    только по команде, а не при каждом запуске.
-    """
-    global CONFIG
-    
-    # 1. Проверяем и удаляем старое сообщение (если оно было в этом канале)
-    async for message in channel.history(limit=5):
-        if message.author.id == ctx.bot.user.id and message.embeds:
-            embed_title = message.embeds[0].title
-            if embed_title and "СИСТЕМА ПОДБОРА ПАТИ WARFRAME" in embed_title:
-                try:
-                    await message.delete()
-                    await ctx.send(f"⚠️ Старое сообщение навигации в канале {channel.mention} удалено.")
-                except Exception:
-                    pass
-
-    # 2. Сохраняем ID канала в конфигурацию
-    CONFIG['NAV_CHANNEL_ID'] = channel.id
-    save_config(CONFIG)
-
-    # 3. Отправляем новое сообщение навигации с кнопками
-    embed = discord.Embed(
-        title="⬇️ СИСТЕМА ПОДБОРА ПАТИ WARFRAME ⬇️",
-        description="Нажмите кнопку, чтобы начать сбор группы для миссий **Арбитраж** или **Каскад**.",
-        color=discord.Color.dark_red()
-    )
-    
-    if NAV_IMAGE_URL:
-        embed.set_image(url=NAV_IMAGE_URL)
-        
-    embed.set_footer(text="Автоматическое удаление тикетов через 1 час (требуется !set_lfg).")
-    
-    await channel.send(
-        embed=embed,
-        view=MainNavigationView(ctx.bot)
-    )
-
-    await ctx.send(f"✅ Канал навигации установлен и стартовое окно отправлено: {channel.mention}.")
-
-
-@bot.command(name='set_lfg')
-@requires_admin
-async def set_lfg_channel(ctx, channel: discord.TextChannel):
-    global CONFIG
-    CONFIG['LFG_CHANNEL_ID'] = channel.id
-    save_config(CONFIG)
-    await ctx.send(f"✅ Канал поиска пати установлен: {channel.mention}. ID сохранен.")
-
-@bot.command(name='set_role')
-@requires_admin
-async def set_arbitrage_role(ctx, role: discord.Role):
-    global CONFIG
-    CONFIG['ARBITRAGE_ROLE_ID'] = role.id
-    save_config(CONFIG)
-    await ctx.send(f"✅ Роль для пинга Арбитража установлена: {role.mention}. ID сохранен.")
-
-@bot.command(name='set_cascade_role')
-@requires_admin
-async def set_cascade_role(ctx, role: discord.Role):
-    global CONFIG
-    CONFIG['CASCAD_ROLE_ID'] = role.id
-    save_config(CONFIG)
-    await ctx.send(f"✅ Роль для пинга Каскада установлена: {role.mention}. ID сохранен.")
-
-@bot.command(name='set_map_role') 
-@requires_admin
-async def set_map_role(ctx, map_name: str, role: discord.Role):
-    """Устанавливает роль для пинга конкретной карты Арбитража."""
-    global CONFIG
-    
-    formatted_map_name = map_name.capitalize() 
-
-    is_valid_map = any(
-        formatted_map_name in [m['name'] for m in tier_maps]
-        for tier_maps in MAP_TIERS_DATA.values()
-    )
-
-    if not is_valid_map:
-        await ctx.send(f"❌ Карта с именем **{formatted_map_name}** не найдена в списке карт Арбитража. Проверьте правильность написания.")
-        return
-
-    CONFIG['MAP_ROLES'][formatted_map_name] = role.id
-    save_config(CONFIG)
-    await ctx.send(f"✅ Роль для карты **{formatted_map_name}** установлена: {role.mention}. ID сохранен.")
-
-
-@bot.event
-async def on_command_error(ctx, error):
-    if isinstance(error, commands.MissingPermissions):
-        await ctx.send("❌ У вас нет прав `Управлять сервером` для выполнения этой команды.")
-    elif isinstance(error, commands.BadArgument):
-        await ctx.send("❌ Неверный аргумент. Укажите канал или роль, например: `!set_nav #канал` или `!set_map_role Casta @роль`.")
-    else:
-        print(f"Ошибка в команде: {error}")
-        
-# =================================================================
-# 6. ЗАПУСК БОТА (ФИНАЛЬНАЯ ВЕРСИЯ С KEEP-ALIVE)
-# =================================================================
-
-@bot.event
-async def on_ready():
-    """
-    [ИСПРАВЛЕНО] Теперь on_ready только регистрирует MainNavigationView, 
-    чтобы обеспечить работу кнопок после перезапуска.
-    Отправка сообщения перенесена в !set_nav.
-    """
-    print(f'Бот готов: {bot.user}')
-    
-    # Регистрируем View для постоянных кнопок.
-    bot.add_view(MainNavigationView(bot)) 
-    
-    print("Логика отправки навигационного сообщения перенесена в команду !set_nav.")
-
-
-# ----------------- Блок Веб-Сервера -----------------
-
-async def handle(request):
-    """Минимальный обработчик запроса для Render."""
-    return web.Response(text="Bot is running!")
-
-async def start_server():
-    """Запускает веб-сервер, который будет слушать порт, предоставленный хостом."""
-    # Render предоставляет порт через переменную окружения PORT
-    port = int(os.environ.get('PORT', 8080))
-    app = web.Application()
-    app.add_routes([web.get('/', handle)])
-    
-    # Запускаем сервер
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', port)
-    
-    print(f"✅ Web server started on port {port}")
-    await site.start()
-
-# ----------------- Блок Self-Ping (Ход Конем) -----------------
-
-async def keep_alive_ping():
-    """Периодически отправляет HTTP-запрос самому себе, чтобы не дать сервису заснуть."""
-    # Переменная окружения должна быть установлена на Render
-    external_url = os.environ.get('EXTERNAL_URL')
-    
-    if not external_url:
-        print("⚠️ Предупреждение: Переменная EXTERNAL_URL не установлена. Бот может заснуть.")
-        return
-
-    # Используем aiohttp для асинхронного пинга
-    async with ClientSession() as session:
-        while True:
-            # Пингуем каждые 14 минут (меньше, чем 15-минутный лимит Render)
-            await asyncio.sleep(5 * 60) 
-            try:
-                # Отправляем HEAD запрос, чтобы не тратить лишний трафик
-                async with session.get(external_url) as response:
-                    print(f"📡 Self-ping OK: Status {response.status}")
-            except Exception as e:
-                print(f"❌ Ошибка при самопинге: {e}. Проверьте правильность EXTERNAL_URL.")
-
-
-# ----------------- Главная точка запуска -----------------
-
-async def main():
-    """Запускает Discord-бота, веб-сервер и self-ping одновременно."""
-    if not BOT_TOKEN:
-        print("\n\n-- ОШИБКА ЗАПУСКА --")
-        print("Бот не был запущен, так как переменная окружения 'BOT_TOKEN' не установлена.")
-        return
-
-    # asyncio.gather запускает все задачи параллельно
-    await asyncio.gather(
-        bot.start(BOT_TOKEN),
-        start_server(),
-        keep_alive_ping() 
-    )
-
-
-if __name__ == '__main__':
-    try:
-        # discord.py требует запуск через asyncio.run()
-        asyncio.run(main())
-    except discord.errors.LoginFailure:
-        print("\n\n-- ОШИБКА АВТОРИЗАЦИИ --")
-        print("Проверьте, правильно ли вы установили переменную окружения 'BOT_TOKEN'!")
-    except KeyboardInterrupt:
-        print("Бот остановлен вручную.")
-    except Exception as e:
-        print(f"Критическая ошибка при запуске: {e}")
-
-
-
-
+import discord
+from discord.ext import commands
+from discord import app_commands
+import abc
+import json
+import sqlite3
+import time
+import heapq
+import bisect
+import contextlib
+import functools
+import itertools
+import logging
+import tempfile
+import sys
+import threading
+import traceback
+import hmac
+import multiprocessing
+import queue
+import signal
+import socket
+from array import array
+try:
+    import resource # Только для замера памяти в on_ready (есть на Linux/Render)
+except ImportError:
+    resource = None
+try:
+    from nacl.signing import VerifyKey # Только для INTERACTIONS_MODE=http (проверка подписи Discord)
+    from nacl.exceptions import BadSignatureError
+except ImportError:
+    VerifyKey = None
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from collections import Counter, deque
+from typing import Dict, Any, Awaitable, Callable, Iterable, Iterator, Optional, NamedTuple, Tuple
+import os # <-- Необходим для чтения переменных окружения (BOT_TOKEN, EXTERNAL_URL, PORT)
+import asyncio # <-- Необходим для асинхронного запуска бота и веб-сервера
+from aiohttp import web, ClientSession, ClientTimeout # <-- Необходим для веб-сервера и самопинга
+
+# =================================================================
+# 1. КОНСТАНТЫ И НАСТРОЙКИ
+# =================================================================
+
+# ВАЖНОЕ ИЗМЕНЕНИЕ: Токен считывается из переменной окружения 'BOT_TOKEN' на Render.
+BOT_TOKEN = os.environ.get('BOT_TOKEN')
+if not BOT_TOKEN:
+    print("❌ ВНИМАНИЕ: Переменная окружения 'BOT_TOKEN' не найдена. Бот не сможет запуститься.")
+
+CONFIG_FILE = 'config.json' # Старый общий файл настроек (односерверный режим), используется для миграции
+GUILD_CONFIG_DIR = os.environ.get('GUILD_CONFIG_DIR', 'guild_configs') # Настройки каждого сервера: <guild_id>.json
+CONFIG_FLUSH_DELAY = 1.0 # Задержка (сек), за которую изменения настроек склеиваются в одну запись
+TICKETS_DB = os.environ.get('TICKETS_DB', 'tickets.db') # SQLite-хранилище открытых тикетов
+MISSIONS_FILE = os.environ.get('MISSIONS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'missions.json')) # Каталог миссий: слоты, карты, цвета, иконки
+MISSIONS_POLL_INTERVAL = 5 # Как часто (сек) проверяется, не изменился ли файл каталога миссий
+LFG_TIMEOUT = 3600 # 1 час (в секундах)
+EXPIRY_BATCH_WINDOW = 5 # Тикеты, истекающие в пределах этого окна (сек), удаляются одной пачкой
+RENDER_DEBOUNCE = 0.25 # Окно (сек), в котором правки одного тикета склеиваются в одно редактирование
+REST_BUCKET_CONCURRENCY = 2 # Сколько REST-запросов одного маршрута к одному каналу выполняются одновременно
+REST_MAX_RATELIMIT_WAIT = 30.0 # Дольше этого (сек) discord.py не ждет 429 сам, а отдает discord.RateLimited планировщику (меньше 30 не принимает)
+DELETE_BATCH_WINDOW = 1.0 # Окно (сек), за которое фоновые удаления сообщений канала склеиваются в bulk delete
+EMBED_TEMPLATE_CACHE_SIZE = 256 # Сколько шаблонов Embed (по одному на миссию) держать в LRU-кэше
+MATCHMAKING_TIMEOUT = LFG_TIMEOUT # Сколько игрок ждет в очереди авто-подбора, прежде чем выпасть из нее
+LOOP_STALL_THRESHOLD = float(os.environ.get('LOOP_STALL_THRESHOLD', 1.0)) # Лаг цикла событий (сек), после которого в лог пишется стек
+DM_WORKERS = 4 # Воркеры рассылки личных уведомлений подписчикам
+DM_RATE = 5.0 # Не больше стольких личных сообщений в секунду на весь процесс
+DM_QUEUE_LIMIT = 10000 # Предел очереди уведомлений; сверх него уведомления отбрасываются
+WORLDSTATE_URL = os.environ.get('WORLDSTATE_URL', 'https://api.warframestat.us/pc/arbitration') # API текущего Арбитража; пустая строка выключает
+WORLDSTATE_FILE = os.environ.get('WORLDSTATE_FILE') # JSON-файл вместо API (работа без сети); важнее WORLDSTATE_URL
+WORLDSTATE_TTL = 60 # Через сколько секунд закэшированная карта Арбитража обновляется в фоне
+WORLDSTATE_MAX_STALE = 3600 # Дольше этого карта без известного времени ротации не предлагается
+WORLDSTATE_RETRY = 30 # Пауза (сек) перед новым запросом после ошибки источника
+WORLDSTATE_FETCH_TIMEOUT = 5 # Таймаут запроса к API состояния мира (сек)
+INTERACTIONS_MODE = os.environ.get('INTERACTIONS_MODE', 'gateway') # 'http' — взаимодействия приходят POST-запросами на /interactions
+DISCORD_PUBLIC_KEY = os.environ.get('DISCORD_PUBLIC_KEY') # Публичный ключ приложения (hex) для проверки подписи взаимодействий
+DISCORD_API_BASE = os.environ.get('DISCORD_API_BASE', 'https://discord.com/api/v10') # REST API Discord для воркеров HTTP-режима
+INTERACTION_WORKERS = int(os.environ.get('INTERACTION_WORKERS', 2)) # Процессы-воркеры для нажатий кнопок тикетов
+INTERACTION_QUEUE_LIMIT = 1000 # Предел очереди одного воркера; сверх него игрок получает «бот перегружен»
+INTERACTION_MAX_SKEW = 300 # Взаимодействия с меткой времени старше этого (сек) отклоняются как повтор
+INTERACTION_REST_TIMEOUT = 10 # Таймаут REST-запроса воркера (сек)
+INTERACTION_LOCAL_BUDGET = 2.5 # Сколько (сек) ждать первого ответа меню навигации, прежде чем ответить на POST отложенным ответом
+INTERACTION_TOKEN_TTL = 900 # Токен взаимодействия живет 15 минут — дольше меню без timeout не хранятся
+SHUTDOWN_GRACE = 20 # Сколько (сек) остановка ждет начатые действия и очереди REST, прежде чем закрыться
+HANDOFF_HEARTBEAT = 5 # Как часто (сек) работающий процесс продлевает аренду в базе тикетов
+HANDOFF_WAIT = 60 # Дольше этого (сек) новый процесс не ждет, пока прежний передаст работу
+SWEEP_INTERVAL = 6 * 3600 # Как часто (сек) каналы LFG сверяются с базой тикетов (первый раз — сразу после запуска)
+SWEEP_CONCURRENCY = 2 # Сколько каналов сверяются одновременно
+SWEEP_BULK_MAX_AGE = 14 * 24 * 3600 - 600 # Старше этого (сек) Discord не удаляет пачкой; запас 10 минут
+LFG_PAGE_SIZE = 10 # Тикетов на одной странице списка !lfg
+SLOT_WAITLIST_LIMIT = 10 # Сколько игроков может стоять в очереди на один занятый слот
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN') # Токен для /debug/profile; без него маршрут выключен
+
+# --- ИЗОБРАЖЕНИЯ ДЛЯ СТИЛИЗАЦИИ ---
+NAV_IMAGE_URL = 'https://avatars.mds.yandex.net/i?id=bfb7df6ab9ff7534c87f3996ad64e2cb_l-5869570-images-thumbs&n=13'
+
+# --- КАТАЛОГ МИССИЙ (слоты, карты, цвета и иконки живут в MISSIONS_FILE) ---
+MISSION_ARBITRATION = "arbitration" # Единственная миссия с картами: выбор карты, роли карт, состояние мира
+MISSION_CASCADE = "cascade"
+MAX_TICKET_SLOTS = 5 # Кнопки «Бронь» занимают один ряд сообщения, а в ряду не больше 5 кнопок
+
+@dataclass(frozen=True, slots=True)
+class MapEntry:
+    """Неизменяемая запись о карте Арбитража."""
+    tier: str
+    name: str
+    faction: str
+    mission: str
+    tileset: str
+    color: int = 0                # цвет Embed (по тиру)
+    icon: Optional[str] = None    # миниатюра Embed (по фракции)
+
+    @property
+    def key(self) -> str:
+        return f"{self.tier}|{self.name}"
+
+    @property
+    def title(self) -> str:
+        return f"{self.tier} | {self.name} ({self.mission})"
+
+
+@dataclass(frozen=True, slots=True)
+class TierInfo:
+    """Тир карт Арбитража: подпись и эмодзи в меню выбора, цвет Embed."""
+    name: str
+    label: str
+    emoji: Optional[str]
+    color: int
+
+
+@dataclass(frozen=True, slots=True)
+class MissionSpec:
+    """Описание миссии из каталога: все, что нужно для создания и отрисовки ее тикетов."""
+    kind: str
+    title: str
+    slots: Tuple[str, ...]
+    pick_slot: bool               # False — создатель сразу занимает первый слот
+    slot_icon: str
+    color: int
+    summary_color: int
+    emoji: Optional[str] = None
+    role_setting: Optional[str] = None  # ключ настроек сервера с ролью для пинга
+    thumbnail: Optional[str] = None
+    fields: Tuple[Tuple[str, str], ...] = ()  # статичные поля Embed тикета (без карты)
+    summary: Tuple[str, ...] = ()             # строки описания итогового Embed (без карты)
+
+
+@dataclass(frozen=True, slots=True)
+class MissionDescriptor:
+    """
+    Типизированное описание миссии тикета (вместо JSON-строки map_info).
+    Хранит саму MissionSpec, а не ссылку на каталог: тикет, созданный до
+    перезагрузки каталога, дорисовывается по тем данным, с которыми создан.
+    """
+    spec: MissionSpec
+    map: Optional[MapEntry] = None
+
+    @property
+    def kind(self) -> str:
+        return self.spec.kind
+
+    @property
+    def key(self) -> str:
+        return f"{self.kind}:{self.map.key}" if self.map else self.kind
+
+    @property
+    def title(self) -> str:
+        return self.map.title if self.map else self.spec.title
+
+
+def _parse_color(value: str) -> int:
+    return int(str(value).lstrip('#'), 16)
+
+
+class MissionCatalog:
+    """
+    Снимок каталога миссий со всеми индексами. Строится целиком из JSON и проверяется
+    в конструкторе (ValueError с описанием ошибки); после постройки не меняется.
+    """
+    __slots__ = ('missions', 'tiers', 'maps_by_tier', 'map_catalog', 'map_by_name', 'missions_by_key', 'mtime')
+
+    def __init__(self, raw: Dict[str, Any], mtime: float = 0.0):
+        self.mtime = mtime
+        self.missions: Dict[str, MissionSpec] = {}              # kind -> миссия, в порядке файла
+        self.tiers: Dict[str, TierInfo] = {}                    # тир -> подпись и цвет
+        self.maps_by_tier: Dict[str, Tuple[MapEntry, ...]] = {} # тир -> карты в порядке файла
+        self.map_catalog: Dict[Tuple[str, str], MapEntry] = {}  # (тир, название) -> карта
+        self.map_by_name: Dict[str, MapEntry] = {}              # название в нижнем регистре -> карта
+        self.missions_by_key: Dict[str, MissionDescriptor] = {} # MissionDescriptor.key -> миссия
+        try:
+            self._build(raw)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{type(e).__name__}: {e}") from e
+
+    def _build(self, raw: Dict[str, Any]):
+        for tier, info in raw.get('tiers', {}).items():
+            self.tiers[tier] = TierInfo(tier, info.get('label', tier), info.get('emoji'), _parse_color(info['color']))
+        icons = raw.get('faction_icons', {})
+
+        for item in raw['missions']:
+            kind = item['kind']
+            if kind in self.missions:
+                raise ValueError(f"миссия {kind} описана дважды")
+            slots = tuple(item['slots'])
+            if not 0 < len(slots) <= MAX_TICKET_SLOTS or len(set(slots)) != len(slots):
+                raise ValueError(f"у миссии {kind} должно быть от 1 до {MAX_TICKET_SLOTS} разных слотов")
+            spec = MissionSpec(
+                kind=kind,
+                title=item['title'],
+                slots=slots,
+                pick_slot=item.get('pick_slot', True),
+                slot_icon=item.get('slot_icon', "⚙️"),
+                color=_parse_color(item['color']),
+                summary_color=_parse_color(item.get('summary_color', item['color'])),
+                emoji=item.get('emoji'),
+                role_setting=item.get('role_setting'),
+                thumbnail=item.get('thumbnail'),
+                fields=tuple((field['name'], field['value']) for field in item.get('fields', ())),
+                summary=tuple(item.get('summary', ())),
+            )
+            self.missions[kind] = spec
+
+            if 'maps' in item and kind != MISSION_ARBITRATION:
+                raise ValueError(f"карты поддерживаются только у миссии {MISSION_ARBITRATION}")
+            if kind != MISSION_ARBITRATION:
+                self.missions_by_key[kind] = MissionDescriptor(spec)
+                continue
+
+            for tier, maps in item['maps'].items():
+                if tier not in self.tiers:
+                    raise ValueError(f"тир {tier} не описан в разделе tiers")
+                if not 0 < len(maps) <= 25:
+                    raise ValueError(f"в тире {tier} должно быть от 1 до 25 карт (предел меню Discord)")
+                self.maps_by_tier[tier] = tuple(
+                    MapEntry(tier=tier, name=entry['name'], faction=entry['faction'], mission=entry['mission'],
+                             tileset=entry['tileset'], color=self.tiers[tier].color, icon=icons.get(entry['faction']))
+                    for entry in maps
+                )
+                for entry in self.maps_by_tier[tier]:
+                    if entry.name.lower() in self.map_by_name:
+                        raise ValueError(f"карта {entry.name} встречается дважды")
+                    self.map_catalog[(tier, entry.name)] = entry
+                    self.map_by_name[entry.name.lower()] = entry
+                    mission = MissionDescriptor(spec, entry)
+                    self.missions_by_key[mission.key] = mission
+
+        for kind in (MISSION_ARBITRATION, MISSION_CASCADE):
+            if kind not in self.missions:
+                raise ValueError(f"нет обязательной миссии {kind} (на нее ведут кнопки навигации)")
+        if not self.maps_by_tier:
+            raise ValueError(f"у миссии {MISSION_ARBITRATION} нет карт")
+
+    def mission(self, kind: str) -> MissionDescriptor:
+        """Миссия без карты (для Арбитража — описание без выбранной карты)."""
+        return self.missions_by_key.get(kind) or MissionDescriptor(self.missions[kind])
+
+
+class MissionRegistry:
+    """
+    Текущий каталог миссий. Файл перечитывается при смене mtime: новый каталог
+    строится и проверяется целиком и только потом заменяет старый одним присваиванием.
+    Ошибочный файл отклоняется, и бот продолжает работать со старым каталогом.
+    Открытые тикеты держат свои MissionDescriptor и слоты и перезагрузку не замечают.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.current = self._load()
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+        self._rejected_mtime = None
+
+    def _load(self) -> MissionCatalog:
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return MissionCatalog(json.load(f), mtime)
+
+    def _swap(self, catalog: MissionCatalog):
+        self.current = catalog
+        self.reloads += 1
+        self.last_error = None
+        print(f"🗺️ Каталог миссий перезагружен: миссий {len(catalog.missions)}, карт {len(catalog.map_catalog)}.")
+
+    def reload(self) -> Optional[str]:
+        """Перечитывает файл сразу (для !reload_missions). Возвращает текст ошибки или None."""
+        try:
+            self._swap(self._load())
+        except (OSError, ValueError) as e:
+            self.last_error = str(e)
+            return self.last_error
+        return None
+
+    async def run(self):
+        """Следит за mtime файла каталога; чтение и проверка идут в потоке, цикл событий не ждет диск."""
+        while True:
+            await asyncio.sleep(MISSIONS_POLL_INTERVAL)
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                continue
+            if mtime == self.current.mtime or mtime == self._rejected_mtime:
+                continue
+            try:
+                self._swap(await asyncio.to_thread(self._load))
+            except (OSError, ValueError) as e:
+                self._rejected_mtime = mtime
+                self.last_error = str(e)
+                print(f"❌ Каталог миссий {self.path} не принят, работает прежний: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "missions": len(self.current.missions),
+            "maps": len(self.current.map_catalog),
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
+
+
+MISSIONS = MissionRegistry(MISSIONS_FILE)
+
+
+def mission_slots(mission: MissionDescriptor) -> Tuple[str, ...]:
+    """Набор слотов миссии."""
+    return mission.spec.slots
+
+
+def mission_from_stored(raw: str) -> Optional[MissionDescriptor]:
+    """Восстанавливает миссию по ключу из базы (понимает и старый формат map_info)."""
+    catalog = MISSIONS.current
+    if raw in catalog.missions_by_key:
+        return catalog.missions_by_key[raw]
+    if raw == "Каскад":
+        return catalog.missions_by_key.get(MISSION_CASCADE)
+    try:
+        legacy = json.loads(raw)
+        entry = catalog.map_catalog.get((legacy['tier'], legacy['name']))
+    except (json.JSONDecodeError, TypeError, KeyError):
+        return None
+    return catalog.missions_by_key[f"{MISSION_ARBITRATION}:{entry.key}"] if entry else None
+
+# =================================================================
+# 2. ФУНКЦИИ УПРАВЛЕНИЯ КОНФИГУРАЦИЕЙ
+# =================================================================
+
+DEFAULT_CONFIG = {
+    "NAV_CHANNEL_ID": None,
+    "LFG_CHANNEL_ID": None,
+    "ARBITRAGE_ROLE_ID": None,
+    "CASCAD_ROLE_ID": None,
+    "MAP_ROLES": {}
+}
+
+
+def _atomic_write(path: str, text: str):
+    """Пишет файл атомарно: временный файл рядом + fsync + os.replace."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _read_text(path: str) -> Optional[str]:
+    """Содержимое файла или None, если его нет."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class ConfigStore:
+    """
+    Настройки бота в JSON-файле. Изменения не пишутся на диск сразу:
+    mark_dirty() откладывает запись на CONFIG_FLUSH_DELAY, и серия команд
+    администратора превращается в одну атомарную запись в потоке-исполнителе,
+    не блокируя цикл событий.
+    """
+
+    def __init__(self, path: str, defaults: Dict[str, Any], raw: Optional[str], seed: Optional[Dict[str, Any]] = None):
+        # raw — уже прочитанное содержимое файла (None — файла нет): диск здесь не читается
+        self.path = path
+        self.data = json.loads(json.dumps(defaults))
+        self._dirty = False
+        self._flush_task = None
+        self._load(seed, raw)
+
+    def _serialize(self) -> str:
+        return json.dumps(self.data, indent=4)
+
+    def _load(self, seed: Optional[Dict[str, Any]], raw: Optional[str]):
+        """
+        Применяет содержимое файла (raw, None — файла нет) и гарантирует наличие всех ключей.
+        Файл переписывается через отложенную запись и только если он изменился;
+        для нового сервера без настроек файл не создается.
+        """
+        if raw is None:
+            if not seed:
+                return
+            self.data.update(seed)
+        else:
+            try:
+                self.data.update(json.loads(raw))
+            except json.JSONDecodeError:
+                print(f"⚠️ Файл {self.path} поврежден, сохраняю копию в {self.path}.corrupt и использую настройки по умолчанию.")
+                os.replace(self.path, f"{self.path}.corrupt")
+                raw = None
+
+        if self._serialize() != raw:
+            self.mark_dirty()
+
+    def mark_dirty(self):
+        """Помечает настройки измененными и планирует отложенную запись (вне цикла событий — до flush())."""
+        self._dirty = True
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(CONFIG_FLUSH_DELAY)
+        await self.flush()
+
+    async def flush(self):
+        """Сразу записывает накопленные изменения (например, перед остановкой бота)."""
+        loop = asyncio.get_running_loop()
+        while self._dirty:
+            self._dirty = False
+            await loop.run_in_executor(None, _atomic_write, self.path, self._serialize())
+
+
+class GuildConfigRegistry:
+    """
+    Настройки по серверам: файлы GUILD_CONFIG_DIR/<guild_id>.json читаются
+    заранее в потоке-исполнителе (preload в on_ready и при входе на сервер) и дальше
+    берутся из кэша; синхронное чтение остается запасным путем для сервера, которого
+    еще нет в кэше. Если у сервера нет файла, а старый config.json указывает на его
+    каналы, настройки переносятся.
+    """
+
+    def __init__(self, directory: str, legacy_path: str):
+        self.directory = directory
+        self.legacy_path = legacy_path
+        self._stores: Dict[int, ConfigStore] = {}
+        self._legacy = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, guild_id: int) -> str:
+        return os.path.join(self.directory, f"{guild_id}.json")
+
+    def _read_legacy(self):
+        if self._legacy is None:
+            try:
+                self._legacy = json.loads(_read_text(self.legacy_path) or '{}')
+            except json.JSONDecodeError:
+                self._legacy = {}
+
+    def _legacy_seed(self, guild_id: int) -> Optional[Dict[str, Any]]:
+        self._read_legacy()
+        for key in ('LFG_CHANNEL_ID', 'NAV_CHANNEL_ID'):
+            channel = bot.get_channel(self._legacy.get(key) or 0)
+            if channel is not None and channel.guild.id == guild_id:
+                return self._legacy
+        return None
+
+    def store(self, guild_id: int) -> ConfigStore:
+        store = self._stores.get(guild_id)
+        if store is None:
+            store = self._create(guild_id, _read_text(self._path(guild_id)))
+        return store
+
+    def _create(self, guild_id: int, raw: Optional[str]) -> ConfigStore:
+        seed = None if raw is not None else self._legacy_seed(guild_id)
+        store = self._stores[guild_id] = ConfigStore(self._path(guild_id), DEFAULT_CONFIG, raw, seed=seed)
+        return store
+
+    def _read_many(self, guild_ids: list) -> Dict[int, Optional[str]]:
+        self._read_legacy()
+        return {guild_id: _read_text(self._path(guild_id)) for guild_id in guild_ids}
+
+    async def preload(self, guild_ids: Iterable[int]):
+        """Читает файлы настроек серверов в потоке-исполнителе, чтобы обращения из обработчиков не трогали диск."""
+        missing = [guild_id for guild_id in guild_ids if guild_id not in self._stores]
+        if not missing:
+            return
+        loop = asyncio.get_running_loop()
+        for guild_id, raw in (await loop.run_in_executor(None, self._read_many, missing)).items():
+            if guild_id not in self._stores:
+                self._create(guild_id, raw)
+
+    def get(self, guild_id: int) -> Dict[str, Any]:
+        return self.store(guild_id).data
+
+    async def flush_all(self):
+        for store in list(self._stores.values()):
+            await store.flush()
+
+
+GUILD_CONFIGS = GuildConfigRegistry(GUILD_CONFIG_DIR, CONFIG_FILE)
+
+# =================================================================
+# 3. ИНИЦИАЛИЗАЦИЯ БОТА И НАМЕРЕНИЯ (INTENTS)
+# =================================================================
+
+_PROCESS_STARTED = time.perf_counter()
+
+# LEAN_MODE: без привилегированных intents и кэша участников. Бот работает только
+# через взаимодействия (кнопки, меню, слэш-команды), список участников серверов
+# не скачивается и не хранится, сообщения не кэшируются. Без guild_messages и
+# message_content текст сообщений не приходит, поэтому префиксные формы команд
+# (!lfg, !subscribe, !set_lfg, ...) молчат — все команды гибридные и доступны как /lfg, /set_lfg.
+LEAN_MODE = os.environ.get('LEAN_MODE', '').lower() in ('1', 'true', 'yes')
+SYNC_APP_COMMANDS = os.environ.get('SYNC_APP_COMMANDS', '1').lower() in ('1', 'true', 'yes')
+
+if LEAN_MODE:
+    intents = discord.Intents.none()
+    intents.guilds = True
+    bot_options = dict(
+        member_cache_flags=discord.MemberCacheFlags.none(),
+        chunk_guilds_at_startup=False,
+        max_messages=None,
+    )
+    print("ℹ️ LEAN_MODE: команды доступны только как слэш-команды (/lfg, /set_lfg, ...), префикс ! не работает.")
+    if not SYNC_APP_COMMANDS:
+        print("⚠️ LEAN_MODE при SYNC_APP_COMMANDS=0: слэш-команды должны быть уже синхронизированы, иначе команд у бота не будет.")
+else:
+    intents = discord.Intents.default()
+    intents.members = True
+    intents.message_content = True
+    bot_options = {}
+
+# --- ШАРДИРОВАНИЕ ---
+# SHARD_COUNT — общее число шардов, SHARD_IDS — шарды этого процесса ("0-3" или "0,2,5").
+# Несколько процессов на одной машине делят между собой пространство серверов.
+def _parse_shard_ids(raw: Optional[str]) -> Optional[list]:
+    if not raw:
+        return None
+    shard_ids = []
+    for part in raw.split(','):
+        start, _, end = part.strip().partition('-')
+        shard_ids.extend(range(int(start), int(end or start) + 1))
+    return shard_ids
+
+SHARD_COUNT = int(os.environ['SHARD_COUNT']) if os.environ.get('SHARD_COUNT') else None
+SHARD_IDS = _parse_shard_ids(os.environ.get('SHARD_IDS'))
+
+if SHARD_COUNT or os.environ.get('SHARDED'):
+    bot = commands.AutoShardedBot(
+        command_prefix='!', intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS,
+        max_ratelimit_timeout=REST_MAX_RATELIMIT_WAIT, **bot_options
+    )
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents, max_ratelimit_timeout=REST_MAX_RATELIMIT_WAIT, **bot_options)
+
+
+def owns_guild(guild_id: int) -> bool:
+    """Обслуживает ли этот процесс сервер (по формуле шардирования Discord)."""
+    if not bot.shard_count:
+        return True
+    shard_ids = bot.shard_ids if bot.shard_ids is not None else range(bot.shard_count)
+    return (guild_id >> 22) % bot.shard_count in shard_ids
+
+
+# Словарь для отслеживания активных тикетов: {(guild_id, user_id): message_id}
+ACTIVE_TICKETS = {}
+
+# =================================================================
+# МЕТРИКИ (ТЕКСТОВЫЙ ФОРМАТ PROMETHEUS)
+# =================================================================
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя ячейка — +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    """
+    Метрика с заранее известными наборами меток. labels() создает дочерний
+    счетчик один раз; горячий путь держит ссылку на него и только прибавляет.
+    """
+
+    def __init__(self, name: str, help_text: str, kind: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = label_names
+        self.buckets = buckets
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _HistogramChild(self.buckets) if self.kind == 'histogram' else _CounterChild()
+        return child
+
+    def _label_text(self, values: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._children.items():
+            if self.kind != 'histogram':
+                lines.append(f"{self.name}{self._label_text(values)} {child.value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self._label_text(values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {child.sum}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Metric:
+        return self._metrics.setdefault(name, Metric(name, help_text, 'counter', label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Metric:
+        return self._metrics.setdefault(name, Metric(name, help_text, 'histogram', label_names, buckets))
+
+    def render(self) -> list:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return lines
+
+
+METRICS = MetricsRegistry()
+CALLBACK_LATENCY = METRICS.histogram(
+    'lfg_interaction_callback_seconds', "Время обработки взаимодействия по компонентам.", ('component',)
+)
+REST_LATENCY = METRICS.histogram(
+    'lfg_rest_request_seconds', "Время выполнения REST-запроса (без ожидания в очереди) по маршрутам.", ('route',)
+)
+REST_ERRORS = METRICS.counter('lfg_rest_errors_total', "REST-запросы, завершившиеся ошибкой, по маршрутам.", ('route',))
+EMBED_RENDERS = METRICS.counter('lfg_embed_renders_total', "Сколько раз собирался Embed тикета.").labels()
+LOOP_LAG = METRICS.histogram(
+    'lfg_event_loop_lag_seconds', "Опоздание цикла событий относительно запланированного пробуждения.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+).labels()
+
+# Маршруты REST-очереди известны заранее: метки создаются один раз
+REST_ROUTES = ('channel.send', 'message.edit', 'message.delete', 'bulk_delete')
+for _route in REST_ROUTES:
+    REST_LATENCY.labels(_route)
+    REST_ERRORS.labels(_route)
+
+
+def timed_callback(component: str):
+    """Замеряет время async-обработчика взаимодействия в гистограмме компонента."""
+    histogram = CALLBACK_LATENCY.labels(component)
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+LOOP_STALLS = METRICS.counter('lfg_event_loop_stalls_total', "Зависания цикла событий дольше LOOP_STALL_THRESHOLD.").labels()
+
+
+class LoopWatchdog:
+    """
+    Сторож цикла событий. Проба внутри цикла каждые interval секунд отмечает «пульс»
+    и пишет опоздание в LOOP_LAG. Отдельный поток следит за пульсом: если цикл молчит
+    дольше LOOP_STALL_THRESHOLD, он печатает стек кода, который держит цикл
+    (один раз на каждое зависание).
+    """
+
+    def __init__(self, interval: float = 0.25, threshold: float = LOOP_STALL_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.loop_thread_id = None
+        self._heartbeat = time.monotonic()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+        while True:
+            started = loop.time()
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            LOOP_LAG.observe(max(0.0, loop.time() - started - self.interval))
+
+    def _watch(self):
+        reported = False
+        while True:
+            time.sleep(self.interval / 2)
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+
+            reported = True
+            LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else "<стек недоступен>\n"
+            # stderr, а не print: заблокированный stdout может оказаться причиной зависания
+            sys.stderr.write(f"🐢 Цикл событий заблокирован уже {stalled:.2f} с. Сейчас выполняется:\n{stack}")
+
+
+WATCHDOG = LoopWatchdog()
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float = 0.005) -> Dict[str, int]:
+    """
+    Сэмплирующий профайлер: каждые interval секунд снимает стек потока и считает
+    одинаковые стеки. Результат — «свернутые» стеки (формат flamegraph.pl / speedscope).
+    """
+    counts: Dict[str, int] = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        key = ';'.join(reversed(names))
+        counts[key] = counts.get(key, 0) + 1
+        time.sleep(interval)
+    return counts
+
+# =================================================================
+# ХРАНИЛИЩЕ ТИКЕТОВ (ПЕРЕЖИВАЕТ ПЕРЕЗАПУСК)
+# =================================================================
+
+class TicketUser(NamedTuple):
+    """Лёгкий заменитель discord.Member: id и имя игрока, без кэша гильдии."""
+    id: int
+    display_name: str
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+
+@functools.lru_cache(maxsize=None)
+def _slot_positions(slot_names: Tuple[str, ...]) -> Dict[str, int]:
+    """Индекс «роль -> позиция», общий для всех тикетов с одинаковым набором слотов."""
+    return {role: position for position, role in enumerate(slot_names)}
+
+
+class SlotTable:
+    """
+    Компактная таблица слотов тикета: array('Q') с id игроков (0 — слот свободен),
+    обратный индекс «id -> позиция» и счетчик свободных мест. Проверка «пати собрана»,
+    поиск слота игрока и перемещение между слотами — O(1), а тикет не держит
+    ссылок на discord.Member и граф гильдии. У занятых слотов бывают очереди
+    ожидающих (FIFO, создаются при первом ожидающем); игрок стоит не больше чем в одной.
+    """
+    __slots__ = ('names', '_positions', '_ids', '_slot_of', 'free', '_waiting')
+
+    def __init__(self, slot_names: Iterable[str], occupants: Optional[Dict[str, int]] = None,
+                 waiting: Optional[Dict[str, Iterable[int]]] = None):
+        self.names = tuple(slot_names)
+        self._positions = _slot_positions(self.names)
+        self._ids = array('Q', bytes(8 * len(self.names)))
+        self._slot_of: Dict[int, int] = {}
+        self.free = len(self.names)
+        self._waiting: Optional[Dict[int, deque]] = None  # позиция слота -> id ожидающих по порядку
+        for role, user_id in (occupants or {}).items():
+            if role in self._positions and user_id:
+                self.occupy(role, user_id)
+        for role, user_ids in (waiting or {}).items():
+            for user_id in user_ids:
+                if role in self._positions and self[role]:
+                    self.wait(role, user_id)
+
+    def __getitem__(self, role: str) -> int:
+        """id игрока в слоте или 0, если слот свободен."""
+        return self._ids[self._positions[role]]
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        return zip(self.names, self._ids)
+
+    @property
+    def is_full(self) -> bool:
+        return self.free == 0
+
+    @property
+    def occupied(self) -> int:
+        return len(self.names) - self.free
+
+    def occupants(self) -> list:
+        return [user_id for user_id in self._ids if user_id]
+
+    def slot_of(self, user_id: int) -> Optional[str]:
+        position = self._slot_of.get(user_id)
+        return None if position is None else self.names[position]
+
+    def occupy(self, role: str, user_id: int) -> Optional[str]:
+        """
+        Сажает игрока в свободный слот (вызывающий проверяет, что слот свободен).
+        Если игрок уже сидел в другом слоте, освобождает его и возвращает его имя.
+        """
+        previous = self.release(user_id)
+        position = self._positions[role]
+        self._ids[position] = user_id
+        self._slot_of[user_id] = position
+        self.free -= 1
+        return previous
+
+    def release(self, user_id: int) -> Optional[str]:
+        """Освобождает слот игрока; возвращает имя слота или None."""
+        position = self._slot_of.pop(user_id, None)
+        if position is None:
+            return None
+        self._ids[position] = 0
+        self.free += 1
+        return self.names[position]
+
+    def waitlists(self) -> Iterator[Tuple[str, deque]]:
+        """Непустые очереди ожидающих: (слот, id по порядку)."""
+        for position, user_ids in (self._waiting or {}).items():
+            if user_ids:
+                yield self.names[position], user_ids
+
+    def waiting_for(self, user_id: int) -> Optional[Tuple[str, int]]:
+        """Слот, которого ждет игрок, и его место в очереди (с 1)."""
+        for role, user_ids in self.waitlists():
+            if user_id in user_ids:
+                return role, user_ids.index(user_id) + 1
+        return None
+
+    def wait(self, role: str, user_id: int) -> int:
+        """
+        Ставит игрока в конец очереди на слот (прежняя очередь игрока отменяется).
+        Возвращает место в очереди или 0, если очередь заполнена.
+        """
+        user_ids = (self._waiting or {}).get(self._positions[role])
+        if user_ids is not None and len(user_ids) >= SLOT_WAITLIST_LIMIT:
+            return 0
+        self.unwait(user_id)
+        if self._waiting is None:
+            self._waiting = {}
+        user_ids = self._waiting.setdefault(self._positions[role], deque())
+        user_ids.append(user_id)
+        return len(user_ids)
+
+    def unwait(self, user_id: int) -> Optional[str]:
+        """Убирает игрока из очереди; возвращает имя слота, которого он ждал, или None."""
+        for role, user_ids in self.waitlists():
+            if user_id in user_ids:
+                user_ids.remove(user_id)
+                return role
+        return None
+
+    def promote(self, role: str) -> Optional[Tuple[int, Optional[str]]]:
+        """
+        Сажает в освободившийся слот первого из его очереди. Возвращает (id игрока,
+        слот, который он освободил, пересев) или None, если очередь пуста.
+        """
+        user_ids = (self._waiting or {}).get(self._positions[role])
+        if not user_ids or self[role]:
+            return None
+        user_id = user_ids.popleft()
+        return user_id, self.occupy(role, user_id)
+
+
+class TicketStore:
+    """
+    Хранит открытые тикеты в SQLite (режим WAL), чтобы после редеплоя
+    тикеты можно было восстановить одним запросом к базе.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+
+    def _migrate(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tickets (
+                    message_id     INTEGER PRIMARY KEY,
+                    channel_id     INTEGER NOT NULL,
+                    initiator_id   INTEGER NOT NULL,
+                    initiator_name TEXT    NOT NULL,
+                    map_info       TEXT    NOT NULL,
+                    slot_names     TEXT    NOT NULL,
+                    slots          TEXT    NOT NULL,
+                    comment        TEXT,
+                    created_at     REAL    NOT NULL,
+                    expires_at     REAL    NOT NULL
+                );
+                PRAGMA user_version = 1;
+            """)
+        if version < 2:
+            self.conn.executescript("""
+                ALTER TABLE tickets ADD COLUMN guild_id INTEGER NOT NULL DEFAULT 0;
+                CREATE INDEX IF NOT EXISTS tickets_guild ON tickets (guild_id);
+                PRAGMA user_version = 2;
+            """)
+        if version < 3:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS subscriptions (
+                    guild_id INTEGER NOT NULL,
+                    user_id  INTEGER NOT NULL,
+                    topic    TEXT    NOT NULL,
+                    PRIMARY KEY (guild_id, user_id, topic)
+                );
+                PRAGMA user_version = 3;
+            """)
+        if version < 4:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    scope        TEXT    PRIMARY KEY,
+                    owner        TEXT    NOT NULL,
+                    heartbeat_at REAL    NOT NULL,
+                    released     INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS matchmaking_queue (
+                    guild_id    INTEGER NOT NULL,
+                    user_id     INTEGER NOT NULL,
+                    user_name   TEXT    NOT NULL,
+                    mission     TEXT    NOT NULL,
+                    roles       TEXT    NOT NULL,
+                    enqueued_at REAL    NOT NULL,
+                    PRIMARY KEY (guild_id, user_id)
+                );
+                PRAGMA user_version = 4;
+            """)
+        if version < 5:
+            self.conn.executescript("""
+                ALTER TABLE tickets ADD COLUMN waitlist TEXT;
+                PRAGMA user_version = 5;
+            """)
+
+    @staticmethod
+    def _dump_slots(slots: SlotTable) -> str:
+        return json.dumps({role: user_id or None for role, user_id in slots})
+
+    @staticmethod
+    def _dump_waitlist(slots: SlotTable) -> Optional[str]:
+        waitlists = {role: list(user_ids) for role, user_ids in slots.waitlists()}
+        return json.dumps(waitlists) if waitlists else None
+
+    @staticmethod
+    def load_slots(raw: str, slot_names: list, waitlist: Optional[str] = None) -> SlotTable:
+        """Читает слоты и очереди на них; старые записи хранили игрока как [id, имя]."""
+        occupants = {}
+        for role, player in json.loads(raw).items():
+            if isinstance(player, list):
+                player = player[0]
+            occupants[role] = player
+        return SlotTable(slot_names, occupants, json.loads(waitlist) if waitlist else None)
+
+    def save(self, ticket: 'PartyTicket'):
+        """Записывает (или перезаписывает) тикет целиком."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO tickets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                ticket.message_id, ticket.channel_id, ticket.initiator.id, ticket.initiator.display_name,
+                ticket.mission.key, json.dumps(ticket.slots.names), self._dump_slots(ticket.slots),
+                ticket.comment, ticket.created_at, ticket.expires_at, ticket.guild_id,
+                self._dump_waitlist(ticket.slots),
+            )
+        )
+
+    def update_slots(self, message_id: int, slots: SlotTable):
+        self.conn.execute(
+            "UPDATE tickets SET slots = ?, waitlist = ? WHERE message_id = ?",
+            (self._dump_slots(slots), self._dump_waitlist(slots), message_id)
+        )
+
+    def delete(self, message_id: int):
+        self.conn.execute("DELETE FROM tickets WHERE message_id = ?", (message_id,))
+
+    def get(self, message_id: int) -> Optional[sqlite3.Row]:
+        return self.conn.execute("SELECT * FROM tickets WHERE message_id = ?", (message_id,)).fetchone()
+
+    def load_all(self) -> list:
+        return self.conn.execute("SELECT * FROM tickets").fetchall()
+
+    def message_ids(self, channel_id: int) -> set:
+        return {row[0] for row in self.conn.execute("SELECT message_id FROM tickets WHERE channel_id = ?", (channel_id,))}
+
+    def add_subscription(self, guild_id: int, user_id: int, topic: str):
+        self.conn.execute("INSERT OR IGNORE INTO subscriptions VALUES (?, ?, ?)", (guild_id, user_id, topic))
+
+    def remove_subscription(self, guild_id: int, user_id: int, topic: str):
+        self.conn.execute(
+            "DELETE FROM subscriptions WHERE guild_id = ? AND user_id = ? AND topic = ?",
+            (guild_id, user_id, topic)
+        )
+
+    def load_subscriptions(self) -> list:
+        return self.conn.execute("SELECT guild_id, user_id, topic FROM subscriptions").fetchall()
+
+    def lease(self, scope: str) -> Optional[sqlite3.Row]:
+        return self.conn.execute("SELECT * FROM leases WHERE scope = ?", (scope,)).fetchone()
+
+    def take_lease(self, scope: str, owner: str):
+        self.conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?, 0)", (scope, owner, time.time()))
+
+    def renew_lease(self, scope: str, owner: str) -> bool:
+        """Продлевает аренду; False — ее уже забрал другой процесс."""
+        cursor = self.conn.execute(
+            "UPDATE leases SET heartbeat_at = ? WHERE scope = ? AND owner = ? AND released = 0",
+            (time.time(), scope, owner)
+        )
+        return cursor.rowcount == 1
+
+    def release_lease(self, scope: str, owner: str):
+        self.conn.execute("UPDATE leases SET released = 1 WHERE scope = ? AND owner = ?", (scope, owner))
+
+    def save_matchmaking(self, entries: Iterable['QueueEntry']):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO matchmaking_queue VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (entry.guild_id, entry.user.id, entry.user.display_name, entry.mission.key, json.dumps(entry.roles), entry.enqueued_at)
+                for entry in entries
+            ]
+        )
+
+    def load_matchmaking(self) -> list:
+        return self.conn.execute("SELECT * FROM matchmaking_queue ORDER BY enqueued_at").fetchall()
+
+    def delete_matchmaking(self, keys: Iterable[Tuple[int, int]]):
+        self.conn.executemany("DELETE FROM matchmaking_queue WHERE guild_id = ? AND user_id = ?", list(keys))
+
+    def checkpoint(self):
+        """Переносит WAL в основной файл базы: следующий процесс читает готовый снимок."""
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+TICKET_STORE = TicketStore(TICKETS_DB)
+
+# =================================================================
+# ПЛАНИРОВЩИК ИСХОДЯЩИХ REST-ЗАПРОСОВ
+# =================================================================
+
+class _RateLimitCounter(logging.Filter):
+    """
+    Считает короткие 429-ответы: discord.py сам ждет и повторяет запрос, а наружу
+    о них сообщает только записью в лог (другого хука у HTTPClient нет).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if str(record.msg).startswith('We are being rate limited'):
+            self.count += 1
+        return True
+
+
+class RestScheduler:
+    """
+    Единая очередь исходящих REST-запросов к каналам. У Discord лимиты считаются
+    по корзинам «маршрут + основной параметр (channel_id)», поэтому очередь ведется
+    на каждую пару (маршрут, канал): не больше REST_BUCKET_CONCURRENCY запросов
+    одновременно, а среди ожидающих первыми идут INTERACTIVE (публикация тикета,
+    сводка, удаление по кнопке), и только потом BACKGROUND (истечение тикетов,
+    уборка старых). Заголовки X-RateLimit-* читает HTTPClient discord.py и сам
+    выжидает короткие 429; лимит дольше REST_MAX_RATELIMIT_WAIT приходит сюда как
+    discord.RateLimited, и запрос ждет, не теряя места в очереди, а его корзина
+    не занимает остальные. Пустые очереди удаляются вместе с последним обработчиком.
+    Ответы на сами взаимодействия идут по отдельному маршруту вебхука и в очередь не попадают.
+    """
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+    def __init__(self):
+        self._queues: Dict[Tuple[str, int], list] = {}  # (маршрут, channel_id) -> куча (приоритет, порядок, время постановки, маршрут, фабрика, future)
+        self._workers: Dict[Tuple[str, int], set] = {}  # (маршрут, channel_id) -> задачи, разбирающие очередь
+        self._order = itertools.count()
+        self._pending_deletes: Dict[int, Tuple[Any, set]] = {}  # channel_id -> (канал, id сообщений)
+        self._rate_limits = _RateLimitCounter()
+        logging.getLogger('discord.http').addFilter(self._rate_limits)
+        self._latency = {route: REST_LATENCY.labels(route) for route in REST_ROUTES}
+        self._errors = {route: REST_ERRORS.labels(route) for route in REST_ROUTES}
+        self.completed = 0
+        self.wait_total = [0.0, 0.0]
+        self.wait_max = [0.0, 0.0]
+        self.wait_count = [0, 0]
+
+    def submit(self, channel_id: int, route: str, factory, priority: int = INTERACTIVE) -> asyncio.Future:
+        """
+        Ставит запрос в очередь корзины (маршрут, канал); factory() вызывается, когда подошла очередь.
+        route — один из REST_ROUTES, по нему же ведутся метрики.
+        """
+        future = asyncio.get_running_loop().create_future()
+        bucket = (route, channel_id)
+        heapq.heappush(
+            self._queues.setdefault(bucket, []),
+            (priority, next(self._order), time.perf_counter(), route, factory, future)
+        )
+        workers = self._workers.setdefault(bucket, set())
+        # done() истинно сразу после выхода из _drain, раньше, чем сработает discard
+        if sum(not worker.done() for worker in workers) < REST_BUCKET_CONCURRENCY:
+            worker = asyncio.ensure_future(self._drain(bucket))
+            workers.add(worker)
+            worker.add_done_callback(functools.partial(self._worker_done, bucket))
+        return future
+
+    def _worker_done(self, bucket: Tuple[str, int], worker: asyncio.Future):
+        workers = self._workers.get(bucket)
+        if workers is None:
+            return
+        workers.discard(worker)
+        if not workers and not self._queues.get(bucket):
+            del self._workers[bucket]
+            self._queues.pop(bucket, None)
+
+    async def run(self, channel_id: int, route: str, factory, priority: int = INTERACTIVE):
+        """Выполняет запрос через очередь канала и возвращает его результат."""
+        return await self.submit(channel_id, route, factory, priority)
+
+    def delete_later(self, channel, message_id: int):
+        """Фоновое удаление: сообщения канала копятся DELETE_BATCH_WINDOW и удаляются одной пачкой."""
+        entry = self._pending_deletes.get(channel.id)
+        if entry is None:
+            entry = self._pending_deletes[channel.id] = (channel, set())
+            asyncio.get_running_loop().call_later(DELETE_BATCH_WINDOW, self._flush_deletes, channel.id)
+        entry[1].add(message_id)
+
+    def _flush_deletes(self, channel_id: int):
+        entry = self._pending_deletes.pop(channel_id, None)
+        if entry is None:
+            # Уже отправлено досрочно (drain)
+            return
+        channel, message_ids = entry
+        future = self.submit(
+            channel_id, 'bulk_delete', functools.partial(bulk_delete_messages, channel, sorted(message_ids)), self.BACKGROUND
+        )
+        future.add_done_callback(self._log_failure)
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Перед остановкой: сразу отправляет накопленные удаления и ждет, пока очереди
+        каналов опустеют. False — к сроку выполнились не все запросы.
+        """
+        for channel_id in list(self._pending_deletes):
+            self._flush_deletes(channel_id)
+        workers = [worker for workers in self._workers.values() for worker in workers if not worker.done()]
+        if not workers:
+            return True
+        _, pending = await asyncio.wait(workers, timeout=timeout)
+        return not pending
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            print(f"Ошибка фонового REST-запроса: {future.exception()}")
+
+    async def _drain(self, bucket: Tuple[str, int]):
+        queue = self._queues[bucket]
+        while queue:
+            priority, _, queued_at, route, factory, future = heapq.heappop(queue)
+            if future.done():
+                continue
+            waited = time.perf_counter() - queued_at
+            self.wait_total[priority] += waited
+            self.wait_count[priority] += 1
+            self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+            started = time.perf_counter()
+            try:
+                result = await factory()
+            except discord.RateLimited as e:
+                # Лимит дольше max_ratelimit_timeout: ждем и повторяем, не теряя место в очереди
+                self._rate_limits.count += 1
+                heapq.heappush(queue, (priority, next(self._order), queued_at, route, factory, future))
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                self._errors[route].inc()
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._latency[route].observe(time.perf_counter() - started)
+            self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        waits = {}
+        for priority, name in ((self.INTERACTIVE, "interactive"), (self.BACKGROUND, "background")):
+            count = self.wait_count[priority]
+            waits[name] = {
+                "requests": count,
+                "avg_wait_ms": round(self.wait_total[priority] / count * 1000, 2) if count else 0.0,
+                "max_wait_ms": round(self.wait_max[priority] * 1000, 2),
+            }
+        return {
+            "queue_depth": sum(len(queue) for queue in self._queues.values()),
+            "buckets": len(self._queues),
+            "pending_deletes": sum(len(ids) for _, ids in self._pending_deletes.values()),
+            "completed": self.completed,
+            "rate_limited": self._rate_limits.count,
+            "wait": waits,
+        }
+
+
+REST = RestScheduler()
+
+# =================================================================
+# ПЛАНИРОВЩИК УДАЛЕНИЯ ТИКЕТОВ
+# =================================================================
+
+class ExpiryScheduler:
+    """
+    Единый планировщик истечения тикетов вместо таймера в каждом тикете.
+    Куча упорядочена по абсолютному времени (создание + LFG_TIMEOUT), поэтому
+    клики по кнопкам срок жизни не продлевают. Одна задача просыпается на
+    каждую пачку истекших тикетов и удаляет их через channel.delete_messages.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._heap = []   # (expires_at, message_id)
+        self.tickets = {} # message_id -> PartyTicket (реестр открытых тикетов)
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def schedule(self, ticket: 'PartyTicket'):
+        self.tickets[ticket.message_id] = ticket
+        if ticket.expires_at > time.time():
+            TICKET_INDEX.add(ticket)
+        heapq.heappush(self._heap, (ticket.expires_at, ticket.message_id))
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        elif self._heap[0][1] == ticket.message_id:
+            self._wakeup.set()
+
+    def cancel(self, message_id: int) -> Optional['PartyTicket']:
+        """Снимает тикет с учета (запись в куче удаляется лениво)."""
+        TICKET_INDEX.remove(message_id)
+        return self.tickets.pop(message_id, None)
+
+    def _pop_due(self) -> list:
+        deadline = time.time() + EXPIRY_BATCH_WINDOW
+        due = []
+        while self._heap and self._heap[0][0] <= deadline:
+            expires_at, message_id = heapq.heappop(self._heap)
+            ticket = self.tickets.get(message_id)
+            if ticket is not None and ticket.expires_at == expires_at:
+                TICKET_INDEX.remove(message_id)
+                due.append(self.tickets.pop(message_id))
+        return due
+
+    async def _run(self):
+        while self._heap:
+            # Просыпаемся, только когда наступил срок самого раннего тикета
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = self._pop_due()
+            if due:
+                try:
+                    await self._expire(due)
+                except Exception as e:
+                    print(f"Ошибка при удалении истекших тикетов: {e}")
+
+    async def _expire(self, tickets: list):
+        by_channel: Dict[int, list] = {}
+        for ticket in tickets:
+            ticket.stop()
+            RENDER_QUEUE.discard(ticket.message_id)
+            if ACTIVE_TICKETS.get((ticket.guild_id, ticket.initiator.id)) == ticket.message_id:
+                del ACTIVE_TICKETS[(ticket.guild_id, ticket.initiator.id)]
+            # В HTTP-режиме тикеты закрывают воркеры: закрытый тикет уже удален из базы вместе с сообщением,
+            # а слоты и очереди открытого меняются только в базе
+            if INTERACTIONS_MODE == 'http':
+                row = TICKET_STORE.get(ticket.message_id)
+                if row is None:
+                    continue
+                ticket.slots = TicketStore.load_slots(row['slots'], json.loads(row['slot_names']), row['waitlist'])
+            ticket.end_waitlists("время тикета истекло")
+            TICKET_STORE.delete(ticket.message_id)
+            by_channel.setdefault(ticket.channel_id, []).append(ticket.message_id)
+
+        for channel_id, message_ids in by_channel.items():
+            await REST.run(
+                channel_id, 'bulk_delete', functools.partial(bulk_delete_messages, message_channel(channel_id), message_ids), REST.BACKGROUND
+            )
+
+
+def message_channel(channel_id: int):
+    """
+    Канал для операций с сообщениями по id: из кэша, а если его там нет
+    (LEAN_MODE, другой шард) — PartialMessageable, без запроса к Discord.
+    """
+    return bot.get_channel(channel_id) or bot.get_partial_messageable(channel_id)
+
+
+async def bulk_delete_messages(channel, message_ids: list):
+    """
+    Удаляет сообщения по id, не загружая их: пачками по 100 (bulk delete).
+    Если у бота нет права «Управлять сообщениями» или канал известен только
+    как PartialMessageable, удаляет свои сообщения по одному.
+    """
+    for start in range(0, len(message_ids), 100):
+        chunk = message_ids[start:start + 100]
+        if hasattr(channel, 'delete_messages'):
+            try:
+                await channel.delete_messages([discord.Object(id=message_id) for message_id in chunk])
+                continue
+            except discord.NotFound:
+                continue
+            except discord.HTTPException:
+                pass
+
+        for message_id in chunk:
+            try:
+                await channel.get_partial_message(message_id).delete()
+            except discord.HTTPException:
+                pass
+
+
+EXPIRY = ExpiryScheduler(bot)
+
+# =================================================================
+# ИНДЕКС ОТКРЫТЫХ ТИКЕТОВ (!lfg)
+# =================================================================
+
+@dataclass(slots=True)
+class TicketFilter:
+    """Фильтр списка !lfg; None — любое значение."""
+    kind: Optional[str] = None
+    tier: Optional[str] = None
+    map_name: Optional[str] = None
+    faction: Optional[str] = None
+    min_free: int = 1
+
+    def matches(self, key: Tuple[str, str, str, str, int]) -> bool:
+        kind, tier, map_name, faction, free = key
+        return (
+            free >= self.min_free
+            and (self.kind is None or kind == self.kind)
+            and (self.tier is None or tier == self.tier)
+            and (self.map_name is None or map_name == self.map_name)
+            and (self.faction is None or faction == self.faction)
+        )
+
+    def describe(self) -> str:
+        catalog = MISSIONS.current
+        parts = [catalog.missions[self.kind].title if self.kind in catalog.missions else self.kind, self.tier, self.map_name, self.faction]
+        if self.min_free > 1:
+            parts.append(f"свободно от {self.min_free}")
+        return ", ".join(part for part in parts if part) or "все пати"
+
+
+class TicketIndex:
+    """
+    Вторичный индекс открытых тикетов для !lfg. На каждом сервере тикеты лежат в корзинах
+    по ключу (миссия, тир, карта, фракция, свободных мест); тикет всегда ровно в одной
+    корзине и переезжает при изменении слотов. Корзина — отсортированный от новых к старым
+    список (bisect), поэтому страница любой глубины берется срезом по номеру, без перебора
+    пропущенных тикетов. Запрос перебирает корзины сервера — их число ограничено каталогом
+    и числом слотов, а не числом тикетов. Реестр тикетов по-прежнему ведет EXPIRY, индекс
+    обновляется вместе с ним и из PartyTicket при занятии и освобождении слотов.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[int, Dict[tuple, list]] = {}            # guild_id -> ключ -> [(-created_at, -message_id)]
+        self._placed: Dict[int, Tuple[int, tuple]] = {}             # message_id -> (guild_id, ключ)
+        self._tickets: Dict[int, 'PartyTicket'] = {}                # message_id -> тикет
+
+    @staticmethod
+    def key_of(ticket: 'PartyTicket') -> Tuple[str, str, str, str, int]:
+        map_data = ticket.mission.map
+        if map_data is None:
+            return (ticket.mission.kind, '', '', '', ticket.slots.free)
+        return (ticket.mission.kind, map_data.tier, map_data.name, map_data.faction, ticket.slots.free)
+
+    @staticmethod
+    def _order(ticket: 'PartyTicket') -> Tuple[float, int]:
+        """Место тикета в корзине: от новых к старым."""
+        return (-ticket.created_at, -ticket.message_id)
+
+    def add(self, ticket: 'PartyTicket'):
+        """Добавляет тикет или переносит его в корзину, соответствующую текущим слотам."""
+        placed = (ticket.guild_id, self.key_of(ticket))
+        current = self._placed.get(ticket.message_id)
+        self._tickets[ticket.message_id] = ticket
+        if current == placed:
+            return
+        if current is not None:
+            self._discard(ticket, current)
+        bisect.insort(self._buckets.setdefault(placed[0], {}).setdefault(placed[1], []), self._order(ticket))
+        self._placed[ticket.message_id] = placed
+
+    def update(self, ticket: 'PartyTicket'):
+        """После изменения слотов; тикеты вне индекса (закрытые, в процессах-воркерах) не добавляются."""
+        if ticket.message_id in self._placed:
+            self.add(ticket)
+
+    def remove(self, message_id: int):
+        placed = self._placed.pop(message_id, None)
+        if placed is not None:
+            self._discard(self._tickets.pop(message_id), placed)
+
+    def _discard(self, ticket: 'PartyTicket', placed: Tuple[int, tuple]):
+        guild_id, key = placed
+        guild_buckets = self._buckets[guild_id]
+        bucket = guild_buckets[key]
+        del bucket[bisect.bisect_left(bucket, self._order(ticket))]
+        if not bucket:
+            del guild_buckets[key]
+            if not guild_buckets:
+                del self._buckets[guild_id]
+
+    def query(self, guild_id: int, ticket_filter: TicketFilter, offset: int, limit: int) -> Tuple[int, list]:
+        """
+        (всего подходящих тикетов, страница). Сначала почти собранные пати (меньше
+        свободных мест), внутри корзины — от новых к старым.
+        """
+        buckets = self._buckets.get(guild_id, {})
+        keys = sorted((key for key in buckets if ticket_filter.matches(key)), key=lambda key: (key[4], key))
+        total = sum(len(buckets[key]) for key in keys)
+        page = []
+        for key in keys:
+            bucket = buckets[key]
+            if offset >= len(bucket):
+                offset -= len(bucket)
+                continue
+            page.extend(self._tickets[-message_id] for _, message_id in bucket[offset:offset + limit - len(page)])
+            offset = 0
+            if len(page) >= limit:
+                break
+        return total, page
+
+    def __len__(self) -> int:
+        return len(self._placed)
+
+
+TICKET_INDEX = TicketIndex()
+
+
+def _sync_from_store(ticket: 'PartyTicket'):
+    """HTTP-режим: слоты меняют процессы-воркеры, поэтому показанный тикет сверяется с общей базой."""
+    row = TICKET_STORE.get(ticket.message_id)
+    if row is None:
+        ticket.stop()
+        EXPIRY.cancel(ticket.message_id)
+        return
+    ticket.slots = TicketStore.load_slots(row['slots'], json.loads(row['slot_names']), row['waitlist'])
+    TICKET_INDEX.update(ticket)
+
+
+def browse_tickets(guild_id: int, ticket_filter: TicketFilter, page: int) -> Tuple[int, list, int]:
+    """Страница списка !lfg: (всего тикетов, тикеты страницы, номер страницы после проверки границ)."""
+    total, tickets = TICKET_INDEX.query(guild_id, ticket_filter, page * LFG_PAGE_SIZE, LFG_PAGE_SIZE)
+    if INTERACTIONS_MODE == 'http' and tickets:
+        for ticket in tickets:
+            _sync_from_store(ticket)
+        total, tickets = TICKET_INDEX.query(guild_id, ticket_filter, page * LFG_PAGE_SIZE, LFG_PAGE_SIZE)
+    last_page = max(0, (total - 1) // LFG_PAGE_SIZE)
+    if page > last_page:
+        return browse_tickets(guild_id, ticket_filter, last_page)
+    return total, tickets, page
+
+
+# =================================================================
+# СВЕРКА КАНАЛОВ LFG С БАЗОЙ ТИКЕТОВ
+# =================================================================
+
+SWEEP_MESSAGES = METRICS.counter('lfg_sweep_messages_total', "Сообщения каналов LFG, просмотренные сверкой, по результату.", ('result',))
+
+
+@dataclass(slots=True)
+class SweepReport:
+    """Итог сверки одного или нескольких каналов."""
+    channels: int = 0
+    scanned: int = 0        # просмотрено сообщений
+    kept: int = 0           # сообщения живых тикетов
+    bulk_deleted: int = 0   # сироты моложе 14 дней (bulk delete)
+    single_deleted: int = 0 # сироты старше 14 дней (по одному)
+    elapsed: float = 0.0
+
+    @property
+    def deleted(self) -> int:
+        return self.bulk_deleted + self.single_deleted
+
+    def add(self, other: 'SweepReport'):
+        self.channels += other.channels
+        self.scanned += other.scanned
+        self.kept += other.kept
+        self.bulk_deleted += other.bulk_deleted
+        self.single_deleted += other.single_deleted
+
+    def __str__(self) -> str:
+        return (
+            f"просмотрено {self.scanned}, оставлено тикетов {self.kept}, удалено {self.deleted} "
+            f"(пачкой {self.bulk_deleted}, по одному {self.single_deleted}) за {self.elapsed:.1f} с"
+        )
+
+
+def _snowflake_at(timestamp: float) -> int:
+    return discord.utils.time_snowflake(datetime.fromtimestamp(timestamp, timezone.utc))
+
+
+def is_ticket_message(message: discord.Message) -> bool:
+    """Сообщение тикета узнается по custom_id кнопок (TicketButton или кнопки старого формата)."""
+    for row in message.components:
+        for component in getattr(row, 'children', ()):
+            custom_id = getattr(component, 'custom_id', None)
+            if custom_id and parse_ticket_custom_id(custom_id, message.id):
+                return True
+    return False
+
+
+class ChannelSweeper:
+    """
+    Сверка каналов LFG с базой тикетов. После падения в канале остаются сообщения
+    тикетов, которых в базе уже нет, и их кнопки никто не обслуживает. Сверка листает
+    историю канала страницами по 100 сообщений, оставляет живые тикеты и все, что
+    тикетом не является (сводки, сообщения игроков), а сирот удаляет: моложе 14 дней —
+    пачками по 100 уже во время просмотра, старше — по одному. Темп одиночных удалений
+    задает REST: корзина (message.delete, канал) и лимиты Discord из заголовков, без
+    собственных пауз. Удаления идут с фоновым приоритетом и не задерживают ответы на
+    нажатия. Одновременно сверяется не больше SWEEP_CONCURRENCY каналов.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.last_report: Optional[SweepReport] = None
+        self.last_run = 0.0
+        self._results = {result: SWEEP_MESSAGES.labels(result) for result in ('kept', 'deleted', 'other')}
+
+    async def run(self):
+        """Сверка сразу после подключения и затем каждые SWEEP_INTERVAL секунд."""
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                await self.sweep_all()
+            except Exception as e:
+                print(f"Ошибка сверки каналов LFG: {e}")
+            await asyncio.sleep(SWEEP_INTERVAL)
+
+    async def sweep_all(self) -> SweepReport:
+        channels = []
+        for guild in self.bot.guilds:
+            channel_id = GUILD_CONFIGS.get(guild.id).get('LFG_CHANNEL_ID')
+            channel = self.bot.get_channel(channel_id) if channel_id else None
+            if channel is not None:
+                channels.append(channel)
+
+        semaphore = asyncio.Semaphore(SWEEP_CONCURRENCY)
+
+        async def sweep_one(channel) -> SweepReport:
+            async with semaphore:
+                return await self.sweep_channel(channel)
+
+        started = time.perf_counter()
+        total = SweepReport()
+        for report in await asyncio.gather(*(sweep_one(channel) for channel in channels)):
+            total.add(report)
+        total.elapsed = time.perf_counter() - started
+        self.last_report, self.last_run = total, time.time()
+        print(f"🧹 Сверка каналов LFG ({total.channels}): {total}.")
+        return total
+
+    async def sweep_channel(self, channel) -> SweepReport:
+        started = time.perf_counter()
+        now = time.time()
+        report = SweepReport(channels=1)
+        live = TICKET_STORE.message_ids(channel.id)
+        bulk_cutoff = _snowflake_at(now - SWEEP_BULK_MAX_AGE)
+        young, batches, deletes = [], [], []
+
+        try:
+            # Сообщения новее начала сверки не трогаем: тикет мог быть уже отправлен, но еще не записан в базу
+            async for message in channel.history(limit=None, before=discord.Object(id=_snowflake_at(now))):
+                report.scanned += 1
+                if message.author.id != self.bot.user.id or not is_ticket_message(message):
+                    continue
+                if message.id in live:
+                    report.kept += 1
+                elif message.id > bulk_cutoff:
+                    young.append(message.id)
+                    if len(young) == 100:
+                        batches.append(self._bulk_delete(channel, young))
+                        young = []
+                else:
+                    # Старые — по одному, тоже сразу в очередь корзины (без задачи на каждое сообщение)
+                    deletes.append((message.id, REST.submit(
+                        channel.id, 'message.delete', channel.get_partial_message(message.id).delete, REST.BACKGROUND
+                    )))
+        except discord.Forbidden:
+            print(f"⚠️ Сверка канала {channel.id} пропущена: нет права читать историю сообщений.")
+
+        if young:
+            batches.append(self._bulk_delete(channel, young))
+        report.bulk_deleted = sum(await asyncio.gather(*batches))
+        for message_id, future in deletes:
+            report.single_deleted += await self._deleted(future, message_id)
+
+        report.elapsed = time.perf_counter() - started
+        self._results['kept'].inc(report.kept)
+        self._results['deleted'].inc(report.deleted)
+        self._results['other'].inc(report.scanned - report.kept - report.deleted)
+        return report
+
+    def _bulk_delete(self, channel, message_ids: list) -> asyncio.Future:
+        """Пачка уходит в очередь канала сразу, пока просмотр истории продолжается."""
+        future = REST.submit(channel.id, 'bulk_delete', functools.partial(bulk_delete_messages, channel, message_ids), REST.BACKGROUND)
+        return asyncio.ensure_future(self._count(future, len(message_ids)))
+
+    @staticmethod
+    async def _count(future: asyncio.Future, count: int) -> int:
+        try:
+            await future
+        except discord.HTTPException as e:
+            print(f"Не удалось удалить пачку сообщений при сверке: {e}")
+            return 0
+        return count
+
+    @staticmethod
+    async def _deleted(future: asyncio.Future, message_id: int) -> int:
+        try:
+            await future
+        except discord.NotFound:
+            return 0
+        except discord.HTTPException as e:
+            print(f"Не удалось удалить сообщение {message_id} при сверке: {e}")
+            return 0
+        return 1
+
+    def stats(self) -> Dict[str, Any]:
+        report = self.last_report
+        return {
+            "last_run_age_s": round(time.time() - self.last_run, 1) if self.last_run else None,
+            "scanned": report.scanned if report else 0,
+            "kept": report.kept if report else 0,
+            "deleted": report.deleted if report else 0,
+        }
+
+
+SWEEPER = ChannelSweeper(bot)
+
+# =================================================================
+# ОЧЕРЕДЬ ПЕРЕРИСОВКИ ТИКЕТОВ
+# =================================================================
+
+class EmbedRenderQueue:
+    """
+    Склеивает перерисовки одного тикета. Слоты меняются сразу, а сообщение
+    редактируется один раз через RENDER_DEBOUNCE после первого клика —
+    с самым свежим состоянием. Так гонка четырех игроков за слоты дает
+    одно редактирование вместо четырех. Счетчики: issued — выполненные правки,
+    saved — запросы, склеенные с уже ожидающей правкой, dropped — ожидавшие
+    правки, ставшие ненужными (тикет собран, закрыт или истек до отправки).
+    """
+
+    def __init__(self):
+        self._pending = {}  # message_id -> (PartyTicket, последнее Interaction)
+        self.edits_issued = 0
+        self.edits_saved = 0
+        self.edits_dropped = 0
+
+    def request(self, ticket: 'PartyTicket', interaction: discord.Interaction):
+        if ticket.message_id in self._pending:
+            self.edits_saved += 1
+        else:
+            asyncio.get_running_loop().call_later(
+                RENDER_DEBOUNCE, lambda: asyncio.ensure_future(self._flush(ticket.message_id))
+            )
+        self._pending[ticket.message_id] = (ticket, interaction)
+
+    async def flush_all(self):
+        """Сразу выполняет все отложенные перерисовки (перед остановкой бота)."""
+        await asyncio.gather(*(self._flush(message_id) for message_id in list(self._pending)))
+
+    def discard(self, message_id: int):
+        """Отменяет отложенную перерисовку (тикет закрыт или удален)."""
+        if self._pending.pop(message_id, None):
+            self.edits_dropped += 1
+
+    async def _flush(self, message_id: int):
+        entry = self._pending.pop(message_id, None)
+        if entry is None:
+            return
+        ticket, interaction = entry
+        if ticket.is_finished():
+            self.edits_dropped += 1
+            return
+
+        embed = ticket._render_embed()
+        self.edits_issued += 1
+        try:
+            await interaction.edit_original_response(embed=embed, view=ticket.build_view())
+        except discord.NotFound:
+            pass
+        except discord.HTTPException as e:
+            print(f"Не удалось обновить тикет {message_id}: {e}")
+
+
+RENDER_QUEUE = EmbedRenderQueue()
+
+
+class Mailbox:
+    """
+    Почтовый ящик актора: действия выполняются строго по одному, в порядке поступления
+    и каждое целиком, вместе со своими REST-вызовами. Поэтому следующее действие всегда
+    видит состояние, которое оставило предыдущее. Задача-обработчик живет, пока в ящике есть работа.
+    """
+    __slots__ = ('_pending', '_task')
+
+    def __init__(self):
+        self._pending = deque()
+        self._task = None
+
+    @property
+    def idle(self) -> bool:
+        return not self._pending and (self._task is None or self._task.done())
+
+    def ask(self, action: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Ставит действие в очередь; Future завершится его результатом или исключением."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((action, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._drain())
+        return future
+
+    async def _drain(self):
+        while self._pending:
+            action, future = self._pending.popleft()
+            try:
+                result = await action()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+
+CREATION_MAILBOXES: Dict[Tuple[int, int], Mailbox] = {} # (guild_id, user_id) -> очередь созданий тикетов инициатора
+
+# =================================================================
+# 4. КЛАССЫ ИНТЕРАКТИВНЫХ КОМПОНЕНТОВ (VIEWS)
+# =================================================================
+
+async def check_and_delete_old_ticket(initiator: TicketUser, lfg_channel):
+    """Проверяет и удаляет старый тикет инициатора."""
+    ticket_key = (lfg_channel.guild.id, initiator.id)
+    old_message_id = ACTIVE_TICKETS.get(ticket_key)
+    if old_message_id:
+        old_ticket = EXPIRY.cancel(old_message_id)
+        # В HTTP-режиме тикет мог уже закрыть воркер: тогда и сообщения больше нет,
+        # а очереди открытого тикета воркеры меняют только в базе
+        row = TICKET_STORE.get(old_message_id) if INTERACTIONS_MODE == 'http' else None
+        closed_by_worker = INTERACTIONS_MODE == 'http' and row is None
+        if old_ticket:
+            old_ticket.stop()
+            if row is not None:
+                old_ticket.slots = TicketStore.load_slots(row['slots'], json.loads(row['slot_names']), row['waitlist'])
+            if not closed_by_worker:
+                old_ticket.end_waitlists("создатель открыл новый тикет")
+        RENDER_QUEUE.discard(old_message_id)
+        if not closed_by_worker:
+            # Удаление старого тикета — фоновая работа: без fetch_message, пачкой через очередь канала
+            REST.delete_later(lfg_channel, old_message_id)
+        TICKET_STORE.delete(old_message_id)
+        ACTIVE_TICKETS.pop(ticket_key, None)
+
+
+async def publish_ticket(ticket: 'PartyTicket', lfg_channel, content: str):
+    """
+    Заменяет прежний тикет инициатора новым. Создания одного инициатора идут через
+    его Mailbox: старый тикет снимается до публикации нового, и два одновременных
+    создания не оставят в канале два тикета.
+    """
+    key = (ticket.guild_id, ticket.initiator.id)
+    mailbox = CREATION_MAILBOXES.setdefault(key, Mailbox())
+    try:
+        return await mailbox.ask(functools.partial(_replace_ticket, ticket, lfg_channel, content))
+    finally:
+        if mailbox.idle and CREATION_MAILBOXES.get(key) is mailbox:
+            del CREATION_MAILBOXES[key]
+
+
+async def _replace_ticket(ticket: 'PartyTicket', lfg_channel, content: str):
+    """
+    Публикует тикет одним запросом: сразу готовый Embed и кнопки, без заглушки
+    «Загрузка тикета» и последующей правки. Кнопки первой версии сообщения не знают
+    его id и ссылаются на тикет через сообщение, на котором нажаты.
+    """
+    await check_and_delete_old_ticket(ticket.initiator, lfg_channel)
+    sent_message = await REST.run(lfg_channel.id, 'channel.send', functools.partial(
+        lfg_channel.send, content, embed=ticket._render_embed(), view=ticket.build_view()
+    ))
+    ticket.message_id = sent_message.id
+    ACTIVE_TICKETS[(ticket.guild_id, ticket.initiator.id)] = sent_message.id
+    TICKET_STORE.save(ticket)
+    EXPIRY.schedule(ticket)
+    notify_subscribers(ticket, lfg_channel.guild.name)
+    return sent_message
+
+
+class EmbedTemplate(NamedTuple):
+    """Заранее собранные статичные части Embed тикета для одной миссии."""
+    data: Dict[str, Any]          # сериализованный Embed без заголовка, полей и футера
+    fields: Tuple[Dict[str, Any], ...]
+    open_title: str
+    full_title: str
+    field_icon: str
+
+
+@functools.lru_cache(maxsize=EMBED_TEMPLATE_CACHE_SIZE)
+def get_embed_template(mission: MissionDescriptor) -> EmbedTemplate:
+    """
+    Строит (один раз на миссию) цвет, миниатюру, заголовки и статичные поля
+    по MissionSpec и карте. При каждой перерисовке остается только
+    скопировать шаблон и дописать поля слотов. Ключ кэша включает MissionSpec,
+    так что после перезагрузки каталога новые тикеты получают новые шаблоны.
+    """
+    spec, map_data = mission.spec, mission.map
+    if map_data:
+        color = map_data.color or spec.color
+        thumbnail = map_data.icon
+        static_fields = (("Тип", f"{map_data.mission} - {map_data.faction}"), ("Сет/Тайлы", map_data.tileset))
+    else:
+        color = spec.color
+        thumbnail = spec.thumbnail
+        static_fields = spec.fields
+    fields = tuple({"name": name, "value": value, "inline": True} for name, value in static_fields)
+    fields += ({"name": "Истекает", "value": "1 час с момента создания", "inline": True},)
+
+    data = {"type": "rich", "color": color}
+    if thumbnail:
+        data["thumbnail"] = {"url": thumbnail}
+
+    return EmbedTemplate(
+        data=data,
+        fields=fields,
+        open_title=f"⚠️ СБОР | {mission.title} | Нужны игроки",
+        full_title=f"✅ ЗАКРЫТО | {mission.title} | Пати собрана!",
+        field_icon=spec.slot_icon,
+    )
+
+
+WAITLIST_EVENTS = METRICS.counter('lfg_waitlist_events_total', "Очереди на занятые слоты: встал в очередь, очередь заполнена, посажен из очереди, очередь снята вместе с тикетом.", ('event',))
+
+
+class PartyTicket:
+    """
+    Состояние открытого тикета (Арбитраж/Каскад) без живого discord.ui.View:
+    кнопки сообщения — TicketButton, их custom_id несет id тикета, действие и
+    номер слота, а один зарегистрированный диспетчер находит тикет в реестре EXPIRY.
+    """
+    __slots__ = ('bot', 'mission', 'slots', 'initiator', 'message_id', 'comment',
+                 'channel_id', 'guild_id', 'created_at', 'expires_at', '_finished', '_mailbox')
+
+    def __init__(self, bot, mission: MissionDescriptor, slots: SlotTable, initiator: TicketUser, message_id: Optional[int], comment: Optional[str] = None,
+                 channel_id: Optional[int] = None, created_at: Optional[float] = None, guild_id: Optional[int] = None):
+        # Собственного таймаута нет: истечение тикетов ведет ExpiryScheduler.
+        self.bot = bot
+        self.mission = mission
+        self.slots = slots
+        self.initiator = initiator
+        self.message_id = message_id
+        self.comment = comment
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.created_at = created_at or time.time()
+        self.expires_at = self.created_at + LFG_TIMEOUT
+        self._finished = False
+        self._mailbox = None
+
+    @property
+    def mailbox(self) -> Mailbox:
+        """Очередь действий с тикетом; создается при первом нажатии кнопки."""
+        if self._mailbox is None:
+            self._mailbox = Mailbox()
+        return self._mailbox
+
+    @property
+    def busy(self) -> bool:
+        """Есть ли у тикета действия в очереди или в работе."""
+        return self._mailbox is not None and not self._mailbox.idle
+
+    @property
+    def slot_names(self) -> Tuple[str, ...]:
+        return self.slots.names
+
+    def stop(self):
+        """Помечает тикет закрытым: нажатия его кнопок больше не обрабатываются."""
+        self._finished = True
+
+    def is_finished(self) -> bool:
+        return self._finished
+
+    def _create_summary_embed(self) -> discord.Embed:
+        """Создает финальный Embed с информацией о собранной пати."""
+        members_list = []
+        for role, user_id in self.slots:
+            if user_id:
+                member_display = f"<@{user_id}>"
+            else:
+                member_display = self.initiator.mention
+
+            members_list.append(f"**{role}:** {member_display}")
+
+        spec, map_data = self.mission.spec, self.mission.map
+        title = f"🚀 Пати на {spec.title} Собрана!"
+        if map_data:
+            description = (
+                f"**Карта:** {map_data.name} ({map_data.tier})\n"
+                f"**Миссия:** {map_data.mission} - {map_data.faction}\n"
+                f"**Тайлсет:** {map_data.tileset}"
+            )
+            color = map_data.color or spec.summary_color
+        else:
+            description = "\n".join(spec.summary)
+            color = spec.summary_color
+
+        embed = discord.Embed(
+            title=title,
+            description=description,
+            color=color
+        )
+
+        embed.add_field(
+            name="⚔️ Состав группы:",
+            value="\n".join(members_list),
+            inline=False
+        )
+
+        if self.comment:
+            embed.add_field(
+                name="📝 Комментарий создателя:",
+                value=f"> *{self.comment}*",
+                inline=False
+            )
+
+        embed.set_footer(text=f"Пати успешно закрыта. Создатель: {self.initiator.display_name}")
+        return embed
+
+
+    def _render_embed(self) -> discord.Embed:
+        """Собирает Embed тикета: статичный шаблон миссии + комментарий + текущие слоты."""
+        EMBED_RENDERS.inc()
+        template = get_embed_template(self.mission)
+        data = dict(template.data)
+        data['title'] = template.full_title if self.slots.is_full else template.open_title
+
+        fields = list(template.fields)
+
+        # Добавляем Комментарий, если он есть
+        if self.comment:
+            fields.append({"name": "📝 Комментарий создателя:", "value": f"> *{self.comment}*", "inline": False})
+
+        # Заполняем поля ролями
+        for role, user_id in self.slots:
+            value = f"<@{user_id}>" if user_id else "**[СВОБОДНО]**"
+            fields.append({"name": f"{template.field_icon} {role}", "value": value, "inline": False})
+
+        data['fields'] = fields
+        data['footer'] = {"text": f"Создатель: {self.initiator.display_name} | Удаление через 1 час после создания."}
+        return discord.Embed.from_dict(data)
+
+
+    def build_view(self) -> discord.ui.View:
+        """
+        Собирает разовый View с кнопками 'Бронь' для свободных слотов и кнопками 'Закрыть' и 'Покинуть'.
+        Все кнопки — TicketButton, поэтому discord.py не хранит этот View после отправки.
+        """
+        view = discord.ui.View(timeout=None)
+
+        # 1. Кнопки бронирования (Join Buttons); на занятый слот та же кнопка ставит в очередь
+        for slot_index, (role_name, user_id) in enumerate(self.slots):
+            label_text = role_name.split('(')[0].strip()
+            if user_id:
+                label_text = f"⏳ Очередь: {label_text}"
+            elif "Слот" not in label_text:
+                label_text = f"Бронь: {label_text}"
+
+            view.add_item(TicketButton(
+                TicketButton.JOIN, self.message_id, slot_index,
+                label=label_text, style=discord.ButtonStyle.secondary, row=0
+            ))
+
+        # 2. КНОПКИ УПРАВЛЕНИЯ
+        view.add_item(TicketButton(
+            TicketButton.CLOSE, self.message_id,
+            label="Закрыть пати ❌", style=discord.ButtonStyle.danger, row=1
+        ))
+        view.add_item(TicketButton(
+            TicketButton.LEAVE, self.message_id,
+            label="Покинуть слот 🏃", style=discord.ButtonStyle.blurple, row=1
+        ))
+        return view
+
+
+    def _promote_waiting(self, role_name: Optional[str]) -> list:
+        """
+        Отдает освободившийся слот первому из его очереди. Если тот пересел из другого
+        слота, освободившийся слот тоже уходит по очереди. Возвращает [(id игрока, слот)].
+        """
+        promoted = []
+        while role_name is not None:
+            result = self.slots.promote(role_name)
+            if result is None:
+                break
+            user_id, vacated = result
+            promoted.append((user_id, role_name))
+            role_name = vacated
+        WAITLIST_EVENTS.labels('promoted').inc(len(promoted))
+        return promoted
+
+    def _notify_promoted(self, promoted: list):
+        """Одно личное сообщение каждому, кого посадили из очереди."""
+        link = f"https://discord.com/channels/{self.guild_id}/{self.channel_id}/{self.message_id}"
+        for user_id, role_name in promoted:
+            NOTIFIER.notify((user_id,), f"✅ Слот **{role_name}** в пати **{self.mission.title}** освободился и теперь ваш. {link}")
+
+    def end_waitlists(self, reason: str):
+        """Тикет закрыт, собран или истек: каждый из очередей получает одно личное сообщение, что ждать больше нечего."""
+        ended = 0
+        for role_name, user_ids in self.slots.waitlists():
+            NOTIFIER.notify(user_ids, f"⌛ Очередь на слот **{role_name}** в пати **{self.mission.title}** снята: {reason}.")
+            ended += len(user_ids)
+        WAITLIST_EVENTS.labels('ended').inc(ended)
+
+    async def _enqueue(self, interaction: discord.Interaction, role_name: str):
+        """Нажатие на занятый слот: игрок встает в его очередь вместо повторных попыток."""
+        user_id = interaction.user.id
+        waiting = self.slots.waiting_for(user_id)
+        if waiting and waiting[0] == role_name:
+            return await interaction.followup.send(
+                f"Вы уже в очереди на слот **{role_name}**: место {waiting[1]}.",
+                ephemeral=True
+            )
+
+        place = self.slots.wait(role_name, user_id)
+        if not place:
+            WAITLIST_EVENTS.labels('full').inc()
+            return await interaction.followup.send(
+                "Этот слот занят, и очередь на него уже заполнена.",
+                ephemeral=True
+            )
+
+        WAITLIST_EVENTS.labels('queued').inc()
+        TICKET_STORE.update_slots(self.message_id, self.slots)
+        message = (
+            f"Слот **{role_name}** занят — вы в очереди, место {place}. "
+            "Когда он освободится, он достанется вам автоматически, а бот напишет в личные сообщения."
+        )
+        if waiting:
+            message += f" Очередь на **{waiting[0]}** отменена."
+        await interaction.followup.send(message, ephemeral=True)
+
+    @timed_callback('join_callback')
+    async def join(self, interaction: discord.Interaction, role_name: str):
+        """Обработка кнопки 'Бронь': занять слот, перейти в него из другого или встать в очередь на занятый."""
+        user = interaction.user
+        current_slot = self.slots.slot_of(user.id)
+        message = ""
+
+        if current_slot == role_name:
+            return await interaction.followup.send(
+                f"Вы уже занимаете слот **{role_name}**.",
+                ephemeral=True
+            )
+
+        if self.slots[role_name]:
+            return await self._enqueue(interaction, role_name)
+
+        if current_slot:
+            # Перемещение: occupy() сам освободит прежний слот, а его получит очередь
+            message = f"Вы покинули слот **{current_slot}** и заняли **{role_name}**."
+        else:
+            # Занятие нового слота
+            message = f"Вы заняли слот **{role_name}**."
+
+        self.slots.unwait(user.id)
+        promoted = self._promote_waiting(self.slots.occupy(role_name, user.id))
+        self._notify_promoted(promoted)
+
+        # --- ЛОГИКА: ПРОВЕРКА НА ПОЛНЫЙ СБОР И ЗАКРЫТИЕ ТИКЕТА ---
+        if self.slots.is_full:
+            self.stop()
+            self.end_waitlists("пати собрана без вас")
+            RENDER_QUEUE.discard(self.message_id)
+            summary_embed = self._create_summary_embed()
+            lfg_channel = interaction.channel
+            mentions = [f"<@{user_id}>" for user_id in self.slots.occupants()]
+            final_content = f"✅ **ПАТИ СОБРАНА!** {', '.join(mentions)} — ВПЕРЕД НА МИССИЮ!"
+
+            await REST.run(lfg_channel.id, 'channel.send', functools.partial(lfg_channel.send, final_content, embed=summary_embed))
+
+            try:
+                await REST.run(lfg_channel.id, 'message.delete', interaction.message.delete)
+            except discord.NotFound:
+                pass
+
+            await interaction.followup.send(
+                f"🎉 **Пати полностью собрана!** Тикет закрыт. Проверьте канал {lfg_channel.mention} для деталей.",
+                ephemeral=True
+            )
+
+            if ACTIVE_TICKETS.get((self.guild_id, self.initiator.id)) == self.message_id:
+                del ACTIVE_TICKETS[(self.guild_id, self.initiator.id)]
+            TICKET_STORE.delete(self.message_id)
+            EXPIRY.cancel(self.message_id)
+
+            return
+
+        # --- КОНЕЦ ЛОГИКИ ---
+
+        TICKET_STORE.update_slots(self.message_id, self.slots)
+        TICKET_INDEX.update(self)
+        # Ответ игроку уходит сразу, а правка сообщения — через очередь перерисовки
+        RENDER_QUEUE.request(self, interaction)
+
+        await interaction.followup.send(message, ephemeral=True)
+
+    @timed_callback('close_party')
+    async def close(self, interaction: discord.Interaction):
+        """Удаляет тикет (Embed) из канала LFG и из ACTIVE_TICKETS. Доступно только создателю."""
+        if interaction.user.id != self.initiator.id:
+            return await interaction.followup.send(
+                "Только создатель пати может её закрыть.",
+                ephemeral=True
+            )
+
+        self.stop()
+        self.end_waitlists("создатель закрыл тикет")
+        await interaction.followup.send("Тикет успешно закрыт.", ephemeral=True)
+        RENDER_QUEUE.discard(self.message_id)
+
+        try:
+            await REST.run(interaction.channel_id, 'message.delete', interaction.message.delete)
+        except discord.NotFound:
+            pass
+
+        if ACTIVE_TICKETS.get((self.guild_id, self.initiator.id)) == self.message_id:
+            del ACTIVE_TICKETS[(self.guild_id, self.initiator.id)]
+        TICKET_STORE.delete(self.message_id)
+        EXPIRY.cancel(self.message_id)
+
+
+    @timed_callback('leave_party')
+    async def leave(self, interaction: discord.Interaction):
+        """
+        Позволяет игроку покинуть занятый слот (или очередь на слот); слот сразу получает следующий из очереди.
+        Очередь ушедшего на другой слот сохраняется: выйти из нее можно повторным нажатием.
+        """
+        user_id = interaction.user.id
+        slot_to_leave = self.slots.slot_of(user_id)
+
+        if not slot_to_leave:
+            waited_slot = self.slots.unwait(user_id)
+            if waited_slot:
+                TICKET_STORE.update_slots(self.message_id, self.slots)
+                return await interaction.followup.send(f"Вы вышли из очереди на слот **{waited_slot}**.", ephemeral=True)
+            return await interaction.followup.send(
+                "Вы не занимаете ни одного слота в этой пати.",
+                ephemeral=True
+            )
+
+        if interaction.user.id == self.initiator.id and self.slots.occupied == 1:
+             return await interaction.followup.send("Как создатель тикета, вы не можете покинуть слот, пока это единственный занятый слот. Вы можете только закрыть тикет.", ephemeral=True)
+
+        self.slots.release(user_id)
+        promoted = self._promote_waiting(slot_to_leave)
+        TICKET_STORE.update_slots(self.message_id, self.slots)
+        TICKET_INDEX.update(self)
+
+        # Уход и пересадка из очереди попадают в одну правку сообщения
+        RENDER_QUEUE.request(self, interaction)
+
+        message = f"Вы успешно покинули слот **{slot_to_leave}**."
+        waiting = self.slots.waiting_for(user_id)
+        if waiting:
+            message += f" Вы по-прежнему в очереди на слот **{waiting[0]}** (место {waiting[1]}); чтобы выйти из нее, нажмите кнопку еще раз."
+        await interaction.followup.send(message, ephemeral=True)
+        self._notify_promoted(promoted)
+
+
+class TicketButton(discord.ui.DynamicItem[discord.ui.Button], template=r'lfg:(?P<action>join|leave|close):(?P<ticket>[0-9]*)(?::(?P<slot>[0-9]+))?'):
+    """
+    Кнопка тикета без состояния: custom_id вида lfg:<действие>:<id тикета>[:<номер слота>].
+    Пустой id тикета (первая публикация, id сообщения еще неизвестен) означает сообщение с кнопкой.
+    Класс регистрируется один раз (bot.add_dynamic_items), а нажатие направляется
+    в PartyTicket из реестра открытых тикетов.
+    """
+    JOIN = "join"
+    LEAVE = "leave"
+    CLOSE = "close"
+
+    def __init__(self, action: str, ticket_id: Optional[int], slot_index: Optional[int] = None, **button_options):
+        custom_id = f"lfg:{action}:{ticket_id or ''}"
+        if slot_index is not None:
+            custom_id = f"{custom_id}:{slot_index}"
+        super().__init__(discord.ui.Button(custom_id=custom_id, **button_options))
+        self.action = action
+        self.ticket_id = ticket_id
+        self.slot_index = slot_index
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        slot = match['slot']
+        ticket_id = int(match['ticket']) if match['ticket'] else interaction.message.id
+        return cls(match['action'], ticket_id, int(slot) if slot is not None else None)
+
+    async def callback(self, interaction: discord.Interaction):
+        await dispatch_ticket_action(interaction, self.ticket_id, self.action, self.slot_index)
+
+
+class LegacyTicketButton(discord.ui.DynamicItem[discord.ui.Button], template=r'join_(?P<role>.+)|(?P<action>close|leave)_party'):
+    """Кнопки сообщений, отправленных до перехода на TicketButton: тикет ищется по id сообщения."""
+
+    def __init__(self, action: str, role_name: Optional[str] = None):
+        custom_id = f"join_{role_name}" if action == TicketButton.JOIN else f"{action}_party"
+        super().__init__(discord.ui.Button(custom_id=custom_id))
+        self.action = action
+        self.role_name = role_name
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match['action'] or TicketButton.JOIN, match['role'])
+
+    async def callback(self, interaction: discord.Interaction):
+        ticket = EXPIRY.tickets.get(interaction.message.id)
+        slot_index = ticket.slot_names.index(self.role_name) if ticket and self.role_name in ticket.slot_names else None
+        await dispatch_ticket_action(interaction, interaction.message.id, self.action, slot_index)
+
+
+async def dispatch_ticket_action(interaction: discord.Interaction, ticket_id: int, action: str, slot_index: Optional[int]):
+    """
+    Единая точка входа для кнопок тикетов: находит тикет и ставит действие в его Mailbox.
+    Нажатие подтверждается сразу: очередь тикета может быть занята дольше трех секунд,
+    которые Discord дает на ответ, поэтому действия отвечают игроку через followup.
+    """
+    if SHUTDOWN.draining:
+        return await interaction.response.send_message(RESTART_NOTICE, ephemeral=True)
+    ticket = EXPIRY.tickets.get(ticket_id)
+    if ticket is None or ticket.is_finished():
+        return await interaction.response.send_message("Этот тикет уже закрыт или истек.", ephemeral=True)
+
+    with SHUTDOWN.admitted():
+        await interaction.response.defer()
+        await ticket.mailbox.ask(functools.partial(apply_ticket_action, ticket, interaction, action, slot_index))
+
+
+async def apply_ticket_action(ticket: 'PartyTicket', interaction: discord.Interaction, action: str, slot_index: Optional[int]):
+    """Выполняет действие внутри очереди тикета, где состояние слотов никто не меняет параллельно."""
+    if ticket.is_finished():
+        # Пати собрали или закрыли, пока нажатие ждало в очереди
+        return await interaction.followup.send("Этот тикет уже закрыт или истек.", ephemeral=True)
+
+    if action == TicketButton.CLOSE:
+        await ticket.close(interaction)
+    elif action == TicketButton.LEAVE:
+        await ticket.leave(interaction)
+    elif slot_index is not None and slot_index < len(ticket.slot_names):
+        await ticket.join(interaction, ticket.slot_names[slot_index])
+    else:
+        await interaction.followup.send("Такого слота в этом тикете нет.", ephemeral=True)
+
+
+# =================================================================
+# АВТО-ПОДБОР ПАТИ (MATCHMAKING)
+# =================================================================
+
+@dataclass(slots=True, eq=False)
+class QueueEntry:
+    """Игрок в очереди авто-подбора."""
+    user: TicketUser
+    guild_id: int
+    mission: MissionDescriptor
+    roles: Tuple[str, ...]
+    enqueued_at: float
+
+
+class Matchmaker:
+    """
+    Автоматический сбор пати из очереди. На каждую пару (сервер, миссия) и каждую
+    роль ведется куча игроков по времени постановки; игрок, готовый играть несколько
+    ролей, лежит в нескольких кучах, а выход из очереди удаляет его лениво. Мертвые
+    элементы (вышел, собран, просрочен) считаются по кучам; куча, в которой они
+    составили больше половины, пересобирается из живых. Новая запись запускает сборку
+    только своей миссии: роли заполняются от самой дефицитной к самой массовой.
+    """
+
+    def __init__(self):
+        self._queues: Dict[Tuple[int, str], Dict[str, list]] = {}  # (guild_id, миссия) -> роль -> куча
+        self._entries: Dict[Tuple[int, int], QueueEntry] = {}      # (guild_id, user_id) -> запись
+        self._counts: Counter = Counter()                          # (guild_id, миссия) -> игроков в очереди
+        self._dead: Counter = Counter()                            # (guild_id, миссия, роль) -> мертвых элементов в куче
+        self._order = itertools.count()
+        self.matches = 0
+        self.matched_players = 0
+        self.wait_total = 0.0
+
+    def _drop(self, key: Tuple[int, int]) -> Optional[QueueEntry]:
+        """
+        Снимает запись, уменьшает счетчик ее миссии и отмечает ее элементы в кучах ролей
+        мертвыми (единственное место удаления).
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            count_key = (entry.guild_id, entry.mission.key)
+            self._counts[count_key] -= 1
+            if self._counts[count_key] <= 0:
+                del self._counts[count_key]
+            for role in entry.roles:
+                self._dead[count_key + (role,)] += 1
+        return entry
+
+    def _compact(self, queue_key: Tuple[int, str]):
+        """Пересобирает кучи миссии, в которых мертвых элементов больше половины."""
+        for role, heap in self._queues.get(queue_key, {}).items():
+            dead_key = queue_key + (role,)
+            if self._dead[dead_key] * 2 > len(heap):
+                heap[:] = [item for item in heap if self._entries.get((item[2].guild_id, item[2].user.id)) is item[2]]
+                heapq.heapify(heap)
+                del self._dead[dead_key]
+
+    def _is_live(self, entry: QueueEntry, now: float) -> bool:
+        key = (entry.guild_id, entry.user.id)
+        if self._entries.get(key) is not entry:
+            return False
+        if now - entry.enqueued_at > MATCHMAKING_TIMEOUT:
+            self._drop(key)
+            return False
+        return True
+
+    def queued(self, guild_id: int, mission: MissionDescriptor) -> int:
+        """Сколько игроков ждет эту миссию на сервере — O(1), без обхода очереди."""
+        return self._counts.get((guild_id, mission.key), 0)
+
+    def dequeue(self, guild_id: int, user_id: int) -> Optional[QueueEntry]:
+        """Убирает игрока из очереди (записи в кучах удаляются лениво)."""
+        entry = self._drop((guild_id, user_id))
+        if entry is not None:
+            self._compact((guild_id, entry.mission.key))
+        return entry
+
+    def enqueue(self, guild_id: int, user: TicketUser, mission: MissionDescriptor, roles: Iterable[str],
+                enqueued_at: Optional[float] = None) -> Optional[Dict[str, QueueEntry]]:
+        """
+        Ставит игрока в очередь (повторная постановка заменяет прежнюю) и пробует
+        собрать пати его миссии. Возвращает {роль: запись}, если пати собрана.
+        enqueued_at сохраняет место в очереди при восстановлении после перезапуска.
+        """
+        self.dequeue(guild_id, user.id)
+        wanted = set(roles)
+        slot_names = mission_slots(mission)
+        entry = QueueEntry(
+            user=user,
+            guild_id=guild_id,
+            mission=mission,
+            roles=tuple(role for role in slot_names if role in wanted) or tuple(slot_names),
+            enqueued_at=enqueued_at or time.time(),
+        )
+        self._entries[(guild_id, user.id)] = entry
+        self._counts[(guild_id, mission.key)] += 1
+
+        queue_key = (guild_id, mission.key)
+        queues = self._queues.setdefault(queue_key, {})
+        order = next(self._order)
+        for role in entry.roles:
+            heapq.heappush(queues.setdefault(role, []), (entry.enqueued_at, order, entry))
+        picked = self._try_match(queue_key, slot_names)
+        self._compact(queue_key)
+        return picked
+
+    def _try_match(self, queue_key: Tuple[int, str], slot_names: list) -> Optional[Dict[str, QueueEntry]]:
+        queues = self._queues[queue_key]
+        now = time.time()
+        picked: Dict[str, QueueEntry] = {}
+        taken = set()
+        popped = []  # (роль, элемент кучи) — живые записи возвращаются в кучи в любом случае
+
+        for role in sorted(slot_names, key=lambda name: len(queues.get(name, ()))):
+            heap = queues.get(role, [])
+            while heap:
+                item = heapq.heappop(heap)
+                entry = item[2]
+                if not self._is_live(entry, now):
+                    self._dead[queue_key + (role,)] -= 1
+                    continue
+                popped.append((role, item))
+                if entry.user.id not in taken:
+                    picked[role] = entry
+                    taken.add(entry.user.id)
+                    break
+            if role not in picked:
+                break
+
+        matched = len(picked) == len(slot_names)
+        if matched:
+            for entry in picked.values():
+                self._drop((entry.guild_id, entry.user.id))
+                self.wait_total += now - entry.enqueued_at
+            self.matches += 1
+            self.matched_players += len(picked)
+
+        for role, item in popped:
+            if not matched or item[2] not in picked.values():
+                heapq.heappush(queues[role], item)
+            else:
+                # Элемент собранного игрока уже вынут из кучи — мертвым он там не числится
+                self._dead[queue_key + (role,)] -= 1
+        return picked if matched else None
+
+    def snapshot(self) -> list:
+        """Живые записи очереди для передачи новому процессу при перезапуске."""
+        now = time.time()
+        return [entry for entry in list(self._entries.values()) if self._is_live(entry, now)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._entries),
+            "matches": self.matches,
+            "avg_wait_s": round(self.wait_total / self.matched_players, 2) if self.matched_players else 0.0,
+        }
+
+
+MATCHMAKER = Matchmaker()
+
+
+async def announce_match(bot, guild_id: int, mission: MissionDescriptor, picked: Dict[str, QueueEntry]):
+    """Публикует собранную авто-подбором пати одной сводкой, как при полном сборе тикета."""
+    lfg_channel_id = GUILD_CONFIGS.get(guild_id).get('LFG_CHANNEL_ID')
+    if not lfg_channel_id:
+        return
+
+    initiator = min(picked.values(), key=lambda entry: entry.enqueued_at).user
+    slots = SlotTable(mission_slots(mission), {role: entry.user.id for role, entry in picked.items()})
+    party = PartyTicket(bot, mission, slots, initiator, None, channel_id=lfg_channel_id, guild_id=guild_id)
+    mentions = [f"<@{user_id}>" for user_id in slots.occupants()]
+    final_content = f"✅ **ПАТИ СОБРАНА АВТО-ПОДБОРОМ!** {', '.join(mentions)} — ВПЕРЕД НА МИССИЮ!"
+
+    lfg_channel = message_channel(lfg_channel_id)
+    await REST.run(lfg_channel_id, 'channel.send', functools.partial(lfg_channel.send, final_content, embed=party._create_summary_embed()))
+
+
+# =================================================================
+# ПОДПИСКИ И УВЕДОМЛЕНИЯ О НОВЫХ ТИКЕТАХ
+# =================================================================
+
+def mission_topics(mission: MissionDescriptor) -> Tuple[str, ...]:
+    """Темы подписки, которым соответствует тикет: карта, тир, тип миссии."""
+    if mission.map:
+        return (f"map:{mission.map.key}", f"tier:{mission.map.tier}", f"mission:{mission.kind}")
+    return (f"mission:{mission.kind}",)
+
+
+def parse_topic(raw: str) -> Optional[Tuple[str, str]]:
+    """Разбирает то, что ввел игрок: карта, тир (S / S-ТИР) или миссия («арбитраж», «каскад»...). Возвращает (тема, подпись)."""
+    catalog = MISSIONS.current
+    text = raw.strip()
+    lowered = text.lower()
+    for spec in catalog.missions.values():
+        if lowered in (spec.kind, spec.title.lower()):
+            label = f"{spec.title} (все карты)" if spec.kind == MISSION_ARBITRATION else spec.title
+            return f"mission:{spec.kind}", label
+
+    arbitration = catalog.missions[MISSION_ARBITRATION].title
+    tier = text.upper() if text.upper() in catalog.maps_by_tier else f"{text.upper()}-ТИР"
+    if tier in catalog.maps_by_tier:
+        return f"tier:{tier}", f"{arbitration}, {tier}"
+
+    map_entry = catalog.map_by_name.get(lowered)
+    if map_entry:
+        return f"map:{map_entry.key}", f"{arbitration}, карта {map_entry.name}"
+    return None
+
+
+class SubscriptionIndex:
+    """
+    Инвертированный индекс подписок: (guild_id, тема) -> множество user_id.
+    Данные лежат в SQLite рядом с тикетами, в память загружаются один раз при старте.
+    """
+
+    def __init__(self, store: 'TicketStore'):
+        self.store = store
+        self._subscribers: Dict[Tuple[int, str], set] = {}
+
+    def load(self):
+        self._subscribers.clear()
+        for row in self.store.load_subscriptions():
+            self._subscribers.setdefault((row['guild_id'], row['topic']), set()).add(row['user_id'])
+
+    def subscribe(self, guild_id: int, user_id: int, topic: str):
+        self._subscribers.setdefault((guild_id, topic), set()).add(user_id)
+        self.store.add_subscription(guild_id, user_id, topic)
+
+    def unsubscribe(self, guild_id: int, user_id: int, topic: str) -> bool:
+        subscribers = self._subscribers.get((guild_id, topic))
+        if not subscribers or user_id not in subscribers:
+            return False
+        subscribers.discard(user_id)
+        self.store.remove_subscription(guild_id, user_id, topic)
+        return True
+
+    def topics_of(self, guild_id: int, user_id: int) -> list:
+        return [
+            topic for (topic_guild, topic), subscribers in self._subscribers.items()
+            if topic_guild == guild_id and user_id in subscribers
+        ]
+
+    def audience(self, guild_id: int, mission: MissionDescriptor) -> set:
+        """Все подписчики тикета этой миссии (объединение по карте, тиру и типу миссии)."""
+        audience = set()
+        for topic in mission_topics(mission):
+            audience |= self._subscribers.get((guild_id, topic), set())
+        return audience
+
+
+DM_SENT = METRICS.counter('lfg_dm_notifications_total', "Личные уведомления о тикетах по результату.", ('result',))
+
+
+class DMNotifier:
+    """
+    Рассылка личных сообщений подписчикам. Создание тикета только кладет получателей
+    в ограниченную очередь (DM_QUEUE_LIMIT) и сразу возвращается; DM_WORKERS воркеров
+    отправляют сообщения не чаще DM_RATE в секунду на всех, а 429 по-прежнему
+    отрабатывает discord.py. При переполнении очереди лишние уведомления отбрасываются.
+    В процессах-воркерах HTTP-режима шлюза нет, и сообщения уходят через REST-клиент воркера (rest).
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.rest: Optional['DiscordRestClient'] = None
+        self._queue = None
+        self._workers = []
+        self._next_slot = 0.0
+        self._sent = DM_SENT.labels('sent')
+        self._failed = DM_SENT.labels('failed')
+        self._dropped = DM_SENT.labels('dropped')
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=DM_QUEUE_LIMIT)
+            self._workers = [asyncio.ensure_future(self._work()) for _ in range(DM_WORKERS)]
+
+    def notify(self, user_ids: Iterable[int], content: str):
+        self._ensure_workers()
+        for user_id in user_ids:
+            try:
+                self._queue.put_nowait((user_id, content))
+            except asyncio.QueueFull:
+                self._dropped.inc()
+
+    async def _pace(self):
+        """Общий для всех воркеров темп: не больше DM_RATE сообщений в секунду."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1 / DM_RATE
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _work(self):
+        while True:
+            user_id, content = await self._queue.get()
+            try:
+                await self._pace()
+                if await self._deliver(user_id, content):
+                    self._sent.inc()
+                else:
+                    self._failed.inc()
+            except discord.HTTPException:
+                # Закрытые личные сообщения или удаленный аккаунт
+                self._failed.inc()
+            except Exception as e:
+                self._failed.inc()
+                print(f"Ошибка отправки уведомления {user_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, user_id: int, content: str) -> bool:
+        if self.rest is not None:
+            return await self.rest.send_dm(user_id, content)
+        user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+        await user.send(content)
+        return True
+
+    async def flush(self, timeout: float):
+        """Ждет (не дольше timeout), пока уйдут уже поставленные уведомления."""
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        """Останавливает воркеров при выключении; неотправленные уведомления не переносятся."""
+        for worker in self._workers:
+            worker.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "sent": self._sent.value,
+            "failed": self._failed.value,
+            "dropped": self._dropped.value,
+        }
+
+
+SUBSCRIPTIONS = SubscriptionIndex(TICKET_STORE)
+NOTIFIER = DMNotifier(bot)
+
+
+def ticket_ping_role(config: Dict[str, Any], mission: MissionDescriptor) -> Optional[int]:
+    """Роль для пинга нового тикета: роль карты (!set_map_role), иначе общая роль миссии (role_setting из каталога)."""
+    map_role = config.get('MAP_ROLES', {}).get(mission.map.name) if mission.map else None
+    return map_role or (config.get(mission.spec.role_setting) if mission.spec.role_setting else None)
+
+
+def notify_subscribers(ticket: 'PartyTicket', guild_name: str):
+    """Ставит в очередь личные уведомления подписчикам миссии тикета (кроме создателя)."""
+    audience = SUBSCRIPTIONS.audience(ticket.guild_id, ticket.mission)
+    audience.discard(ticket.initiator.id)
+    if not audience:
+        return
+
+    title = ticket.mission.title
+    link = f"https://discord.com/channels/{ticket.guild_id}/{ticket.channel_id}/{ticket.message_id}"
+    NOTIFIER.notify(audience, f"🔔 **{guild_name}**: новая пати — **{title}**. Создатель: {ticket.initiator.display_name}. {link}")
+
+
+# =================================================================
+# ТЕКУЩЕЕ СОСТОЯНИЕ МИРА (КАКАЯ КАРТА СЕЙЧАС НА АРБИТРАЖЕ)
+# =================================================================
+
+class ArbitrationNode(NamedTuple):
+    """Текущий узел Арбитража, как его отдал источник."""
+    node: str                 # «Casta (Ceres)»
+    expiry: Optional[float]   # Unix-время ротации, если источник его знает
+
+
+def parse_arbitration(payload: Dict[str, Any]) -> Optional[ArbitrationNode]:
+    """Разбирает ответ в формате warframestat.us (`node`, `expiry` в ISO 8601)."""
+    node = payload.get('node') if isinstance(payload, dict) else None
+    if not node:
+        return None
+    expiry = None
+    if payload.get('expiry'):
+        try:
+            expiry = datetime.fromisoformat(payload['expiry'].replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            pass
+    return ArbitrationNode(node, expiry)
+
+
+def resolve_arbitration_map(node: str) -> Optional[MapEntry]:
+    """«Casta (Ceres)» -> запись каталога миссий; None, если карты нет в списке бота."""
+    return MISSIONS.current.map_by_name.get(node.split(' (')[0].strip().lower())
+
+
+class WorldStateProvider(abc.ABC):
+    """Источник состояния мира. Реализация должна вернуть текущий узел Арбитража или бросить исключение."""
+    @abc.abstractmethod
+    async def fetch_arbitration(self) -> Optional[ArbitrationNode]:
+        """Текущий узел Арбитража (None, если в ответе его нет)."""
+
+    async def close(self):
+        """Освобождает соединения источника (при остановке бота)."""
+
+
+class HttpWorldStateProvider(WorldStateProvider):
+    """Публичное API состояния мира (по умолчанию api.warframestat.us)."""
+    def __init__(self, url: str):
+        self.url = url
+        self._session = None
+
+    async def fetch_arbitration(self) -> Optional[ArbitrationNode]:
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(timeout=ClientTimeout(total=WORLDSTATE_FETCH_TIMEOUT))
+        async with self._session.get(self.url) as response:
+            response.raise_for_status()
+            return parse_arbitration(await response.json(content_type=None))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class FileWorldStateProvider(WorldStateProvider):
+    """Локальная замена API: JSON-файл того же формата. Нужен для работы без сети и для бенчмарка."""
+    def __init__(self, path: str):
+        self.path = path
+
+    def _read(self) -> Optional[ArbitrationNode]:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return parse_arbitration(json.load(f))
+
+    async def fetch_arbitration(self) -> Optional[ArbitrationNode]:
+        return await asyncio.to_thread(self._read)
+
+
+WORLDSTATE_REFRESHES = METRICS.counter('lfg_worldstate_refreshes_total', "Обновления состояния мира по результату.", ('result',))
+
+
+class WorldStateCache:
+    """
+    Кэш текущей карты Арбитража поверх WorldStateProvider.
+    Чтение (current_arbitration) синхронное и никогда не ждет сеть: свежее значение
+    отдается как есть, устаревшее (старше WORLDSTATE_TTL) тоже отдается, но запускает
+    фоновое обновление. Одновременно идет не больше одного обновления; после ошибки
+    источник не опрашивается WORLDSTATE_RETRY секунд. Значение после ротации
+    (или без ротации — старше WORLDSTATE_MAX_STALE) не отдается вовсе.
+    """
+
+    def __init__(self, provider: Optional[WorldStateProvider]):
+        self.provider = provider
+        self._value: Optional[ArbitrationNode] = None
+        self._fetched_at = 0.0
+        self._retry_at = 0.0
+        self._refresh = None
+        self._ok = WORLDSTATE_REFRESHES.labels('ok')
+        self._error = WORLDSTATE_REFRESHES.labels('error')
+
+    def _usable(self, now: float) -> bool:
+        if self._value is None:
+            return False
+        if self._value.expiry is not None:
+            return now < self._value.expiry
+        return now - self._fetched_at < WORLDSTATE_MAX_STALE
+
+    def current_arbitration(self) -> Optional[MapEntry]:
+        """Карта текущего Арбитража или None (источник выключен, недоступен или карты нет в каталоге)."""
+        if self.provider is None:
+            return None
+        now = time.time()
+        expired = self._value is not None and self._value.expiry is not None and now >= self._value.expiry
+        if expired or now - self._fetched_at >= WORLDSTATE_TTL:
+            self.refresh_soon()
+        return resolve_arbitration_map(self._value.node) if self._usable(now) else None
+
+    def refresh_soon(self):
+        """Запускает фоновое обновление, если оно еще не идет и источник не в паузе после ошибки."""
+        if self.provider is None or (self._refresh and not self._refresh.done()) or time.time() < self._retry_at:
+            return
+        self._refresh = asyncio.ensure_future(self._do_refresh())
+
+    async def _do_refresh(self):
+        try:
+            value = await self.provider.fetch_arbitration()
+        except Exception as e:
+            self._error.inc()
+            self._retry_at = time.time() + WORLDSTATE_RETRY
+            print(f"⚠️ Не удалось получить состояние мира: {e}")
+            return
+        self._ok.inc()
+        self._value = value
+        self._fetched_at = time.time()
+
+    async def close(self):
+        if self._refresh and not self._refresh.done():
+            self._refresh.cancel()
+        if self.provider is not None:
+            await self.provider.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "node": self._value.node if self._value else None,
+            "age_s": round(time.time() - self._fetched_at, 1) if self._fetched_at else None,
+            "refreshes": self._ok.value,
+            "errors": self._error.value,
+        }
+
+
+def _world_state_provider() -> Optional[WorldStateProvider]:
+    if WORLDSTATE_FILE:
+        return FileWorldStateProvider(WORLDSTATE_FILE)
+    if WORLDSTATE_URL:
+        return HttpWorldStateProvider(WORLDSTATE_URL)
+    return None
+
+
+WORLD_STATE = WorldStateCache(_world_state_provider())
+
+
+# =================================================================
+# АРБИТРАЖ, КАСКАД, МОДАЛЬНЫЕ ОКНА И VIEW-КОНТЕЙНЕРЫ
+# =================================================================
+
+async def open_ticket(bot, interaction: discord.Interaction, mission: MissionDescriptor, initiator: discord.Member,
+                      role_name: str, comment: Optional[str]):
+    """
+    Общее создание тикета для всех миссий: создатель занимает role_name, тикет публикуется
+    с пингом роли миссии. Возвращает канал LFG или None, если он не настроен (игроку уже ответили).
+    Взаимодействие подтверждается (defer) до публикации: снятие старого тикета и отправка
+    нового в очереди REST могут занять больше 3 секунд, отведенных Discord на ответ.
+    Итог вызывающий сообщает через edit_original_response или followup.
+    """
+    if SHUTDOWN.draining:
+        await interaction.response.send_message(RESTART_NOTICE, ephemeral=True)
+        return None
+    config = GUILD_CONFIGS.get(interaction.guild_id)
+    lfg_channel_id = config.get('LFG_CHANNEL_ID')
+    # Канал мог быть удален или недоступен боту — тогда его нет в кэше
+    lfg_channel = bot.get_channel(lfg_channel_id) if lfg_channel_id else None
+    if lfg_channel is None:
+        await interaction.response.send_message("❌ Канал поиска пати не настроен! Используйте `!set_lfg`.", ephemeral=True)
+        return None
+
+    ticket = PartyTicket(
+        bot,
+        mission,
+        SlotTable(mission_slots(mission), {role_name: initiator.id}),
+        TicketUser(initiator.id, initiator.display_name),
+        None,
+        comment=comment,
+        channel_id=lfg_channel.id,
+        guild_id=lfg_channel.guild.id
+    )
+
+    role_id = ticket_ping_role(config, mission)
+    role_mention = f"<@&{role_id}>" if role_id else ""
+    map_text = f" | Карта: **{mission.map.title}**" if mission.map else ""
+
+    with SHUTDOWN.admitted():
+        await interaction.response.defer()
+        # Пингуем роль миссии и упоминаем создателя
+        await publish_ticket(
+            ticket,
+            lfg_channel,
+            f"{role_mention} | Пати на **{mission.spec.title}** ищет игроков! Создатель: {initiator.mention}{map_text}"
+        )
+    return lfg_channel
+
+
+class RoleSelect(discord.ui.Select):
+    """Dropdown для выбора первой роли инициатора."""
+    def __init__(self, bot, mission: MissionDescriptor, initiator: discord.Member):
+        self.bot = bot
+        self.mission = mission
+        self.initiator = initiator
+
+        options = [
+            discord.SelectOption(label=role, value=role)
+            for role in mission_slots(mission)
+        ]
+
+        super().__init__(placeholder="Займите свой первый слот...", options=options, row=0)
+
+    @timed_callback('RoleSelect')
+    async def callback(self, interaction: discord.Interaction):
+        selected_role = interaction.data['values'][0]
+        comment = getattr(self.view, 'comment_text', None)
+
+        lfg_channel = await open_ticket(self.bot, interaction, self.mission, self.initiator, selected_role, comment)
+        if lfg_channel is None:
+            return
+
+        await interaction.edit_original_response(
+            content=f"🎉 **Тикет создан!** Вы заняли слот **{selected_role}**. Комментарий: {comment or 'Нет'}. Проверьте канал {lfg_channel.mention} и ждите других игроков.",
+            view=None
+        )
+
+
+class TierSelect(discord.ui.Select):
+    """Dropdown для выбора конкретной карты внутри выбранного Тира (Шаг 2)."""
+
+    def __init__(self, bot, catalog: MissionCatalog, map_tier: str, initiator: discord.Member):
+        self.bot = bot
+        self.catalog = catalog # снимок каталога, по которому построено меню
+        self.map_tier = map_tier
+        self.initiator = initiator
+
+        map_options = catalog.maps_by_tier.get(map_tier, ())
+
+        options = []
+        for item in map_options:
+            label = f"{item.name} {item.faction} ({item.mission})"
+            options.append(discord.SelectOption(label=label, value=item.key))
+
+        super().__init__(placeholder=f"Выберите карту в {map_tier}...", options=options, row=0)
+
+    @timed_callback('TierSelect')
+    async def callback(self, interaction: discord.Interaction):
+        map_id_string = interaction.data['values'][0] # e.g., "S-ТИР|Casta"
+        mission = self.catalog.missions_by_key[f"{MISSION_ARBITRATION}:{map_id_string}"]
+
+        await interaction.response.edit_message(
+            content=f"✅ Вы выбрали карту **{mission.map.name}**.\n\n⏳ **Шаг 3: Займите свой стартовый слот (и добавьте коммент):**",
+            view=RoleSelectView(self.bot, mission, self.initiator)
+        )
+
+class MapSelect(discord.ui.Select):
+    """Dropdown для выбора Тира карты (Шаг 1)."""
+    def __init__(self, bot, initiator: discord.Member):
+        self.bot = bot
+        self.initiator = initiator
+        self.catalog = MISSIONS.current
+        options = [
+            discord.SelectOption(label=self.catalog.tiers[tier].label, value=tier, emoji=self.catalog.tiers[tier].emoji)
+            for tier in self.catalog.maps_by_tier
+        ]
+        super().__init__(placeholder="Выберите Тир карты...", options=options)
+
+    @timed_callback('MapSelect')
+    async def callback(self, interaction: discord.Interaction):
+        selected_tier = interaction.data['values'][0]
+
+        await interaction.response.edit_message(
+            content=f"✅ Вы выбрали **{selected_tier}**.\n\n⏳ **Шаг 2: Выберите название карты:**",
+            view=TierSelectView(self.bot, self.catalog, selected_tier, self.initiator)
+        )
+
+# =================================================================
+# МИССИИ БЕЗ ВЫБОРА СЛОТА (КАСКАД И ДР.)
+# =================================================================
+
+class MissionStartView(discord.ui.View):
+    """Упрощенный View для создания пати на миссию с pick_slot = false (Каскад). Автоматически занимает первый слот."""
+    def __init__(self, bot, mission: MissionDescriptor, initiator: discord.Member):
+        super().__init__(timeout=600)
+        self.bot = bot
+        self.mission = mission
+        self.comment_text = None
+        self.initiator = initiator # Сохраняем инициатора для кнопки запуска
+
+    @discord.ui.button(label="Создать пати 🚀", style=discord.ButtonStyle.success, row=0, custom_id="mission_start_btn")
+    @timed_callback('MissionStartView.start_party')
+    async def start_party_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Логика создания тикета: автоматически занимает первый слот."""
+        selected_role = mission_slots(self.mission)[0]
+
+        lfg_channel = await open_ticket(self.bot, interaction, self.mission, self.initiator, selected_role, self.comment_text)
+        if lfg_channel is None:
+            return
+
+        await interaction.followup.send(
+            f"🎉 **Тикет создан!** Вы заняли слот **{selected_role}** (Комм.: {self.comment_text if self.comment_text else 'Нет'}). Проверьте канал {lfg_channel.mention} и ждите других игроков.",
+            ephemeral=True
+        )
+
+    @discord.ui.button(label="Добавить коммент 📝", style=discord.ButtonStyle.secondary, row=1)
+    async def add_comment_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        modal = CommentModal(view=self)
+        await interaction.response.send_modal(modal)
+
+# =================================================================
+# МОДАЛЬНЫЕ ОКНА
+# =================================================================
+
+def submitted_text(interaction: discord.Interaction, text_input: discord.ui.TextInput) -> str:
+    """
+    Текст поля модального окна прямо из данных взаимодействия — одинаково для шлюза
+    и HTTP-режима, где окно не проходит через диспетчер discord.py.
+    """
+    for row in interaction.data.get('components', ()):
+        for component in row.get('components') or [row.get('component') or row]:
+            if component.get('custom_id') == text_input.custom_id:
+                return component.get('value') or ''
+    return ''
+
+
+class CommentModal(discord.ui.Modal, title='Добавить комментарий к тикету'):
+    """Модальное окно для ввода комментария."""
+
+    comment_input = discord.ui.TextInput(
+        label='Ваш комментарий (до 100 символов)',
+        style=discord.TextStyle.short,
+        placeholder='Например: +Каскад, Нужен хил, 4x60 и т.д.',
+        required=False,
+        max_length=100,
+    )
+
+    def __init__(self, view: discord.ui.View):
+        super().__init__()
+        self.view = view
+
+    @timed_callback('CommentModal')
+    async def on_submit(self, interaction: discord.Interaction):
+        comment = submitted_text(interaction, self.comment_input)
+        self.view.comment_text = comment
+
+        comment_display = f"✅ **Комментарий добавлен:** *{comment}*" if comment else "Комментарий удален."
+
+        # Разделяем контент по двойному переводу строки, чтобы не дублировать старый коммент
+        current_content = interaction.message.content.split('\n\n')[0]
+
+        await interaction.response.edit_message(
+            content=f"{current_content}\n\n{comment_display}",
+            view=self.view
+        )
+
+# =================================================================
+# VIEW-КОНТЕЙНЕРЫ (С НОВЫМ ПОЛЕМ comment_text)
+# =================================================================
+
+class TierSelectView(discord.ui.View):
+    """View-контейнер для TierSelect."""
+    def __init__(self, bot, catalog: MissionCatalog, map_tier: str, initiator: discord.Member):
+        super().__init__(timeout=600)
+        self.bot = bot
+        self.add_item(TierSelect(bot, catalog, map_tier, initiator))
+
+class RoleSelectView(discord.ui.View):
+    """View-контейнер для RoleSelect. С allow_other_map (карта подставлена из состояния мира) есть возврат к выбору тира."""
+    def __init__(self, bot, mission: MissionDescriptor, initiator: discord.Member, allow_other_map: bool = False):
+        super().__init__(timeout=600)
+        self.bot = bot
+        self.mission = mission
+        self.initiator = initiator
+        self.comment_text = None
+
+        self.add_item(RoleSelect(bot, mission, initiator))
+        if allow_other_map:
+            other_map = discord.ui.Button(label="Другая карта 🗺️", style=discord.ButtonStyle.secondary, row=1)
+            other_map.callback = self._choose_other_map
+            self.add_item(other_map)
+
+    async def _choose_other_map(self, interaction: discord.Interaction):
+        await interaction.response.edit_message(
+            content="⏳ **Шаг 1: Выберите Тир текущей карты Арбитража:**",
+            view=MapSelectView(self.bot, self.initiator)
+        )
+
+    @discord.ui.button(label="Добавить коммент 📝", style=discord.ButtonStyle.secondary, row=1)
+    async def add_comment_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        modal = CommentModal(view=self)
+        await interaction.response.send_modal(modal)
+
+
+class MapSelectView(discord.ui.View):
+    """View-контейнер для MapSelect."""
+    def __init__(self, bot, initiator: discord.Member):
+        super().__init__(timeout=600)
+        self.bot = bot
+        self.add_item(MapSelect(bot, initiator))
+
+
+class MatchmakingView(discord.ui.View):
+    """Выбор миссии и ролей для очереди авто-подбора."""
+    def __init__(self, bot, initiator: discord.Member):
+        super().__init__(timeout=600)
+        self.bot = bot
+        self.initiator = initiator
+        self.catalog = MISSIONS.current
+        self.mission = None
+        arbitration_slots = self.catalog.missions[MISSION_ARBITRATION].slots
+        self.roles = list(arbitration_slots)
+
+        # Сначала миссии без карт, затем карты Арбитража; в меню Discord не больше 25 пунктов
+        missions = sorted(self.catalog.missions_by_key.values(), key=lambda mission: mission.map is not None)
+        mission_select = discord.ui.Select(
+            placeholder="Выберите миссию...",
+            options=[
+                discord.SelectOption(label=mission.title, value=mission.key, emoji=None if mission.map else mission.spec.emoji)
+                for mission in missions[:25]
+            ],
+            row=0
+        )
+        mission_select.callback = self._select_mission
+        self.add_item(mission_select)
+
+        role_select = discord.ui.Select(
+            placeholder="Какие роли вы готовы занять (для Арбитража)...",
+            options=[discord.SelectOption(label=role, value=role) for role in arbitration_slots],
+            min_values=1,
+            max_values=len(arbitration_slots),
+            row=1
+        )
+        role_select.callback = self._select_roles
+        self.add_item(role_select)
+
+    async def _select_mission(self, interaction: discord.Interaction):
+        self.mission = self.catalog.missions_by_key.get(interaction.data['values'][0])
+        await interaction.response.defer()
+
+    async def _select_roles(self, interaction: discord.Interaction):
+        self.roles = interaction.data['values']
+        await interaction.response.defer()
+
+    @discord.ui.button(label="Встать в очередь 🎯", style=discord.ButtonStyle.success, row=2)
+    @timed_callback('MatchmakingView.enqueue')
+    async def enqueue_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.mission is None:
+            return await interaction.response.send_message("❌ Сначала выберите миссию.", ephemeral=True)
+        if SHUTDOWN.draining:
+            return await interaction.response.send_message(RESTART_NOTICE, ephemeral=True)
+
+        player = TicketUser(interaction.user.id, interaction.user.display_name)
+        picked = MATCHMAKER.enqueue(interaction.guild_id, player, self.mission, self.roles)
+        # Новая запись может собрать пати и без нажавшего: порядок заполнения ролей зависит от длины куч
+        my_role = next((role for role, entry in (picked or {}).items() if entry.user.id == player.id), None)
+        if my_role is None:
+            waiting = MATCHMAKER.queued(interaction.guild_id, self.mission)
+            await interaction.response.edit_message(
+                content=f"⏳ Вы в очереди авто-подбора. Игроков в очереди на эту миссию: **{waiting}**. Пати будет объявлена в канале поиска.",
+                view=self
+            )
+        else:
+            await interaction.response.edit_message(content=f"🎉 **Пати собрана!** Ваша роль: **{my_role}**.", view=None)
+        if picked is not None:
+            await announce_match(self.bot, interaction.guild_id, self.mission, picked)
+
+    @discord.ui.button(label="Выйти из очереди", style=discord.ButtonStyle.secondary, row=2)
+    async def dequeue_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if MATCHMAKER.dequeue(interaction.guild_id, interaction.user.id):
+            await interaction.response.edit_message(content="Вы вышли из очереди авто-подбора.", view=None)
+        else:
+            await interaction.response.send_message("Вы не стоите в очереди авто-подбора.", ephemeral=True)
+
+
+async def send_mission_start(bot, interaction: discord.Interaction, mission: MissionDescriptor, edit: bool = False):
+    """Первый шаг создания тикета миссии: выбор тира карты, выбор слота или сразу кнопка «Создать пати»."""
+    if mission.kind == MISSION_ARBITRATION:
+        content, view = "⏳ **Шаг 1: Выберите Тир текущей карты Арбитража:**", MapSelectView(bot, interaction.user)
+    elif mission.spec.pick_slot:
+        content, view = f"⏳ **Пати на {mission.spec.title}.** Займите свой стартовый слот (и добавьте коммент):", RoleSelectView(bot, mission, interaction.user)
+    else:
+        content, view = f"⏳ **Настройка пати на {mission.spec.title}.**\n\nНажмите **'Создать пати'** или сначала добавьте комментарий:", MissionStartView(bot, mission, interaction.user)
+
+    if edit:
+        await interaction.response.edit_message(content=content, view=view)
+    else:
+        await interaction.response.send_message(content, view=view, ephemeral=True)
+
+
+class MissionPickView(discord.ui.View):
+    """Выбор любой миссии из каталога (в том числе добавленных без перезапуска бота)."""
+    def __init__(self, bot, initiator: discord.Member):
+        super().__init__(timeout=600)
+        self.bot = bot
+        self.catalog = MISSIONS.current
+        mission_select = discord.ui.Select(
+            placeholder="Выберите миссию...",
+            options=[
+                discord.SelectOption(label=spec.title, value=spec.kind, emoji=spec.emoji)
+                for spec in list(self.catalog.missions.values())[:25]
+            ],
+            row=0
+        )
+        mission_select.callback = self._select_mission
+        self.add_item(mission_select)
+
+    async def _select_mission(self, interaction: discord.Interaction):
+        mission = self.catalog.mission(interaction.data['values'][0])
+        await send_mission_start(self.bot, interaction, mission, edit=True)
+
+
+@functools.lru_cache(maxsize=4)
+def _filter_terms(catalog: MissionCatalog) -> Dict[str, Tuple[str, str]]:
+    """Слова фильтра !lfg для каталога: «арбитраж», «s», «s-тир», «casta», «гринир» -> (поле TicketFilter, значение)."""
+    terms = {}
+    for spec in catalog.missions.values():
+        terms[spec.kind] = terms[spec.title.lower()] = ('kind', spec.kind)
+    for tier, maps in catalog.maps_by_tier.items():
+        terms[tier.lower()] = terms[tier.split('-')[0].lower()] = ('tier', tier)
+        for map_entry in maps:
+            terms[map_entry.name.lower()] = ('map_name', map_entry.name)
+            terms[map_entry.faction.lower()] = ('faction', map_entry.faction)
+    return terms
+
+
+def parse_ticket_filter(raw: Optional[str]) -> Tuple[TicketFilter, list]:
+    """
+    Фильтр из того, что ввел игрок: миссия, тир, карта (в том числе из нескольких слов),
+    фракция и число — минимум свободных мест. Возвращает фильтр и нераспознанные слова.
+    """
+    terms = _filter_terms(MISSIONS.current)
+    ticket_filter = TicketFilter()
+    unknown = []
+    words = (raw or '').replace(',', ' ').split()
+    position = 0
+    while position < len(words):
+        for length in (3, 2, 1):
+            phrase = ' '.join(words[position:position + length]).lower()
+            if position + length <= len(words) and phrase in terms:
+                field, value = terms[phrase]
+                setattr(ticket_filter, field, value)
+                position += length
+                break
+        else:
+            word = words[position]
+            if word.isdigit() and 1 <= int(word) <= MAX_TICKET_SLOTS:
+                ticket_filter.min_free = int(word)
+            elif word.lower() not in ('list', 'список'):
+                unknown.append(word)
+            position += 1
+    return ticket_filter, unknown
+
+
+class TicketBrowserView(discord.ui.View):
+    """Постраничный список !lfg. Каждая страница заново берется из TICKET_INDEX, поэтому список не устаревает."""
+    def __init__(self, guild_id: int, ticket_filter: TicketFilter):
+        super().__init__(timeout=600)
+        self.guild_id = guild_id
+        self.ticket_filter = ticket_filter
+        self.page = 0
+
+    def render(self) -> discord.Embed:
+        total, tickets, self.page = browse_tickets(self.guild_id, self.ticket_filter, self.page)
+        pages = max(1, -(-total // LFG_PAGE_SIZE))
+        lines = []
+        for ticket in tickets:
+            link = f"https://discord.com/channels/{ticket.guild_id}/{ticket.channel_id}/{ticket.message_id}"
+            lines.append(
+                f"**[{ticket.mission.title}]({link})** — свободно {ticket.slots.free} из {len(ticket.slot_names)} · "
+                f"{ticket.initiator.display_name} · удаление <t:{int(ticket.expires_at)}:R>"
+            )
+
+        embed = discord.Embed(
+            title=f"🔎 Открытые пати: {self.ticket_filter.describe()}",
+            description="\n".join(lines) or "Сейчас нет открытых пати с такими условиями. Создайте свою в канале навигации!",
+            color=discord.Color.dark_red()
+        )
+        embed.set_footer(text=f"Страница {self.page + 1} из {pages} · Всего пати: {total}")
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page + 1 >= pages
+        return embed
+
+    @discord.ui.button(label="◀ Назад", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Вперед ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+
+class MainNavigationView(discord.ui.View):
+    """Главный View для канала навигации, содержит кнопки выбора миссий."""
+    def __init__(self, bot):
+        super().__init__(timeout=None)
+        self.bot = bot
+
+    @discord.ui.button(label="Найти пати: АРБИТРАЖ", style=discord.ButtonStyle.green, custom_id="arbitrage_start", row=0)
+    @timed_callback('MainNavigationView.arbitrage')
+    async def arbitrage_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+
+        if not GUILD_CONFIGS.get(interaction.guild_id).get('LFG_CHANNEL_ID'):
+            return await interaction.response.send_message("❌ Канал поиска пати не настроен. Попросите администратора использовать `!set_lfg`.", ephemeral=True)
+
+        # Карта текущего Арбитража известна — сразу к выбору слота, минуя два шага
+        live_map = WORLD_STATE.current_arbitration()
+        live_mission = MISSIONS.current.missions_by_key.get(f"{MISSION_ARBITRATION}:{live_map.key}") if live_map else None
+        if live_mission:
+            return await interaction.response.send_message(
+                f"🌍 Сейчас на Арбитраже: **{live_map.title}**.\n\n⏳ **Займите свой стартовый слот (и добавьте коммент)** или выберите другую карту:",
+                view=RoleSelectView(self.bot, live_mission, interaction.user, allow_other_map=True),
+                ephemeral=True
+            )
+
+        await send_mission_start(self.bot, interaction, MISSIONS.current.mission(MISSION_ARBITRATION))
+
+    @discord.ui.button(label="Найти пати: КАСКАД", style=discord.ButtonStyle.blurple, custom_id="cascade_start", row=0)
+    @timed_callback('MainNavigationView.cascade')
+    async def cascade_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+
+        if not GUILD_CONFIGS.get(interaction.guild_id).get('LFG_CHANNEL_ID'):
+            return await interaction.response.send_message("❌ Канал поиска пати не настроен. Попросите администратора использовать `!set_lfg`.", ephemeral=True)
+
+        await send_mission_start(self.bot, interaction, MISSIONS.current.mission(MISSION_CASCADE))
+
+    @discord.ui.button(label="Авто-подбор 🎯", style=discord.ButtonStyle.secondary, custom_id="matchmaking_start", row=1)
+    @timed_callback('MainNavigationView.matchmaking')
+    async def matchmaking_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+
+        if not GUILD_CONFIGS.get(interaction.guild_id).get('LFG_CHANNEL_ID'):
+            return await interaction.response.send_message("❌ Канал поиска пати не настроен. Попросите администратора использовать `!set_lfg`.", ephemeral=True)
+
+        await interaction.response.send_message(
+            "🎯 **Авто-подбор.** Выберите миссию и роли, затем встаньте в очередь — бот сам соберет полную пати:",
+            view=MatchmakingView(self.bot, interaction.user),
+            ephemeral=True
+        )
+
+    @discord.ui.button(label="Другие миссии 📜", style=discord.ButtonStyle.secondary, custom_id="missions_more", row=1)
+    @timed_callback('MainNavigationView.missions')
+    async def missions_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+
+        if not GUILD_CONFIGS.get(interaction.guild_id).get('LFG_CHANNEL_ID'):
+            return await interaction.response.send_message("❌ Канал поиска пати не настроен. Попросите администратора использовать `!set_lfg`.", ephemeral=True)
+
+        await interaction.response.send_message(
+            "📜 **Выберите миссию** (список берется из каталога миссий):",
+            view=MissionPickView(self.bot, interaction.user),
+            ephemeral=True
+        )
+
+# =================================================================
+# 5. АДМИНИСТРАТИВНЫЕ КОМАНДЫ ДЛЯ НАСТРОЙКИ
+# =================================================================
+
+requires_admin = commands.has_permissions(manage_guild=True)
+guild_only = commands.guild_only()
+
+def admin_command(name: str, description: str):
+    """
+    Регистрирует админскую команду и как `!префиксную`, и как слэш-команду.
+    Слэш-вариант нужен для LEAN_MODE, где бот не читает текст сообщений;
+    в списке команд Discord он виден только участникам с правом «Управлять сервером».
+    """
+    def decorator(func):
+        func = app_commands.default_permissions(manage_guild=True)(func)
+        func = app_commands.guild_only()(func)
+        func = guild_only(requires_admin(func))
+        return bot.hybrid_command(name=name, description=description)(func)
+    return decorator
+
+
+@admin_command('set_nav', "Установить канал навигации и отправить стартовое окно")
+async def set_nav_channel(ctx, channel: discord.TextChannel):
+    """
+    [ИСПРАВЛЕНО] Устанавливает канал навигации и отправляет стартовое сообщение
+    только по команде, а не при каждом запуске.
+    """
+    await ctx.defer()
+    config_store = GUILD_CONFIGS.store(ctx.guild.id)
+
+    # 1. Проверяем и удаляем старое сообщение (если оно было в этом канале)
+    async for message in channel.history(limit=5):
+        if message.author.id == ctx.bot.user.id and message.embeds:
+            embed_title = message.embeds[0].title
+            if embed_title and "СИСТЕМА ПОДБОРА ПАТИ WARFRAME" in embed_title:
+                try:
+                    await message.delete()
+                    await ctx.send(f"⚠️ Старое сообщение навигации в канале {channel.mention} удалено.")
+                except Exception:
+                    pass
+
+    # 2. Сохраняем ID канала в конфигурацию
+    config_store.data['NAV_CHANNEL_ID'] = channel.id
+    config_store.mark_dirty()
+
+    # 3. Отправляем новое сообщение навигации с кнопками
+    embed = discord.Embed(
+        title="⬇️ СИСТЕМА ПОДБОРА ПАТИ WARFRAME ⬇️",
+        description="Нажмите кнопку, чтобы начать сбор группы для миссий **Арбитраж** или **Каскад**.",
+        color=discord.Color.dark_red()
+    )
+
+    if NAV_IMAGE_URL:
+        embed.set_image(url=NAV_IMAGE_URL)
+
+    embed.set_footer(text="Автоматическое удаление тикетов через 1 час (требуется !set_lfg).")
+
+    await channel.send(
+        embed=embed,
+        view=MainNavigationView(ctx.bot)
+    )
+
+    await ctx.send(f"✅ Канал навигации установлен и стартовое окно отправлено: {channel.mention}.")
+
+
+@admin_command('set_lfg', "Установить канал, куда публикуются тикеты")
+async def set_lfg_channel(ctx, channel: discord.TextChannel):
+    config_store = GUILD_CONFIGS.store(ctx.guild.id)
+    config_store.data['LFG_CHANNEL_ID'] = channel.id
+    config_store.mark_dirty()
+    await ctx.send(f"✅ Канал поиска пати установлен: {channel.mention}. ID сохранен.")
+
+@admin_command('set_role', "Установить роль для пинга Арбитража")
+async def set_arbitrage_role(ctx, role: discord.Role):
+    config_store = GUILD_CONFIGS.store(ctx.guild.id)
+    config_store.data['ARBITRAGE_ROLE_ID'] = role.id
+    config_store.mark_dirty()
+    await ctx.send(f"✅ Роль для пинга Арбитража установлена: {role.mention}. ID сохранен.")
+
+@admin_command('set_cascade_role', "Установить роль для пинга Каскада")
+async def set_cascade_role(ctx, role: discord.Role):
+    config_store = GUILD_CONFIGS.store(ctx.guild.id)
+    config_store.data['CASCAD_ROLE_ID'] = role.id
+    config_store.mark_dirty()
+    await ctx.send(f"✅ Роль для пинга Каскада установлена: {role.mention}. ID сохранен.")
+
+@admin_command('set_map_role', "Установить роль для пинга конкретной карты Арбитража")
+async def set_map_role(ctx, map_name: str, role: discord.Role):
+    """Устанавливает роль для пинга конкретной карты Арбитража."""
+    config_store = GUILD_CONFIGS.store(ctx.guild.id)
+
+    map_entry = MISSIONS.current.map_by_name.get(map_name.lower())
+
+    if not map_entry:
+        await ctx.send(f"❌ Карта с именем **{map_name.capitalize()}** не найдена в списке карт Арбитража. Проверьте правильность написания.")
+        return
+
+    formatted_map_name = map_entry.name
+
+    config_store.data['MAP_ROLES'][formatted_map_name] = role.id
+    config_store.mark_dirty()
+    await ctx.send(f"✅ Роль для карты **{formatted_map_name}** установлена: {role.mention}. ID сохранен.")
+
+
+@admin_command('reload_missions', "Перечитать каталог миссий (слоты, карты, цвета) без перезапуска")
+async def reload_missions(ctx):
+    """Каталог и так перечитывается при изменении файла; команда нужна, чтобы сразу увидеть ошибку проверки."""
+    error = MISSIONS.reload()
+    if error:
+        await ctx.send(f"❌ Каталог миссий не принят, работает прежний: `{error}`")
+        return
+    catalog = MISSIONS.current
+    await ctx.send(f"✅ Каталог миссий перезагружен: миссий **{len(catalog.missions)}**, карт **{len(catalog.map_catalog)}**. Открытые тикеты не затронуты.")
+
+
+@admin_command('sweep_lfg', "Сверить канал поиска пати с базой и удалить мертвые тикеты")
+async def sweep_lfg(ctx):
+    """Внеочередная сверка канала LFG этого сервера (обычно она идет при запуске и каждые SWEEP_INTERVAL)."""
+    lfg_channel_id = GUILD_CONFIGS.get(ctx.guild.id).get('LFG_CHANNEL_ID')
+    lfg_channel = ctx.bot.get_channel(lfg_channel_id) if lfg_channel_id else None
+    if lfg_channel is None:
+        await ctx.send("❌ Канал поиска пати не настроен! Используйте `!set_lfg`.")
+        return
+    await ctx.defer()
+    report = await SWEEPER.sweep_channel(lfg_channel)
+    await ctx.send(f"🧹 Сверка {lfg_channel.mention}: {report}.")
+
+
+# --- Подписки игроков (доступны всем участникам) ---
+
+def user_command(name: str, description: str):
+    """Регистрирует пользовательскую команду и как `!префиксную`, и как слэш-команду (только на сервере)."""
+    def decorator(func):
+        func = app_commands.guild_only()(func)
+        return bot.hybrid_command(name=name, description=description)(guild_only(func))
+    return decorator
+
+
+@user_command('subscribe', "Получать в личные сообщения новые пати по карте, тиру или миссии")
+async def subscribe(ctx, *, target: str):
+    """Подписка на карту (`Casta`), тир (`S` / `S-ТИР`), весь Арбитраж (`арбитраж`) или Каскад (`каскад`)."""
+    parsed = parse_topic(target)
+    if not parsed:
+        await ctx.send("❌ Не понял, на что подписаться. Укажите карту (`Casta`), тир (`S`), `арбитраж` или `каскад`.", ephemeral=True)
+        return
+
+    topic, label = parsed
+    SUBSCRIPTIONS.subscribe(ctx.guild.id, ctx.author.id, topic)
+    await ctx.send(f"🔔 Подписка оформлена: **{label}**. Новые пати придут в личные сообщения.", ephemeral=True)
+
+
+@user_command('unsubscribe', "Отписаться от уведомлений по карте, тиру или миссии")
+async def unsubscribe(ctx, *, target: str):
+    parsed = parse_topic(target)
+    if not parsed or not SUBSCRIPTIONS.unsubscribe(ctx.guild.id, ctx.author.id, parsed[0]):
+        await ctx.send("❌ Такой подписки нет. Список подписок: `!subscriptions`.", ephemeral=True)
+        return
+    await ctx.send(f"🔕 Подписка отменена: **{parsed[1]}**.", ephemeral=True)
+
+
+@user_command('subscriptions', "Показать ваши подписки на новые пати")
+async def list_subscriptions(ctx):
+    topics = SUBSCRIPTIONS.topics_of(ctx.guild.id, ctx.author.id)
+    if not topics:
+        await ctx.send("У вас нет подписок. Пример: `!subscribe Casta` или `!subscribe S`.", ephemeral=True)
+        return
+    # Тема хранится как «вид:значение»; для карты значение — «тир|название»
+    lines = [f"• `{topic.split(':', 1)[1].replace('|', ' | ')}`" for topic in sorted(topics)]
+    await ctx.send("🔔 Ваши подписки:\n" + "\n".join(lines), ephemeral=True)
+
+
+@bot.hybrid_group(name='lfg', description="Открытые пати на сервере: миссия, тир, карта, фракция, свободные места", fallback='list')
+@guild_only
+@app_commands.guild_only()
+async def lfg_list(ctx, *, filters: Optional[str] = None):
+    """`!lfg`, `!lfg S Гринир`, `!lfg Outer Terminus 2` (число — минимум свободных мест); слэш-вариант — `/lfg list`."""
+    ticket_filter, unknown = parse_ticket_filter(filters)
+    if unknown:
+        await ctx.send(
+            f"❌ Не понял: `{' '.join(unknown)}`. Фильтры: миссия (`арбитраж`, `каскад`), тир (`S`), карта (`Casta`), "
+            "фракция (`Гринир`) и число свободных мест (`2`).",
+            ephemeral=True
+        )
+        return
+    view = TicketBrowserView(ctx.guild.id, ticket_filter)
+    await ctx.send(embed=view.render(), view=view, ephemeral=True)
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, commands.HybridCommandError):
+        error = error.original
+    if isinstance(error, (commands.MissingPermissions, app_commands.MissingPermissions)):
+        await ctx.send("❌ У вас нет прав `Управлять сервером` для выполнения этой команды.")
+    elif isinstance(error, commands.BadArgument):
+        await ctx.send("❌ Неверный аргумент. Укажите канал или роль, например: `!set_nav #канал` или `!set_map_role Casta @роль`.")
+    else:
+        print(f"Ошибка в команде: {error}")
+
+# =================================================================
+# РЕЖИМ HTTP-ВЗАИМОДЕЙСТВИЙ (INTERACTIONS_MODE=http)
+# =================================================================
+
+def parse_ticket_custom_id(custom_id: str, message_id: int) -> Optional[Tuple[int, str, Optional[int], Optional[str]]]:
+    """(id тикета, действие, номер слота, роль из старого custom_id) для кнопки тикета или None."""
+    match = TicketButton.__discord_ui_compiled_template__.fullmatch(custom_id)
+    if match:
+        slot = match['slot']
+        return int(match['ticket']) if match['ticket'] else message_id, match['action'], int(slot) if slot is not None else None, None
+    match = LegacyTicketButton.__discord_ui_compiled_template__.fullmatch(custom_id)
+    if match:
+        return message_id, match['action'] or TicketButton.JOIN, None, match['role']
+    return None
+
+
+class DiscordRestClient:
+    """
+    Минимальный REST-клиент воркера: вебхуки взаимодействий (токен из самого
+    взаимодействия) и отправка сообщений от имени бота. Подключения к шлюзу нет.
+    """
+
+    def __init__(self, session: ClientSession):
+        self.session = session
+
+    async def request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None, bot_auth: bool = False):
+        """Выполняет запрос с повтором после 429. 404 (сообщение удалено, токен истек) не считается ошибкой."""
+        headers = {"Authorization": f"Bot {BOT_TOKEN}"} if bot_auth else {}
+        for _ in range(3):
+            async with self.session.request(method, DISCORD_API_BASE + path, json=payload, headers=headers) as response:
+                if response.status == 429:
+                    retry_after = (await response.json(content_type=None) or {}).get('retry_after', 1)
+                    await asyncio.sleep(float(retry_after))
+                    continue
+                if response.status >= 400 and response.status != 404:
+                    print(f"Ошибка REST {method} {path.split('/')[1]}: {response.status} {await response.text()}")
+                return None if response.status in (204, 404) else await response.json(content_type=None)
+
+    async def send_dm(self, user_id: int, content: str) -> bool:
+        """Личное сообщение от имени бота; False — ЛС закрыты или аккаунта нет."""
+        channel = await self.request('POST', "/users/@me/channels", {"recipient_id": str(user_id)}, bot_auth=True)
+        if not channel or 'id' not in channel:
+            return False
+        message = await self.request('POST', f"/channels/{channel['id']}/messages", {"content": content}, bot_auth=True)
+        return bool(message and 'id' in message)
+
+
+class RestChannel:
+    """Канал по id для воркера: только то, что нужно PartyTicket при полном сборе."""
+
+    def __init__(self, api: DiscordRestClient, channel_id: int):
+        self.api = api
+        self.id = channel_id
+        self.mention = f"<#{channel_id}>"
+
+    async def send(self, content: str, embed: Optional[discord.Embed] = None):
+        payload = {"content": content}
+        if embed is not None:
+            payload["embeds"] = [embed.to_dict()]
+        return await self.api.request('POST', f"/channels/{self.id}/messages", payload, bot_auth=True)
+
+
+class InteractionMessage:
+    """Сообщение с нажатой кнопкой: удаляется через вебхук взаимодействия (@original)."""
+    __slots__ = ('interaction', 'id', 'content')
+
+    def __init__(self, interaction: 'WebhookInteraction', message_id: int, content: str = ''):
+        self.interaction = interaction
+        self.id = message_id
+        self.content = content
+
+    async def delete(self):
+        await self.interaction.api.request('DELETE', f"{self.interaction.webhook_path}/messages/@original")
+
+
+class InteractionFollowup:
+    """followup.send(): сообщение игроку через вебхук взаимодействия."""
+    __slots__ = ('interaction',)
+
+    def __init__(self, interaction: 'WebhookInteraction'):
+        self.interaction = interaction
+
+    async def send(self, content: str, ephemeral: bool = False):
+        payload = {"content": content}
+        if ephemeral:
+            payload["flags"] = discord.MessageFlags(ephemeral=True).value
+        await self.interaction.api.request('POST', self.interaction.webhook_path, payload)
+
+
+def payload_user(payload: Dict[str, Any]) -> TicketUser:
+    """Автор взаимодействия из HTTP-запроса: ник на сервере, глобальное имя или логин."""
+    member = payload.get('member') or {}
+    user = member.get('user') or payload['user']
+    return TicketUser(int(user['id']), member.get('nick') or user.get('global_name') or user['username'])
+
+
+class WebhookInteraction:
+    """
+    Взаимодействие из HTTP-запроса в воркере с тем же интерфейсом, которым пользуются
+    PartyTicket и EmbedRenderQueue: user, channel, message.delete(), followup.send()
+    и edit_original_response(). Нажатие уже подтверждено (DEFERRED_UPDATE_MESSAGE) в ответе на POST.
+    """
+
+    def __init__(self, api: DiscordRestClient, payload: Dict[str, Any]):
+        self.api = api
+        self.id = int(payload['id'])
+        self.guild_id = int(payload['guild_id']) if payload.get('guild_id') else None
+        self.channel_id = int(payload['channel_id'])
+        self.webhook_path = f"/webhooks/{payload['application_id']}/{payload['token']}"
+        self.user = payload_user(payload)
+        self.channel = RestChannel(api, self.channel_id)
+        self.message = InteractionMessage(self, int(payload['message']['id']))
+        self.followup = InteractionFollowup(self)
+
+    async def edit_original_response(self, embed: Optional[discord.Embed] = None, view: Optional[discord.ui.View] = None):
+        payload = {}
+        if embed is not None:
+            payload["embeds"] = [embed.to_dict()]
+        if view is not None:
+            payload["components"] = view.to_components()
+        await self.api.request('PATCH', f"{self.webhook_path}/messages/@original", payload)
+
+
+_UNCHANGED = object()  # поле сообщения не меняется (в отличие от None — «убрать»)
+
+
+def _message_data(content=_UNCHANGED, embed: Optional[discord.Embed] = None, view=_UNCHANGED, ephemeral: bool = False) -> Dict[str, Any]:
+    data = {}
+    if content is not _UNCHANGED:
+        data["content"] = content
+    if embed is not None:
+        data["embeds"] = [embed.to_dict()]
+    if view is not _UNCHANGED:
+        data["components"] = view.to_components() if view is not None else []
+    if ephemeral:
+        data["flags"] = discord.MessageFlags(ephemeral=True).value
+    return data
+
+
+class LocalInteractionResponse:
+    """
+    interaction.response для меню навигации в HTTP-режиме. Первый ответ обработчика
+    становится телом ответа на POST (initial). Если обработчик не ответил за
+    INTERACTION_LOCAL_BUDGET, на POST уходит отложенный ответ (deferred), а дальнейшие
+    send_message и edit_message завершают взаимодействие через его вебхук.
+    """
+
+    def __init__(self, interaction: 'LocalInteraction'):
+        self.interaction = interaction
+        self.initial = asyncio.get_running_loop().create_future()
+        self._deferred_type = None
+
+    def is_done(self) -> bool:
+        return self.initial.done()
+
+    def _answer(self, body: Dict[str, Any]) -> bool:
+        """Отдает body на POST. False — POST уже отвечен, ответ пойдет через вебхук."""
+        if self.initial.done():
+            return False
+        self.initial.set_result(body)
+        return True
+
+    def deferred(self) -> Dict[str, Any]:
+        """
+        Отложенный ответ: для кнопок, меню и окон на сообщении — «обновлю сообщение позже»
+        (тип 6), для команд — «бот думает...» в эфемерном сообщении (тип 5).
+        """
+        if self.interaction.message is not None:
+            body = {"type": discord.InteractionResponseType.deferred_message_update.value}
+        else:
+            body = {
+                "type": discord.InteractionResponseType.deferred_channel_message.value,
+                "data": {"flags": discord.MessageFlags(ephemeral=True).value},
+            }
+        self._answer(body)
+        self._deferred_type = body["type"]
+        return body
+
+    async def defer(self, **kwargs):
+        if not self.initial.done():
+            self.deferred()
+
+    async def send_message(self, content: Optional[str] = None, *, embed: Optional[discord.Embed] = None,
+                           view: Optional[discord.ui.View] = None, ephemeral: bool = False):
+        self.interaction.router.track(view)
+        data = _message_data(content, embed, view if view is not None else _UNCHANGED, ephemeral)
+        if self._answer({"type": discord.InteractionResponseType.channel_message.value, "data": data}):
+            return
+        if self._deferred_type == discord.InteractionResponseType.deferred_channel_message.value:
+            await self.interaction.api.request('PATCH', f"{self.interaction.webhook_path}/messages/@original", data)
+        else:
+            await self.interaction.api.request('POST', self.interaction.webhook_path, data)
+
+    async def edit_message(self, *, content=_UNCHANGED, embed: Optional[discord.Embed] = None, view=_UNCHANGED):
+        self.interaction.router.track(view)
+        data = _message_data(content, embed, view)
+        if not self._answer({"type": discord.InteractionResponseType.message_update.value, "data": data}):
+            await self.interaction.api.request('PATCH', f"{self.interaction.webhook_path}/messages/@original", data)
+
+    async def send_modal(self, modal: discord.ui.Modal):
+        self.interaction.router.track(modal)
+        if not self._answer({"type": discord.InteractionResponseType.modal.value, "data": modal.to_dict()}):
+            # Окно можно открыть только первым ответом, а на POST уже ушел отложенный
+            await self.interaction.followup.send("⏳ Бот не успел открыть окно, нажмите кнопку еще раз.", ephemeral=True)
+
+
+class LocalInteraction:
+    """
+    Нажатие в меню навигации, выбор в списке, отправка модального окна или команда
+    из HTTP-запроса в основном процессе. Атрибуты — те, которыми пользуются обработчики
+    View: user, guild_id, data, message, response, followup, edit_original_response.
+    Внутреннее состояние discord.py не нужно.
+    """
+
+    def __init__(self, api: DiscordRestClient, payload: Dict[str, Any], router: 'LocalComponentRouter'):
+        self.api = api
+        self.router = router
+        self.id = int(payload['id'])
+        self.type = payload['type']
+        self.data = payload.get('data') or {}
+        self.guild_id = int(payload['guild_id']) if payload.get('guild_id') else None
+        self.channel_id = int(payload['channel_id']) if payload.get('channel_id') else None
+        self.webhook_path = f"/webhooks/{payload['application_id']}/{payload['token']}"
+        self.user = payload_user(payload)
+        message = payload.get('message')
+        self.message = InteractionMessage(self, int(message['id']), message.get('content', '')) if message else None
+        self.response = LocalInteractionResponse(self)
+        self.followup = InteractionFollowup(self)
+
+    async def edit_original_response(self, *, content=_UNCHANGED, embed: Optional[discord.Embed] = None, view=_UNCHANGED):
+        self.router.track(view)
+        await self.api.request('PATCH', f"{self.webhook_path}/messages/@original", _message_data(content, embed, view))
+
+
+class LocalComponentRouter:
+    """
+    Диспетчер меню навигации в HTTP-режиме вместо диспетчера discord.py, который
+    принимает взаимодействия только со шлюза. Постоянные View (кнопки канала навигации)
+    берутся из bot.persistent_views; эфемерные View и модальные окна запоминаются по
+    custom_id при отправке и живут свой timeout (не дольше токена взаимодействия).
+    """
+
+    def __init__(self):
+        self._targets: Dict[str, Tuple[float, Any]] = {}  # custom_id -> (срок по time.monotonic(), элемент или окно)
+        self._prune_at = 1024
+
+    def track(self, item):
+        if item is None or item is _UNCHANGED:
+            return
+        expires_at = time.monotonic() + min(item.timeout or INTERACTION_TOKEN_TTL, INTERACTION_TOKEN_TTL)
+        if isinstance(item, discord.ui.Modal):
+            self._targets[item.custom_id] = (expires_at, item)
+        else:
+            for child in item.children:
+                if getattr(child, 'custom_id', None):
+                    self._targets[child.custom_id] = (expires_at, child)
+        if len(self._targets) >= self._prune_at:
+            now = time.monotonic()
+            self._targets = {custom_id: target for custom_id, target in self._targets.items() if target[0] > now}
+            self._prune_at = max(1024, len(self._targets) * 2)
+
+    def find(self, custom_id: str):
+        target = self._targets.get(custom_id)
+        if target is not None and target[0] > time.monotonic():
+            return target[1]
+        for view in bot.persistent_views:
+            for child in view.children:
+                if getattr(child, 'custom_id', None) == custom_id:
+                    return child
+        return None
+
+    async def dispatch(self, interaction: LocalInteraction):
+        if interaction.type == discord.InteractionType.application_command.value:
+            return await interaction.response.send_message(HTTP_COMMANDS_NOTICE, ephemeral=True)
+
+        target = self.find(interaction.data.get('custom_id', ''))
+        if target is None:
+            return await interaction.response.send_message(
+                "⌛ Это меню устарело. Откройте его заново кнопкой в канале навигации.", ephemeral=True
+            )
+        if interaction.type == discord.InteractionType.modal_submit.value:
+            await target.on_submit(interaction)
+        else:
+            await target.callback(interaction)
+
+
+HTTP_COMMANDS_NOTICE = "⚠️ Бот принимает взаимодействия по HTTP: слэш-команды недоступны, используйте команды с префиксом `!` (например, `!lfg`)."
+
+
+class InteractionWorker:
+    """
+    Процесс-воркер HTTP-режима. Между нажатиями ничего не хранит: тикет каждый раз
+    читается из общей базы TICKETS_DB, а ответы и правки идут через вебхук взаимодействия.
+    Нажатия одного тикета всегда попадают в один и тот же воркер (id тикета % число
+    воркеров) и выполняются по очереди через Mailbox, как в режиме шлюза.
+    """
+
+    def __init__(self, queue, worker_id: int):
+        self.queue = queue
+        self.worker_id = worker_id
+        self._mailboxes: Dict[int, Mailbox] = {}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        asyncio.ensure_future(MISSIONS.run()) # каталог миссий перечитывается и в воркерах
+        async with ClientSession(timeout=ClientTimeout(total=INTERACTION_REST_TIMEOUT)) as session:
+            self.api = DiscordRestClient(session)
+            NOTIFIER.rest = self.api
+            print(f"⚙️ Воркер взаимодействий {self.worker_id} запущен (pid {os.getpid()}).")
+            while True:
+                body = await loop.run_in_executor(None, self.queue.get)
+                if body is None:
+                    break
+                payload = json.loads(body)
+                ticket_id, action, slot_index, legacy_role = parse_ticket_custom_id(payload['data']['custom_id'], int(payload['message']['id']))
+                mailbox = self._mailboxes.setdefault(ticket_id, Mailbox())
+                future = mailbox.ask(functools.partial(self.handle, payload, ticket_id, action, slot_index, legacy_role))
+                future.add_done_callback(functools.partial(self._finished, ticket_id, mailbox))
+
+            # Остановка (HttpInteractions.drain): доделываем принятые нажатия и отложенные правки
+            while any(not mailbox.idle for mailbox in self._mailboxes.values()):
+                await asyncio.sleep(0.05)
+            await RENDER_QUEUE.flush_all()
+            await REST.drain(INTERACTION_REST_TIMEOUT)
+            await NOTIFIER.flush(INTERACTION_REST_TIMEOUT)
+
+    def _finished(self, ticket_id: int, mailbox: Mailbox, future: asyncio.Future):
+        if future.exception():
+            print(f"Ошибка обработки нажатия тикета {ticket_id}: {future.exception()}")
+        if mailbox.idle and self._mailboxes.get(ticket_id) is mailbox:
+            del self._mailboxes[ticket_id]
+
+    async def handle(self, payload: Dict[str, Any], ticket_id: int, action: str, slot_index: Optional[int], legacy_role: Optional[str]):
+        interaction = WebhookInteraction(self.api, payload)
+        row = TICKET_STORE.get(ticket_id)
+        ticket = ticket_from_row(row, row['guild_id']) if row else None
+        if ticket is None:
+            return await interaction.followup.send("Этот тикет уже закрыт или истек.", ephemeral=True)
+        if legacy_role is not None and legacy_role in ticket.slot_names:
+            slot_index = ticket.slot_names.index(legacy_role)
+        await apply_ticket_action(ticket, interaction, action, slot_index)
+
+
+def run_interaction_worker(queue, worker_id: int):
+    """Точка входа процесса-воркера (multiprocessing, метод запуска spawn)."""
+    try:
+        asyncio.run(InteractionWorker(queue, worker_id).run())
+    except KeyboardInterrupt:
+        pass
+
+
+INTERACTION_REQUESTS = METRICS.counter('lfg_http_interactions_total', "Взаимодействия, принятые HTTP-эндпоинтом, по результату.", ('result',))
+
+
+class HttpInteractions:
+    """
+    Прием взаимодействий POST-запросами на /interactions вместо шлюза.
+    Подпись Ed25519 проверяется по DISCORD_PUBLIC_KEY. Нажатия кнопок тикетов сразу
+    подтверждаются ответом на POST и через локальные очереди уходят в INTERACTION_WORKERS
+    процессов-воркеров. Навигация, меню и модальные окна обрабатываются в этом процессе
+    через LocalComponentRouter: первый ответ обработчика уходит телом ответа на POST,
+    а медленный обработчик получает отложенный ответ и завершает взаимодействие через вебхук.
+    """
+
+    def __init__(self):
+        self.verify_key = None
+        self._queues = []
+        self._processes = []
+        self._context = None
+        self._router = LocalComponentRouter()
+        self._session = None
+        self._api = None
+        self._local_tasks = set()
+        self._results = {
+            result: INTERACTION_REQUESTS.labels(result)
+            for result in ('forwarded', 'local', 'deferred', 'ping', 'bad_signature', 'overloaded', 'restarting')
+        }
+
+    def start(self):
+        if VerifyKey is None:
+            raise RuntimeError("Для INTERACTIONS_MODE=http нужен PyNaCl (pip install PyNaCl).")
+        if not DISCORD_PUBLIC_KEY:
+            raise RuntimeError("Для INTERACTIONS_MODE=http нужна переменная DISCORD_PUBLIC_KEY.")
+        if TICKETS_DB == ':memory:':
+            raise RuntimeError("Воркерам нужна общая база тикетов: TICKETS_DB не может быть :memory:.")
+        self.verify_key = VerifyKey(bytes.fromhex(DISCORD_PUBLIC_KEY))
+        self._context = multiprocessing.get_context('spawn')
+        for worker_id in range(INTERACTION_WORKERS):
+            self._queues.append(self._context.Queue(maxsize=INTERACTION_QUEUE_LIMIT))
+            self._processes.append(None)
+            self._spawn(worker_id)
+
+    def _spawn(self, worker_id: int):
+        process = self._context.Process(
+            target=run_interaction_worker, args=(self._queues[worker_id], worker_id), name=f"lfg-worker-{worker_id}", daemon=True
+        )
+        process.start()
+        self._processes[worker_id] = process
+
+    def stop(self):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+
+    async def drain(self, deadline: float):
+        """
+        Плавная остановка воркеров: каждый получает метку конца очереди, дорабатывает
+        принятые нажатия и выходит. Кто не успел к сроку (time.monotonic()), завершается принудительно.
+        """
+        loop = asyncio.get_running_loop()
+        for worker_queue in self._queues:
+            try:
+                await loop.run_in_executor(None, worker_queue.put, None, True, max(0.1, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        if self._local_tasks:
+            await asyncio.wait(self._local_tasks, timeout=max(0.0, deadline - time.monotonic()))
+        for process in self._processes:
+            if process is not None:
+                await loop.run_in_executor(None, process.join, max(0.0, deadline - time.monotonic()))
+        self.stop()
+        if self._session is not None:
+            await self._session.close()
+
+    def verify(self, headers, body: bytes) -> bool:
+        signature = headers.get('X-Signature-Ed25519', '')
+        timestamp = headers.get('X-Signature-Timestamp', '')
+        try:
+            if abs(time.time() - int(timestamp)) > INTERACTION_MAX_SKEW:
+                return False
+            self.verify_key.verify(timestamp.encode() + body, bytes.fromhex(signature))
+        except (ValueError, BadSignatureError):
+            return False
+        return True
+
+    async def handle(self, request):
+        body = await request.read()
+        if not self.verify(request.headers, body):
+            self._results['bad_signature'].inc()
+            return web.Response(status=401, text="invalid request signature")
+
+        payload = json.loads(body)
+        if payload['type'] == discord.InteractionType.ping.value:
+            self._results['ping'].inc()
+            return web.json_response({"type": discord.InteractionResponseType.pong.value})
+
+        if not SHUTDOWN.serving:
+            # Процесс еще ждет передачи работы или уже останавливается
+            self._results['restarting'].inc()
+            return web.json_response({
+                "type": discord.InteractionResponseType.channel_message.value,
+                "data": {"content": RESTART_NOTICE, "flags": discord.MessageFlags(ephemeral=True).value},
+            })
+
+        if payload['type'] == discord.InteractionType.autocomplete.value:
+            return web.json_response({"type": discord.InteractionResponseType.autocomplete_result.value, "data": {"choices": []}})
+
+        parsed = None
+        if payload['type'] == discord.InteractionType.component.value:
+            parsed = parse_ticket_custom_id(payload['data']['custom_id'], int(payload['message']['id']))
+        if parsed is None:
+            return web.json_response(await self._handle_local(payload))
+
+        worker_id = parsed[0] % len(self._queues)
+        if not self._processes[worker_id].is_alive():
+            print(f"⚠️ Воркер взаимодействий {worker_id} завершился, перезапускаем.")
+            self._spawn(worker_id)
+        try:
+            self._queues[worker_id].put_nowait(body)
+        except queue.Full:
+            self._results['overloaded'].inc()
+            return web.json_response({
+                "type": discord.InteractionResponseType.channel_message.value,
+                "data": {"content": "⏳ Бот перегружен, попробуйте нажать еще раз.", "flags": discord.MessageFlags(ephemeral=True).value},
+            })
+        self._results['forwarded'].inc()
+        return web.json_response({"type": discord.InteractionResponseType.deferred_message_update.value})
+
+    async def _handle_local(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Меню навигации в этом процессе. Ждем первый ответ обработчика не дольше
+        INTERACTION_LOCAL_BUDGET; иначе на POST уходит отложенный ответ, а обработчик
+        доделывает работу в фоне и отвечает через вебхук взаимодействия.
+        """
+        if self._api is None:
+            self._session = ClientSession(timeout=ClientTimeout(total=INTERACTION_REST_TIMEOUT))
+            self._api = DiscordRestClient(self._session)
+        interaction = LocalInteraction(self._api, payload, self._router)
+        task = asyncio.ensure_future(self._router.dispatch(interaction))
+        self._local_tasks.add(task)
+        task.add_done_callback(self._local_finished)
+        await asyncio.wait({interaction.response.initial, task}, timeout=INTERACTION_LOCAL_BUDGET, return_when=asyncio.FIRST_COMPLETED)
+        if interaction.response.is_done():
+            self._results['local'].inc()
+            return interaction.response.initial.result()
+        self._results['deferred'].inc()
+        return interaction.response.deferred()
+
+    def _local_finished(self, task: asyncio.Future):
+        self._local_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"Ошибка обработки взаимодействия меню: {task.exception()!r}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": INTERACTIONS_MODE,
+            "workers_alive": sum(1 for process in self._processes if process is not None and process.is_alive()),
+            **{result: counter.value for result, counter in self._results.items()},
+        }
+
+
+INTERACTIONS = HttpInteractions()
+
+
+# =================================================================
+# ПЛАВНЫЙ ПЕРЕЗАПУСК (SIGTERM) И ПЕРЕДАЧА РАБОТЫ НОВОМУ ПРОЦЕССУ
+# =================================================================
+
+RESTART_NOTICE = "🔄 Бот перезапускается. Повторите действие через несколько секунд."
+
+
+class GracefulShutdown:
+    """
+    Плавная остановка при деплое. Процесс, обслуживающий серверы, держит аренду в базе
+    тикетов (продлевает ее каждые HANDOFF_HEARTBEAT секунд); новый процесс поднимает
+    веб-сервер сразу, а к Discord подключается, только когда прежний отпустит аренду.
+    По SIGTERM прежний процесс перестает принимать новые тикеты и нажатия, дожидается
+    начатых действий, отправляет отложенные правки и удаления, записывает настройки
+    и очередь авто-подбора, отпускает аренду и только потом закрывает соединения.
+    Тикеты уже лежат в базе, поэтому новый процесс подхватывает их кнопки в on_ready.
+    """
+
+    def __init__(self, store: TicketStore):
+        self.store = store
+        self.scope = f"shards:{','.join(map(str, SHARD_IDS))}" if SHARD_IDS else "shards:all"
+        self.owner = f"{os.uname().nodename}:{os.getpid()}"
+        self.serving = False
+        self.draining = False
+        self.runners = []       # веб-серверы aiohttp, которые закрываются последними
+        self._services = None   # asyncio.gather всех служб процесса (main)
+        self._drain_task = None
+        self._admitted = 0      # действия, прошедшие проверку draining, но еще не попавшие в Mailbox
+
+    def install(self, services: asyncio.Future):
+        """Перехватывает SIGTERM/SIGINT: вместо мгновенного выхода — плавная остановка."""
+        self._services = services
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.request_stop)
+
+    def request_stop(self):
+        if self._drain_task is None:
+            self._drain_task = asyncio.ensure_future(self.drain())
+
+    async def acquire(self):
+        """Ждет, пока прежний процесс отпустит аренду (или перестанет ее продлевать), и забирает ее."""
+        deadline = time.monotonic() + HANDOFF_WAIT
+        announced = False
+        while True:
+            if self.draining:
+                # SIGTERM пришел раньше, чем дошла очередь: аренду не берем
+                return
+            lease = self.store.lease(self.scope)
+            if lease is None or lease['released'] or lease['owner'] == self.owner:
+                break
+            if time.time() - lease['heartbeat_at'] > HANDOFF_HEARTBEAT * 3:
+                print(f"⚠️ Процесс {lease['owner']} перестал продлевать аренду, забираю ее.")
+                break
+            if time.monotonic() >= deadline:
+                print(f"⚠️ Процесс {lease['owner']} не передал работу за {HANDOFF_WAIT} с, забираю аренду принудительно.")
+                break
+            if not announced:
+                print(f"⏳ Жду, пока процесс {lease['owner']} передаст работу...")
+                announced = True
+            await asyncio.sleep(0.2)
+        self.store.take_lease(self.scope, self.owner)
+        self.serving = True
+
+    async def run(self):
+        """Продлевает аренду. Если ее забрал другой процесс, этот останавливается."""
+        while self.serving:
+            await asyncio.sleep(HANDOFF_HEARTBEAT)
+            if self.serving and not self.store.renew_lease(self.scope, self.owner):
+                print("⚠️ Аренду забрал другой процесс: останавливаюсь.")
+                self.request_stop()
+                return
+
+    @contextlib.contextmanager
+    def admitted(self):
+        """
+        Действие уже прошло проверку draining, но ждет ответа Discord (defer), прежде чем
+        встать в Mailbox. drain() ждет и такие действия, иначе они выполнились бы после передачи работы.
+        """
+        self._admitted += 1
+        try:
+            yield
+        finally:
+            self._admitted -= 1
+
+    def _actions_pending(self) -> bool:
+        return (
+            self._admitted > 0
+            or any(ticket.busy for ticket in EXPIRY.tickets.values())
+            or any(not mailbox.idle for mailbox in CREATION_MAILBOXES.values())
+        )
+
+    async def drain(self):
+        started = time.perf_counter()
+        deadline = time.monotonic() + SHUTDOWN_GRACE
+        self.draining = True
+        print("🛑 Остановка: новые тикеты и нажатия не принимаются, завершаю начатые действия.")
+
+        # 1. Начатые действия с тикетами доходят до конца вместе со своими REST-вызовами
+        while self._actions_pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if INTERACTIONS_MODE == 'http':
+            await INTERACTIONS.drain(deadline)
+
+        # 2. Отложенная работа: правки тикетов, удаления, настройки, очередь авто-подбора
+        await RENDER_QUEUE.flush_all()
+        if not await REST.drain(max(0.0, deadline - time.monotonic())):
+            print("⚠️ Не все REST-запросы успели выполниться до остановки.")
+        await GUILD_CONFIGS.flush_all()
+        queued = MATCHMAKER.snapshot()
+        self.store.save_matchmaking(queued)
+        self.store.checkpoint()
+
+        # 3. Состояние в базе: новый процесс может подключаться к Discord
+        if self.serving:
+            self.store.release_lease(self.scope, self.owner)
+            self.serving = False
+        print(
+            f"💾 Работа передана: тикетов {len(EXPIRY.tickets)}, игроков в очереди авто-подбора {len(queued)}, "
+            f"за {time.perf_counter() - started:.2f} с."
+        )
+
+        # 4. Соединения закрываются последними
+        NOTIFIER.stop()
+        await WORLD_STATE.close()
+        for runner in self.runners:
+            await runner.cleanup()
+        await bot.close()
+        if self._services is not None:
+            self._services.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"owner": self.owner, "serving": self.serving, "draining": self.draining}
+
+
+SHUTDOWN = GracefulShutdown(TICKET_STORE)
+
+
+# =================================================================
+# 6. ЗАПУСК БОТА (ФИНАЛЬНАЯ ВЕРСИЯ С KEEP-ALIVE)
+# =================================================================
+
+_tickets_restored = False
+_UNPLACED_TICKETS: set = set() # id тикетов старых записей (без guild_id), чей канал еще не появился в кэше
+
+def ticket_from_row(row: sqlite3.Row, guild_id: int) -> Optional['PartyTicket']:
+    """PartyTicket из записи TicketStore; None, если миссии больше нет в каталоге."""
+    mission = mission_from_stored(row['map_info'])
+    if mission is None:
+        return None
+    return PartyTicket(
+        bot,
+        mission,
+        TicketStore.load_slots(row['slots'], json.loads(row['slot_names']), row['waitlist']),
+        TicketUser(row['initiator_id'], row['initiator_name']),
+        row['message_id'],
+        comment=row['comment'],
+        channel_id=row['channel_id'],
+        created_at=row['created_at'],
+        guild_id=guild_id
+    )
+
+
+def restore_tickets() -> int:
+    """
+    Восстанавливает все открытые тикеты одним проходом по базе:
+    PartyTicket попадает в реестр EXPIRY, кнопки обслуживает TicketButton — без запросов к Discord.
+    Тикеты, истекшие во время простоя, сразу уходят в ExpiryScheduler на пакетное удаление.
+    Тикеты серверов, которые обслуживают другие процессы (шарды), не трогаются.
+    Канал в кэше не нужен: сервер может быть временно недоступен, а удаление
+    по истечении работает и через PartialMessageable.
+    """
+    now = time.time()
+    return sum(_restore_row(row, now) for row in TICKET_STORE.load_all())
+
+
+def restore_unplaced_tickets() -> int:
+    """Повторная попытка для старых записей без guild_id, когда их сервер стал доступен."""
+    now = time.time()
+    restored = 0
+    for message_id in list(_UNPLACED_TICKETS):
+        row = TICKET_STORE.get(message_id)
+        if row is None:
+            _UNPLACED_TICKETS.discard(message_id)
+            continue
+        restored += _restore_row(row, now)
+    return restored
+
+
+def _restore_row(row: sqlite3.Row, now: float) -> bool:
+    """Ставит тикет из записи в реестр EXPIRY; True — тикет открыт и восстановлен."""
+    if row['message_id'] in EXPIRY.tickets:
+        return False
+    if row['guild_id'] and not owns_guild(row['guild_id']):
+        return False
+
+    guild_id = row['guild_id']
+    if not guild_id:
+        channel = bot.get_channel(row['channel_id'])
+        if channel is None:
+            # Без guild_id тикет не к чему привязать; запись остается в базе до on_guild_available
+            _UNPLACED_TICKETS.add(row['message_id'])
+            return False
+        guild_id = channel.guild.id
+    _UNPLACED_TICKETS.discard(row['message_id'])
+
+    ticket = ticket_from_row(row, guild_id)
+    if ticket is None:
+        TICKET_STORE.delete(row['message_id'])
+        return False
+
+    EXPIRY.schedule(ticket)
+    if row['expires_at'] <= now:
+        return False
+
+    ACTIVE_TICKETS[(ticket.guild_id, ticket.initiator.id)] = row['message_id']
+    return True
+
+
+def restore_matchmaking() -> int:
+    """Возвращает в очередь авто-подбора игроков, переданных прежним процессом при перезапуске."""
+    taken = []
+    for row in TICKET_STORE.load_matchmaking():
+        if not owns_guild(row['guild_id']):
+            continue
+        taken.append((row['guild_id'], row['user_id']))
+        mission = mission_from_stored(row['mission'])
+        if mission is None:
+            continue
+        picked = MATCHMAKER.enqueue(
+            row['guild_id'], TicketUser(row['user_id'], row['user_name']), mission, json.loads(row['roles']), row['enqueued_at']
+        )
+        if picked:
+            asyncio.ensure_future(announce_match(bot, row['guild_id'], mission, picked))
+    TICKET_STORE.delete_matchmaking(taken)
+    return len(taken)
+
+
+@bot.event
+async def on_ready():
+    """
+    [ИСПРАВЛЕНО] Теперь on_ready только регистрирует MainNavigationView,
+    чтобы обеспечить работу кнопок после перезапуска.
+    Отправка сообщения перенесена в !set_nav.
+    """
+    global _tickets_restored
+    print(f'Бот готов: {bot.user}')
+
+    # Регистрируем View для постоянных кнопок.
+    bot.add_view(MainNavigationView(bot))
+    # Кнопки тикетов: один диспетчер по шаблону custom_id вместо View на каждый тикет.
+    bot.add_dynamic_items(TicketButton, LegacyTicketButton)
+
+    # on_ready может вызываться повторно после переподключения — восстанавливаем тикеты один раз.
+    if not _tickets_restored:
+        _tickets_restored = True
+        started = time.perf_counter()
+        await GUILD_CONFIGS.preload(guild.id for guild in bot.guilds)
+        restored = restore_tickets()
+        queued = restore_matchmaking()
+        SUBSCRIPTIONS.load()
+        WORLD_STATE.refresh_soon()
+        print(f"♻️ Восстановлено тикетов: {restored}, игроков в очереди авто-подбора: {queued} за {time.perf_counter() - started:.3f} с.")
+
+        # Замер старта для сравнения обычного режима и LEAN_MODE
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else 0
+        print(
+            f"⏱️ До on_ready: {time.perf_counter() - _PROCESS_STARTED:.1f} с | "
+            f"Пик памяти: {rss_mb:.1f} МБ | Серверов: {len(bot.guilds)} | "
+            f"Режим: {'LEAN' if LEAN_MODE else 'обычный'}"
+        )
+
+        if SYNC_APP_COMMANDS:
+            try:
+                synced = await bot.tree.sync()
+                print(f"✅ Слэш-команды синхронизированы: {len(synced)}")
+            except discord.HTTPException as e:
+                print(f"❌ Не удалось синхронизировать слэш-команды: {e}")
+
+    print("Логика отправки навигационного сообщения перенесена в команду !set_nav.")
+
+
+@bot.event
+async def on_guild_join(guild):
+    await GUILD_CONFIGS.preload((guild.id,))
+
+
+@bot.event
+async def on_guild_available(guild):
+    """Сервер стал доступен (после сбоя или позже on_ready): восстанавливаем отложенные тикеты."""
+    if _tickets_restored and _UNPLACED_TICKETS:
+        restored = restore_unplaced_tickets()
+        if restored:
+            print(f"♻️ Сервер {guild.id} доступен: восстановлено тикетов {restored}.")
+
+
+# ----------------- Блок Веб-Сервера -----------------
+
+async def handle(request):
+    """Минимальный обработчик запроса для Render."""
+    return web.Response(text="Bot is running!")
+
+async def handle_stats(request):
+    """Счетчики внутренних очередей бота в JSON."""
+    return web.json_response({
+        "render": {
+            "edits_issued": RENDER_QUEUE.edits_issued,
+            "edits_saved": RENDER_QUEUE.edits_saved,
+            "edits_dropped": RENDER_QUEUE.edits_dropped,
+        },
+        "open_tickets": len(EXPIRY.tickets),
+        "rest": REST.stats(),
+        "matchmaking": MATCHMAKER.stats(),
+        "notifications": NOTIFIER.stats(),
+        "world_state": WORLD_STATE.stats(),
+        "missions": MISSIONS.stats(),
+        "interactions": INTERACTIONS.stats(),
+        "shutdown": SHUTDOWN.stats(),
+        "sweeper": SWEEPER.stats(),
+        "indexed_tickets": len(TICKET_INDEX),
+    })
+
+def _gauge(lines: list, name: str, help_text: str, samples: Iterable[Tuple[str, Any]], kind: str = 'gauge'):
+    """Дописывает метрику, значение которой считается в момент запроса /metrics."""
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{name}{labels} {value}")
+
+
+async def handle_metrics(request):
+    """Метрики процесса в текстовом формате Prometheus."""
+    lines = METRICS.render()
+
+    open_tickets: Dict[Tuple[str, str], int] = {}
+    for ticket in EXPIRY.tickets.values():
+        key = (ticket.mission.kind, ticket.mission.map.tier if ticket.mission.map else "")
+        open_tickets[key] = open_tickets.get(key, 0) + 1
+    _gauge(lines, 'lfg_open_tickets', "Открытые тикеты по миссиям и тирам.", (
+        (f'{{mission="{mission}",tier="{tier}"}}', count) for (mission, tier), count in open_tickets.items()
+    ))
+
+    rest = REST.stats()
+    _gauge(lines, 'lfg_rest_rate_limited_total', "Ответы 429 от Discord.", [("", rest["rate_limited"])], kind='counter')
+    _gauge(lines, 'lfg_rest_queue_depth', "Запросы, ожидающие в REST-очереди.", [("", rest["queue_depth"])])
+    _gauge(lines, 'lfg_render_edits_total', "Редактирования тикетов: выполненные, склеенные и ненужные (тикет закрыт до отправки).", [
+        ('{result="issued"}', RENDER_QUEUE.edits_issued), ('{result="saved"}', RENDER_QUEUE.edits_saved),
+        ('{result="dropped"}', RENDER_QUEUE.edits_dropped),
+    ], kind='counter')
+    _gauge(lines, 'lfg_matchmaking_queued', "Игроки в очереди авто-подбора.", [("", MATCHMAKER.stats()["queued"])])
+
+    latencies = bot.latencies if isinstance(bot, commands.AutoShardedBot) else [(0, bot.latency)]
+    _gauge(lines, 'lfg_gateway_heartbeat_seconds', "Задержка heartbeat шлюза Discord по шардам.", (
+        (f'{{shard="{shard_id}"}}', latency) for shard_id, latency in latencies if latency == latency and latency != float('inf')
+    ))
+
+    return web.Response(text="\n".join(lines) + "\n", content_type='text/plain', charset='utf-8')
+
+async def handle_profile(request):
+    """
+    /debug/profile?seconds=N — профиль живого процесса за N секунд (до 60) в формате
+    свернутых стеков. Только с токеном DEBUG_TOKEN (заголовок Authorization: Bearer
+    или параметр token); без заданного токена маршрута нет.
+    """
+    if not DEBUG_TOKEN:
+        raise web.HTTPNotFound()
+
+    auth = request.headers.get('Authorization', '')
+    token = auth[7:] if auth.startswith('Bearer ') else request.query.get('token', '')
+    if not hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode()):
+        raise web.HTTPForbidden()
+
+    try:
+        seconds = min(max(float(request.query.get('seconds', 10)), 0.1), 60.0)
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds должен быть числом")
+
+    # Сэмплер работает в потоке-исполнителе и снимает стеки потока цикла событий
+    loop = asyncio.get_running_loop()
+    counts = await loop.run_in_executor(None, sample_stacks, threading.get_ident(), seconds)
+    lines = [f"{stack} {count}" for stack, count in sorted(counts.items(), key=lambda item: -item[1])]
+    return web.Response(text="\n".join(lines) + "\n", content_type='text/plain', charset='utf-8')
+
+async def start_server():
+    """Запускает веб-сервер, который будет слушать порт, предоставленный хостом."""
+    # Render предоставляет порт через переменную окружения PORT
+    port = int(os.environ.get('PORT', 8080))
+    app = web.Application()
+    app.add_routes([web.get('/', handle), web.get('/stats', handle_stats), web.get('/metrics', handle_metrics),
+                    web.get('/debug/profile', handle_profile)])
+    if INTERACTIONS_MODE == 'http':
+        app.add_routes([web.post('/interactions', INTERACTIONS.handle)])
+
+    # Запускаем сервер
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # При деплое новый процесс слушает порт вместе с прежним, пока тот не передаст работу
+    # (SHUTDOWN.acquire); без SO_REUSEPORT bind упал бы с EADDRINUSE
+    site = web.TCPSite(runner, '0.0.0.0', port, reuse_port=hasattr(socket, 'SO_REUSEPORT'))
+
+    print(f"✅ Web server started on port {port}")
+    await site.start()
+    SHUTDOWN.runners.append(runner)
+
+# ----------------- Блок Self-Ping (Ход Конем) -----------------
+
+async def keep_alive_ping():
+    """Периодически отправляет HTTP-запрос самому себе, чтобы не дать сервису заснуть."""
+    # Переменная окружения должна быть установлена на Render
+    external_url = os.environ.get('EXTERNAL_URL')
+
+    if not external_url:
+        print("⚠️ Предупреждение: Переменная EXTERNAL_URL не установлена. Бот может заснуть.")
+        return
+
+    # Используем aiohttp для асинхронного пинга
+    async with ClientSession() as session:
+        while True:
+            # Пингуем каждые 14 минут (меньше, чем 15-минутный лимит Render)
+            await asyncio.sleep(5 * 60)
+            try:
+                # Отправляем HEAD запрос, чтобы не тратить лишний трафик
+                async with session.get(external_url) as response:
+                    print(f"📡 Self-ping OK: Status {response.status}")
+            except Exception as e:
+                print(f"❌ Ошибка при самопинге: {e}. Проверьте правильность EXTERNAL_URL.")
+
+
+# ----------------- Главная точка запуска -----------------
+
+async def serve_discord():
+    """Подключение к Discord — после того, как прежний процесс (при деплое) передаст работу."""
+    await SHUTDOWN.acquire()
+    if SHUTDOWN.draining:
+        return
+    if INTERACTIONS_MODE == 'http':
+        INTERACTIONS.start()
+        print(f"🌐 HTTP-режим взаимодействий: эндпоинт /interactions, воркеров {INTERACTION_WORKERS}.")
+        if LEAN_MODE:
+            print("⚠️ LEAN_MODE с INTERACTIONS_MODE=http: слэш-команды по HTTP не обрабатываются, а префикс ! в LEAN_MODE не работает — у бота не будет команд.")
+    await asyncio.gather(bot.start(BOT_TOKEN), SHUTDOWN.run(), SWEEPER.run())
+
+
+async def main():
+    """Запускает Discord-бота, веб-сервер и self-ping одновременно."""
+    if not BOT_TOKEN:
+        print("\n\n-- ОШИБКА ЗАПУСКА --")
+        print("Бот не был запущен, так как переменная окружения 'BOT_TOKEN' не установлена.")
+        return
+
+    # asyncio.gather запускает все задачи параллельно
+    services = asyncio.gather(
+        serve_discord(),
+        start_server(),
+        keep_alive_ping(),
+        WATCHDOG.run(),
+        MISSIONS.run()
+    )
+    SHUTDOWN.install(services)
+    try:
+        await services
+    except asyncio.CancelledError:
+        # Службы отменяет SHUTDOWN.drain(), когда состояние уже передано
+        print("Бот остановлен.")
+
+
+if __name__ == '__main__':
+    try:
+        # discord.py требует запуск через asyncio.run()
+        asyncio.run(main())
+    except discord.errors.LoginFailure:
+        print("\n\n-- ОШИБКА АВТОРИЗАЦИИ --")
+        print("Проверьте, правильно ли вы установили переменную окружения 'BOT_TOKEN'!")
+    except KeyboardInterrupt:
+        print("Бот остановлен вручную.")
+    except Exception as e:
+        print(f"Критическая ошибка при запуске: {e}")
+
+
+
+
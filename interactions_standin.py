@@ -0,0 +1,429 @@
+"""
+Локальная проверка HTTP-режима взаимодействий (INTERACTIONS_MODE=http) без Discord.
+
+Поднимает эндпоинт /interactions бота и заглушку REST API Discord, кладет тикеты
+в общую базу и отправляет на эндпоинт подписанные Ed25519 взаимодействия: PING,
+запрос с неверной подписью и пачки нажатий «Бронь» по тикетам. Нажатия
+обрабатывают настоящие процессы-воркеры; заглушка записывает их запросы
+(followup, правки и удаление сообщения, итоговые сообщения о сборе).
+Затем проходит меню навигации в основном процессе: ответ телом POST (сообщение,
+модальное окно, правка), отложенный ответ с завершением через вебхук, устаревшее
+меню, слэш-команда и автодополнение. Наконец, очереди на занятые слоты, собранные
+нажатиями в воркерах, снимаются истечением и заменой тикета в основном процессе.
+
+Запуск:  python interactions_standin.py --tickets 50 --clicks 400 [--workers 2] [--concurrency 50]
+Нужен PyNaCl (он же нужен боту в HTTP-режиме).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from aiohttp import ClientSession, web
+from nacl.signing import SigningKey
+
+GUILD_ID = 1 << 40
+CHANNEL_ID = (1 << 40) + 1
+APPLICATION_ID = (1 << 40) + 2
+_snowflakes = itertools.count(1 << 42)
+
+
+def configure(args) -> SigningKey:
+    """
+    Окружение бота задается до импорта bot_host. Процессы-воркеры запускаются
+    методом spawn и наследуют его, поэтому база тикетов у них общая с эндпоинтом.
+    """
+    signing_key = SigningKey.generate()
+    workdir = tempfile.mkdtemp(prefix='lfg-standin-')
+    os.environ['INTERACTIONS_MODE'] = 'http'
+    os.environ['DISCORD_PUBLIC_KEY'] = signing_key.verify_key.encode().hex()
+    os.environ['DISCORD_API_BASE'] = f"http://127.0.0.1:{args.api_port}"
+    os.environ['INTERACTION_WORKERS'] = str(args.workers)
+    os.environ['TICKETS_DB'] = os.path.join(workdir, 'tickets.db')
+    os.environ['GUILD_CONFIG_DIR'] = os.path.join(workdir, 'guild_configs')
+    os.environ['WORLDSTATE_URL'] = ''
+    os.environ.setdefault('BOT_TOKEN', 'standin')
+    return signing_key
+
+
+# =================================================================
+# ЗАГЛУШКА REST API DISCORD
+# =================================================================
+
+class FakeDiscordApi:
+    """Отвечает на запросы воркеров и записывает их по маршрутам и тикетам."""
+
+    def __init__(self):
+        self.routes = Counter()
+        self.events = {}  # id тикета -> список (маршрут, тело запроса)
+        self.last_request = time.perf_counter()
+
+    def _record(self, route: str, token: str, payload):
+        if token.startswith('local'):
+            route, token = f"local.{route}", ''  # меню навигации, а не нажатия тикетов
+        self.routes[route] += 1
+        self.last_request = time.perf_counter()
+        ticket_id = int(token.split('-')[0]) if token else 0
+        self.events.setdefault(ticket_id, []).append((route, payload))
+
+    async def followup(self, request):
+        self._record('followup.send', request.match_info['token'], await request.json())
+        return web.json_response({"id": str(next(_snowflakes))})
+
+    async def edit_original(self, request):
+        self._record('edit_original_response', request.match_info['token'], await request.json())
+        return web.json_response({"id": str(next(_snowflakes))})
+
+    async def delete_original(self, request):
+        self._record('message.delete', request.match_info['token'], None)
+        return web.Response(status=204)
+
+    async def channel_send(self, request):
+        assert request.headers.get('Authorization', '').startswith('Bot '), "отправка в канал без токена бота"
+        self._record('channel.send', '', await request.json())
+        return web.json_response({"id": str(next(_snowflakes))})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post('/webhooks/{application}/{token}', self.followup),
+            web.patch('/webhooks/{application}/{token}/messages/@original', self.edit_original),
+            web.delete('/webhooks/{application}/{token}/messages/@original', self.delete_original),
+            web.post('/channels/{channel}/messages', self.channel_send),
+        ])
+        return app
+
+
+async def serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+# =================================================================
+# СЦЕНАРИЙ
+# =================================================================
+
+def seed_tickets(bot_host, count: int) -> list:
+    """Тикеты Каскада в общей базе: создатель занял первый слот, остальные свободны."""
+    mission = bot_host.MISSIONS.current.mission(bot_host.MISSION_CASCADE)
+    slot_names = bot_host.mission_slots(mission)
+    tickets = []
+    for _ in range(count):
+        initiator = bot_host.TicketUser(next(_snowflakes), "Initiator")
+        ticket = bot_host.PartyTicket(
+            None, mission, bot_host.SlotTable(slot_names, {slot_names[0]: initiator.id}), initiator,
+            next(_snowflakes), channel_id=CHANNEL_ID, guild_id=GUILD_ID
+        )
+        bot_host.TICKET_STORE.save(ticket)
+        tickets.append(ticket)
+    return tickets
+
+
+def component_payload(ticket, user_id: int, slot_index: int, tokens) -> dict:
+    """Нажатие «Бронь» в формате Discord; половина кнопок — первой версии сообщения (без id тикета)."""
+    ticket_ref = ticket.message_id if slot_index % 2 else ''
+    return {
+        "id": str(next(_snowflakes)),
+        "application_id": str(APPLICATION_ID),
+        "type": 3,
+        "token": f"{ticket.message_id}-{next(tokens)}",
+        "version": 1,
+        "guild_id": str(GUILD_ID),
+        "channel_id": str(CHANNEL_ID),
+        "member": {"user": {"id": str(user_id), "username": f"tenno{user_id % 100000}"}, "nick": None},
+        "message": {"id": str(ticket.message_id)},
+        "data": {"custom_id": f"lfg:join:{ticket_ref}:{slot_index}", "component_type": 2},
+    }
+
+
+def local_payload(interaction_type: int, data: dict, tokens, message: dict = None) -> dict:
+    """Взаимодействие меню навигации (обрабатывается в основном процессе, а не воркером)."""
+    payload = {
+        "id": str(next(_snowflakes)),
+        "application_id": str(APPLICATION_ID),
+        "type": interaction_type,
+        "token": f"local-{next(tokens)}",
+        "version": 1,
+        "guild_id": str(GUILD_ID),
+        "channel_id": str(CHANNEL_ID),
+        "member": {"user": {"id": str(next(_snowflakes)), "username": "navigator"}, "nick": None},
+        "data": data,
+    }
+    if message is not None:
+        payload["message"] = message
+    return payload
+
+
+def custom_ids(components: list) -> list:
+    return [item.get('custom_id') for row in components or () for item in row.get('components', ())]
+
+
+class Signer:
+    def __init__(self, signing_key: SigningKey):
+        self.signing_key = signing_key
+
+    def headers(self, body: bytes, tamper: bool = False) -> dict:
+        timestamp = str(int(time.time()))
+        signature = self.signing_key.sign(timestamp.encode() + body).signature
+        if tamper:
+            signature = bytes([signature[0] ^ 1]) + signature[1:]
+        return {
+            "Content-Type": "application/json",
+            "X-Signature-Ed25519": signature.hex(),
+            "X-Signature-Timestamp": timestamp,
+        }
+
+
+async def post(session: ClientSession, url: str, signer: Signer, payload: dict, tamper: bool = False):
+    body = json.dumps(payload).encode()
+    started = time.perf_counter()
+    async with session.post(url, data=body, headers=signer.headers(body, tamper)) as response:
+        data = await response.json(content_type=None) if response.status == 200 else None
+        return response.status, data, time.perf_counter() - started
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def navigation_checks(bot_host, session: ClientSession, url: str, signer: Signer, api: FakeDiscordApi) -> dict:
+    """
+    Меню навигации по HTTP: кнопка Каскада отвечает эфемерным сообщением прямо в теле POST,
+    «Добавить коммент» — модальным окном, его отправка — правкой сообщения. С нулевым
+    бюджетом ответа тот же обработчик получает отложенный ответ и отвечает через вебхук.
+    """
+    navigation = bot_host.MainNavigationView(bot_host.bot)
+    bot_host.bot.add_view(navigation)
+    bot_host.GUILD_CONFIGS.store(GUILD_ID).data['LFG_CHANNEL_ID'] = CHANNEL_ID
+    tokens = itertools.count()
+    nav_message = {"id": str(next(_snowflakes)), "content": ""}
+    checks = {}
+
+    _, data, _ = await post(session, url, signer, local_payload(3, {"custom_id": "cascade_start", "component_type": 2}, tokens, nav_message))
+    menu_ids = custom_ids(data['data'].get('components')) if data and data['type'] == 4 else []
+    checks['local_message_in_body'] = "mission_start_btn" in menu_ids and bool(data['data'].get('flags'))
+
+    comment_id = next((custom_id for custom_id in menu_ids if custom_id != "mission_start_btn"), '')
+    menu_message = {"id": str(next(_snowflakes)), "content": data['data']['content'] if data else ""}
+    _, modal, _ = await post(session, url, signer, local_payload(3, {"custom_id": comment_id, "component_type": 2}, tokens, menu_message))
+    checks['local_modal_in_body'] = bool(modal) and modal['type'] == 9
+
+    input_id = custom_ids(modal['data']['components'])[0] if checks['local_modal_in_body'] else ''
+    submit = {"custom_id": modal['data']['custom_id'] if modal else '', "components": [
+        {"type": 1, "components": [{"type": 4, "custom_id": input_id, "value": "нужен хил"}]}
+    ]}
+    _, edited, _ = await post(session, url, signer, local_payload(5, submit, tokens, menu_message))
+    checks['local_modal_submit_edits'] = bool(edited) and edited['type'] == 7 and "нужен хил" in edited['data']['content']
+
+    _, stale, _ = await post(session, url, signer, local_payload(3, {"custom_id": "expired-menu", "component_type": 2}, tokens, menu_message))
+    checks['local_stale_menu_notice'] = bool(stale) and stale['type'] == 4 and "устарело" in stale['data']['content']
+
+    _, command, _ = await post(session, url, signer, local_payload(2, {"name": "lfg", "type": 1}, tokens))
+    checks['local_command_notice'] = bool(command) and command['type'] == 4
+    _, autocomplete, _ = await post(session, url, signer, local_payload(4, {"name": "lfg", "type": 1}, tokens))
+    checks['local_autocomplete'] = autocomplete == {"type": 8, "data": {"choices": []}}
+
+    # Медленный обработчик: POST получает отложенный ответ, сообщение приходит через вебхук
+    cascade = next(item for item in navigation.children if item.custom_id == "cascade_start")
+    callback, budget = cascade.callback, bot_host.INTERACTION_LOCAL_BUDGET
+
+    async def slow_callback(interaction):
+        await asyncio.sleep(0.3)
+        await callback(interaction)
+
+    cascade.callback, bot_host.INTERACTION_LOCAL_BUDGET = slow_callback, 0.1
+    try:
+        _, deferred, _ = await post(session, url, signer, local_payload(3, {"custom_id": "cascade_start", "component_type": 2}, tokens, nav_message))
+    finally:
+        cascade.callback, bot_host.INTERACTION_LOCAL_BUDGET = callback, budget
+    deadline = time.perf_counter() + 5
+    while not api.routes['local.followup.send'] and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    followup = api.events.get(0, [])
+    checks['local_deferred_in_body'] = deferred == {"type": 6}
+    checks['local_deferred_completed_by_webhook'] = any(
+        route == 'local.followup.send' and "mission_start_btn" in custom_ids(payload.get('components')) for route, payload in followup
+    )
+    return checks
+
+
+async def ended_waitlist_checks(bot_host, session: ClientSession, url: str, signer: Signer, api: FakeDiscordApi, waiters: int = 3) -> dict:
+    """
+    Очереди тикетов меняют воркеры и пишут только в общую базу. Истечение одного тикета
+    и замена другого новым тикетом создателя идут в основном процессе, где объекты тикетов
+    очередей не видели, — и все равно каждый ждущий получает сообщение о снятой очереди.
+    """
+    mission = bot_host.MISSIONS.current.mission(bot_host.MISSION_CASCADE)
+    slot_names = bot_host.mission_slots(mission)
+    tokens = itertools.count()
+    notices = []
+    deleted = []
+    bot_host.NOTIFIER.notify = lambda user_ids, content: notices.extend((user_id, content) for user_id in user_ids)
+
+    async def bulk_delete(channel, message_ids):
+        deleted.extend(message_ids)
+
+    queued = {}
+    for case in ('expiry', 'replace'):
+        initiator = bot_host.TicketUser(next(_snowflakes), "Initiator")
+        slots = bot_host.SlotTable(slot_names, {slot_names[0]: initiator.id, slot_names[1]: next(_snowflakes)})
+        ticket = bot_host.PartyTicket(None, mission, slots, initiator, next(_snowflakes), channel_id=CHANNEL_ID, guild_id=GUILD_ID)
+        bot_host.TICKET_STORE.save(ticket)
+        bot_host.EXPIRY.tickets[ticket.message_id] = ticket
+        bot_host.ACTIVE_TICKETS[(GUILD_ID, initiator.id)] = ticket.message_id
+        users = [next(_snowflakes) for _ in range(waiters)]
+        for user_id in users:
+            await post(session, url, signer, component_payload(ticket, user_id, 1, tokens))
+        queued[case] = (ticket, users)
+
+    deadline = time.perf_counter() + 10
+    answered = lambda ticket: sum(1 for route, _ in api.events.get(ticket.message_id, ()) if route == 'followup.send')
+    while any(answered(ticket) < waiters for ticket, _ in queued.values()) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+    ended = lambda: Counter(user_id for user_id, content in notices if content.startswith("⌛"))
+    bulk_delete_messages, bot_host.bulk_delete_messages = bot_host.bulk_delete_messages, bulk_delete
+    try:
+        ticket, users = queued['expiry']
+        await bot_host.EXPIRY._expire([bot_host.EXPIRY.cancel(ticket.message_id)])
+        expired = ended()
+
+        ticket, users = queued['replace']
+        lfg_channel = SimpleNamespace(id=CHANNEL_ID, guild=SimpleNamespace(id=GUILD_ID))
+        await bot_host.check_and_delete_old_ticket(ticket.initiator, lfg_channel)
+        replaced = ended() - expired
+        await asyncio.sleep(bot_host.DELETE_BATCH_WINDOW + 0.5)
+    finally:
+        bot_host.bulk_delete_messages = bulk_delete_messages
+    return {
+        'http_expiry_ends_waitlists': expired == Counter(queued['expiry'][1]),
+        'http_replace_ends_waitlists': replaced == Counter(queued['replace'][1]),
+        'http_ended_tickets_deleted': sorted(deleted) == sorted(ticket.message_id for ticket, _ in queued.values()),
+    }
+
+
+async def run(args, signing_key: SigningKey):
+    import bot_host
+
+    api = FakeDiscordApi()
+    api_runner = await serve(api.app(), args.api_port)
+    endpoint = web.Application()
+    endpoint.add_routes([web.post('/interactions', bot_host.INTERACTIONS.handle)])
+    endpoint_runner = await serve(endpoint, args.port)
+    url = f"http://127.0.0.1:{args.port}/interactions"
+
+    tickets = seed_tickets(bot_host, args.tickets)
+    await bot_host.SHUTDOWN.acquire()
+    bot_host.INTERACTIONS.start()
+    signer = Signer(signing_key)
+    checks = {}
+    try:
+        async with ClientSession() as session:
+            status, data, _ = await post(session, url, signer, {"id": "1", "application_id": str(APPLICATION_ID), "type": 1, "token": "ping", "version": 1})
+            checks['ping'] = status == 200 and data == {"type": 1}
+            status, _, _ = await post(session, url, signer, {"id": "2", "application_id": str(APPLICATION_ID), "type": 1, "token": "ping", "version": 1}, tamper=True)
+            checks['bad_signature_rejected'] = status == 401
+
+            rng = random.Random(args.seed)
+            tokens = itertools.count()
+            players = [next(_snowflakes) for _ in range(max(8, args.tickets * 2))]
+            clicks = []
+            for _ in range(args.clicks):
+                ticket = rng.choice(tickets)
+                clicks.append(component_payload(ticket, rng.choice(players), rng.randrange(1, len(ticket.slot_names)), tokens))
+
+            semaphore = asyncio.Semaphore(args.concurrency)
+            acks = Counter()
+            latencies = []
+
+            async def click(payload):
+                async with semaphore:
+                    status, data, elapsed = await post(session, url, signer, payload)
+                acks[data['type'] if data else status] += 1
+                latencies.append(elapsed)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(click(payload) for payload in clicks))
+            ack_seconds = time.perf_counter() - started
+
+            # Воркеры отвечают асинхронно: на каждое нажатие приходит ровно один followup,
+            # после него ждем отложенные правки сообщений (RENDER_DEBOUNCE)
+            deadline = time.perf_counter() + args.timeout
+            while api.routes['followup.send'] < args.clicks and time.perf_counter() < deadline:
+                await asyncio.sleep(0.1)
+            processed_seconds = time.perf_counter() - started
+            settle = max(1.0, bot_host.RENDER_DEBOUNCE * 4)
+            while time.perf_counter() - api.last_request < settle:
+                await asyncio.sleep(0.1)
+            checks.update(await navigation_checks(bot_host, session, url, signer, api))
+            # Нажатия сценария очередей отвечаются теми же followup — считаем до него
+            answered = api.routes['followup.send']
+            checks.update(await ended_waitlist_checks(bot_host, session, url, signer, api))
+        endpoint_stats = bot_host.INTERACTIONS.stats()
+    finally:
+        await bot_host.INTERACTIONS.drain(time.monotonic() + 10)
+        await endpoint_runner.cleanup()
+        await api_runner.cleanup()
+
+    # Итоговое состояние — в общей базе: закрытый тикет удален, открытый хранит слоты без дублей
+    closed = 0
+    for ticket in tickets:
+        row = bot_host.TICKET_STORE.get(ticket.message_id)
+        if row is None:
+            closed += 1
+            deleted = [route for route, _ in api.events.get(ticket.message_id, ()) if route == 'message.delete']
+            checks.setdefault('closed_tickets_deleted_once', True)
+            checks['closed_tickets_deleted_once'] &= len(deleted) == 1
+            continue
+        occupants = list(bot_host.TicketStore.load_slots(row['slots'], json.loads(row['slot_names'])).occupants())
+        checks.setdefault('no_double_booking', True)
+        checks['no_double_booking'] &= len(occupants) == len(set(occupants))
+    checks['all_clicks_answered'] = answered == args.clicks
+    checks['summaries_match_closed'] = api.routes['channel.send'] == closed
+
+    return {
+        "tickets": args.tickets,
+        "clicks": args.clicks,
+        "workers": args.workers,
+        "ack_types": dict(acks),
+        "ack_p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "ack_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "acks_per_second": round(args.clicks / ack_seconds, 1) if ack_seconds else 0.0,
+        "processed_seconds": round(processed_seconds, 3),
+        "tickets_closed": closed,
+        "rest_calls": dict(api.routes),
+        "endpoint": endpoint_stats,
+        "checks": checks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка HTTP-режима взаимодействий на заглушке Discord.")
+    parser.add_argument('--tickets', type=int, default=50)
+    parser.add_argument('--clicks', type=int, default=400)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--port', type=int, default=8790, help="порт эндпоинта /interactions")
+    parser.add_argument('--api-port', type=int, default=8791, help="порт заглушки REST API Discord")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=60, help="сколько ждать ответов воркеров (сек)")
+    args = parser.parse_args()
+
+    signing_key = configure(args)
+    report = asyncio.run(run(args, signing_key))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if all(report['checks'].values()) else 1)
+
+
+if __name__ == '__main__':
+    main()